@@ -1,4 +1,6 @@
 from django.contrib import admin
+from django.db.models import Q
+from django.utils import timezone
 from .models import * 
 
 # Register your models here.
@@ -15,5 +17,53 @@ admin.site.register(Comment)
 admin.site.register(Vote)
 admin.site.register(Like)
 admin.site.register(MasterTaskLog)
+admin.site.register(TaskLogArchive)
 admin.site.register(TeamMilestoneGrade)
-admin.site.register(PushSubscription)
+admin.site.register(PushOutbox)
+admin.site.register(NotificationPreference)
+admin.site.register(PushEvent)
+admin.site.register(PointsLedger)
+admin.site.register(GradeSnapshot)
+admin.site.register(TaskDeadline)
+admin.site.register(VoteTally)
+admin.site.register(SearchDocument)
+
+
+class PushHealthFilter(admin.SimpleListFilter):
+    title = 'delivery health'
+    parameter_name = 'health'
+
+    def lookups(self, request, model_admin):
+        return (
+            ('healthy', 'Healthy'),
+            ('backing_off', 'Backing off'),
+            ('failing', 'Failing, not backing off'),
+            ('never_delivered', 'Never delivered'),
+        )
+
+    def queryset(self, request, queryset):
+        now = timezone.now()
+        if self.value() == 'healthy':
+            return queryset.filter(failure_count=0)
+        if self.value() == 'backing_off':
+            return queryset.filter(retry_after__gt=now)
+        if self.value() == 'failing':
+            return queryset.filter(Q(retry_after__isnull=True) | Q(retry_after__lte=now), failure_count__gt=0)
+        if self.value() == 'never_delivered':
+            return queryset.filter(last_success_at__isnull=True)
+        return queryset
+
+
+@admin.register(PushSubscription)
+class PushSubscriptionAdmin(admin.ModelAdmin):
+    list_display = ('user', 'origin', 'failure_count', 'last_success_at', 'last_failure_at', 'retry_after', 'created_at')
+    list_filter = (PushHealthFilter,)
+    list_select_related = ('user',)
+    search_fields = ('user__username', 'endpoint')
+    ordering = ('-failure_count', 'pk')
+    # Shows the number of subscriptions next to each health choice
+    show_facets = admin.ShowFacets.ALWAYS
+
+    @admin.display(description='Push service')
+    def origin(self, obj):
+        return obj.endpoint.split('/')[2] if '//' in obj.endpoint else obj.endpoint
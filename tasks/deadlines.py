@@ -0,0 +1,127 @@
+import datetime
+
+from django.db import connection, transaction
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from tasks.models import MasterTask, MasterTaskLog, SearchDocument, TaskDeadline, Team
+
+REJECTED = 4
+
+REJECTION_REASONS = (
+    ("milestone", "Task is rejected because milestone is due."),
+    ("promised_date", "Task is rejected because due date has passed."),
+)
+
+
+def _overdue(mastertasks, reason, today):
+    if reason == "milestone":
+        return mastertasks.filter(milestone__due__lt=today)
+    # Rows not yet backfilled by refresh_current_tasks fall back to the latest revision
+    return mastertasks.alias(
+        promised_date=Coalesce("current_promised_date", MasterTask.latest_revision("promised_date"))
+    ).filter(promised_date__lt=today)
+
+
+def _can_return_from_update():
+    if connection.vendor == "sqlite":
+        return connection.Database.sqlite_version_info >= (3, 35)
+    return connection.vendor == "postgresql"
+
+
+def _reject(rows):
+    """Reject the tasks of ``rows`` ((pk, team_id) pairs) that are still open.
+
+    Returns the pairs of the tasks this call changed; one a concurrent run
+    rejected first is left out, so it is neither counted nor logged again.
+    """
+    if not _can_return_from_update():
+        return [
+            (pk, team_id) for pk, team_id in rows
+            if MasterTask.objects.filter(pk=pk, status__lt=REJECTED).update(status=REJECTED)
+        ]
+    quote = connection.ops.quote_name
+    table, pk_column = quote(MasterTask._meta.db_table), quote(MasterTask._meta.pk.column)
+    team_column = quote(MasterTask._meta.get_field("team").column)
+    changed = []
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), 500):
+            ids = [pk for pk, _ in rows[start:start + 500]]
+            cursor.execute(
+                f"UPDATE {table} SET status = %s WHERE status < %s AND {pk_column} IN ({', '.join(['%s'] * len(ids))}) "
+                f"RETURNING {pk_column}, {team_column}",
+                [REJECTED, REJECTED, *ids],
+            )
+            changed.extend(cursor.fetchall())
+    return changed
+
+
+def reject_overdue_tasks(today=None, mastertasks=None):
+    """Reject every open task whose milestone or promised date has passed.
+
+    Issues one UPDATE and one bulk INSERT of logs per reason. Rows are claimed
+    with SELECT ... FOR UPDATE SKIP LOCKED where the backend supports it. The
+    UPDATE re-checks the status and only the rows it changed are logged, so
+    concurrent or repeated runs never reject or log a task twice. Returns the
+    number of rejected tasks per reason.
+    """
+    today = today or datetime.date.today()
+    if mastertasks is None:
+        mastertasks = MasterTask.objects.filter(team__course__active=True)
+
+    counts = {}
+    for reason, message in REJECTION_REASONS:
+        with transaction.atomic():
+            candidates = _overdue(mastertasks.filter(status__lt=REJECTED), reason, today)
+            if connection.features.has_select_for_update_skip_locked:
+                candidates = candidates.select_for_update(skip_locked=True, of=("self",))
+            rows = _reject(list(candidates.values_list("pk", "team_id")))
+            if not rows:
+                counts[reason] = 0
+                continue
+            ids = [pk for pk, _ in rows]
+            entries = MasterTaskLog.objects.bulk_create([
+                MasterTaskLog(
+                    mastertask_id=pk,
+                    taskstatus=MasterTask.STATUS[REJECTED - 1][1],
+                    log=message,
+                )
+                for pk in ids
+            ], batch_size=500)
+            SearchDocument.index_logs(entries)
+            # Planned points include rejected tasks and only accepted tasks earn
+            # points, so the ledger is unchanged; cached breakdowns still expire.
+            Team.bump_points_version(pk__in={team_id for _, team_id in rows})
+            TaskDeadline.objects.filter(mastertask_id__in=ids).delete()
+            counts[reason] = len(ids)
+    return counts
+
+
+def reject_due_tasks(now=None, batch_size=500):
+    """Drain the deadline index up to ``now`` in batches of ``batch_size``.
+
+    Tasks of inactive courses are dropped from the index without rejection.
+    Returns the number of rejected tasks.
+    """
+    now = now or timezone.now()
+    today = timezone.localdate(now)
+    rejected = 0
+    while True:
+        batch = list(
+            TaskDeadline.objects.filter(due_at__lte=now)
+            .order_by("due_at", "mastertask")
+            .values_list("pk", "mastertask_id")[:batch_size]
+        )
+        if not batch:
+            return rejected
+        counts = reject_overdue_tasks(
+            today,
+            MasterTask.objects.filter(pk__in=[mastertask_id for _, mastertask_id in batch], team__course__active=True),
+        )
+        rejected += sum(counts.values())
+        # A row whose deadline moved while this batch ran has a later due_at now
+        TaskDeadline.objects.filter(pk__in=[pk for pk, _ in batch], due_at__lte=now).delete()
+
+
+def next_deadline():
+    return TaskDeadline.objects.order_by("due_at").values_list("due_at", flat=True).first()
@@ -1,9 +1,11 @@
 from django.db.models.base import Model
+from django.db.models.functions import Coalesce
 from django.forms import ModelForm, DateInput, Textarea
 from django.core.exceptions import ValidationError
 from django import forms
 
 from .models import *
+from .listings import FEED_SORTS
 
 class MasterCourseForm(ModelForm):
     class Meta:
@@ -63,3 +65,59 @@ class EmailChangeForm(ModelForm):
     class Meta:
         model = User
         fields = ['email']
+
+class NotificationPreferenceForm(ModelForm):
+    class Meta:
+        model = NotificationPreference
+        fields = ['mode']
+        widgets = {
+            'mode': forms.RadioSelect,
+        }
+
+class TaskFeedFilterForm(forms.Form):
+    team = forms.ModelChoiceField(queryset=Team.objects.none(), required=False, empty_label='All teams')
+    owner = forms.ModelChoiceField(queryset=Developer.objects.none(), required=False, empty_label='All owners')
+    milestone = forms.ModelChoiceField(queryset=Milestone.objects.none(), required=False, empty_label='All milestones')
+    status = forms.TypedChoiceField(
+        choices=(('', 'All statuses'),) + MasterTask.STATUS, coerce=int, empty_value=None, required=False
+    )
+    due_from = forms.DateField(required=False, widget=DateInput(attrs={'class': 'datepicker'}))
+    due_to = forms.DateField(required=False, widget=DateInput(attrs={'class': 'datepicker'}))
+    ai = forms.ChoiceField(
+        choices=(('', 'Any AI usage'), ('yes', 'Used AI'), ('no', 'No AI')), required=False, label='AI usage'
+    )
+    sort = forms.ChoiceField(required=False)
+
+    def __init__(self, course, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['team'].queryset = Team.objects.filter(course=course).order_by('name')
+        self.fields['owner'].queryset = Developer.objects.filter(team__course=course).select_related('user').order_by(
+            'user__first_name', 'user__last_name').distinct()
+        self.fields['milestone'].queryset = Milestone.objects.filter(course=course).order_by('due')
+        self.fields['sort'].choices = [(key, label) for key, (label, _, _) in FEED_SORTS.items()]
+
+    def filter(self, mastertasks):
+        data = self.cleaned_data
+        if data.get('team'):
+            mastertasks = mastertasks.filter(team=data['team'])
+        if data.get('owner'):
+            mastertasks = mastertasks.filter(owner=data['owner'])
+        if data.get('milestone'):
+            mastertasks = mastertasks.filter(milestone=data['milestone'])
+        if data.get('status'):
+            mastertasks = mastertasks.filter(status=data['status'])
+        if data.get('due_from') or data.get('due_to'):
+            # Rows not yet backfilled by refresh_current_tasks fall back to the latest revision
+            mastertasks = mastertasks.alias(
+                due=Coalesce('current_promised_date', MasterTask.latest_revision('promised_date'))
+            )
+        if data.get('due_from'):
+            mastertasks = mastertasks.filter(due__gte=data['due_from'])
+        if data.get('due_to'):
+            mastertasks = mastertasks.filter(due__lte=data['due_to'])
+        if data.get('ai'):
+            mastertasks = mastertasks.filter(used_ai=data['ai'] == 'yes')
+        return mastertasks
+
+    def get_sort(self):
+        return self.cleaned_data.get('sort') or 'newest'
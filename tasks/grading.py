@@ -0,0 +1,269 @@
+import datetime
+
+from django.core.cache import cache
+from django.db.models.functions import Coalesce
+
+from tasks.models import Course, Developer, GradeSnapshot, MasterTask, Milestone, PointsLedger, Team
+
+
+class CourseGrades:
+    """Team, milestone and project scores for a whole course at once.
+
+    Points are loaded with a fixed number of queries and every score is kept
+    as a list indexed like ``self.milestones``. The formulas are the ones used
+    by Team.get_team_points and Developer.get_project_grade.
+    """
+
+    def __init__(self, course, milestones, members, totals):
+        self.course = course
+        self.group_weight = course.group_weight
+        self.individual_weight = course.individual_weight
+        self.milestones = milestones
+        self.weights = [m.weight / 100 for m in milestones]
+        self.members = members
+        self.index = {m.pk: i for i, m in enumerate(milestones)}
+
+        self.team_planned = {}
+        self.team_accepted = {}
+        self.owner_accepted = {}
+        for (team_id, milestone_id, owner_id), (planned, accepted) in totals.items():
+            i = self.index.get(milestone_id)
+            if i is None:
+                continue
+            self._column(self.team_planned, team_id)[i] += planned
+            self._column(self.team_accepted, team_id)[i] += accepted
+            self._column(self.owner_accepted, owner_id)[i] += accepted
+
+    def _column(self, table, key):
+        if key not in table:
+            table[key] = [0] * len(self.milestones)
+        return table[key]
+
+    @staticmethod
+    def load_totals(mastertasks, ledger, from_tasks):
+        if from_tasks:
+            return PointsLedger.accumulate(PointsLedger.points_queryset(mastertasks).iterator())
+        return {
+            (row.team_id, row.milestone_id, row.owner_id): (row.planned_points, row.accepted_points)
+            for row in ledger
+        }
+
+    @classmethod
+    def for_course(cls, course, from_tasks=False):
+        # from_tasks recomputes points from MasterTask/Task instead of the ledger
+        milestones = list(Milestone.objects.filter(course=course).order_by("pk"))
+        members = {}
+        memberships = Developer.team.through.objects.filter(team__course=course).order_by("pk")
+        for team_id, developer_id in memberships.values_list("team_id", "developer_id"):
+            members.setdefault(team_id, []).append(developer_id)
+        totals = cls.load_totals(
+            MasterTask.objects.filter(team__course=course),
+            PointsLedger.objects.filter(team__course=course),
+            from_tasks,
+        )
+        return cls(course, milestones, members, totals)
+
+    @classmethod
+    def for_team(cls, team, from_tasks=False):
+        milestones = list(Milestone.objects.filter(course_id=team.course_id).order_by("pk"))
+        members = {team.pk: list(team.developer_set.values_list("pk", flat=True))}
+        totals = cls.load_totals(
+            MasterTask.objects.filter(team=team),
+            PointsLedger.objects.filter(team=team),
+            from_tasks,
+        )
+        return cls(team.course, milestones, members, totals)
+
+    @classmethod
+    def for_snapshot(cls, course, snapshot):
+        data = snapshot.data
+        milestones = [
+            Milestone(
+                pk=m["id"],
+                course=course,
+                name=m["name"],
+                weight=m["weight"],
+                due=datetime.date.fromisoformat(m["due"]),
+            )
+            for m in data["milestones"]
+        ]
+        members = {int(team_id): ids for team_id, ids in data["members"].items()}
+        grades = cls(course, milestones, members, {})
+        grades.group_weight = data["group_weight"]
+        grades.individual_weight = data["individual_weight"]
+        grades.team_planned = {int(k): v for k, v in data["team_planned"].items()}
+        grades.team_accepted = {int(k): v for k, v in data["team_accepted"].items()}
+        grades.owner_accepted = {int(k): v for k, v in data["owner_accepted"].items()}
+        return grades
+
+    @classmethod
+    def frozen(cls, course):
+        # Grades saved by end_course, or None while the course is still running
+        if course.active:
+            return None
+        snapshot = GradeSnapshot.objects.filter(course=course).first()
+        if snapshot is None:
+            return None
+        return cls.for_snapshot(course, snapshot)
+
+    def snapshot_data(self):
+        # Inputs are kept so for_snapshot can rebuild the engine; scores are
+        # stored as computed for auditing.
+        return {
+            "milestones": [
+                {"id": m.pk, "name": m.name, "weight": m.weight, "due": m.due.isoformat()}
+                for m in self.milestones
+            ],
+            "group_weight": self.group_weight,
+            "individual_weight": self.individual_weight,
+            "members": self.members,
+            "team_planned": self.team_planned,
+            "team_accepted": self.team_accepted,
+            "owner_accepted": self.owner_accepted,
+            "team_scores": {team_id: self.team_scores(team_id) for team_id in self.members},
+            "developer_scores": {
+                team_id: {
+                    developer_id: {
+                        "milestones": self.developer_scores(team_id, developer_id),
+                        "project": self.project_grade(team_id, developer_id),
+                    }
+                    for developer_id in developer_ids
+                }
+                for team_id, developer_ids in self.members.items()
+            },
+        }
+
+    def planned_points(self, team_id):
+        return self.team_planned.get(team_id) or [0] * len(self.milestones)
+
+    def accepted_points(self, team_id):
+        return self.team_accepted.get(team_id) or [0] * len(self.milestones)
+
+    def developer_accepted_points(self, developer_id):
+        return self.owner_accepted.get(developer_id) or [0] * len(self.milestones)
+
+    def developer_averages(self, team_id):
+        count = len(self.members.get(team_id, []))
+        return [planned / count if count > 0 else 0 for planned in self.planned_points(team_id)]
+
+    def team_scores(self, team_id):
+        return [
+            Team.calculate_team_points(planned, accepted)
+            for planned, accepted in zip(self.planned_points(team_id), self.accepted_points(team_id))
+        ]
+
+    def developer_scores(self, team_id, developer_id):
+        return [
+            Developer.calculate_developer_grade(accepted, average)
+            for accepted, average in zip(
+                self.developer_accepted_points(developer_id), self.developer_averages(team_id)
+            )
+        ]
+
+    def weighted_sum(self, scores):
+        total = 0
+        for score, weight in zip(scores, self.weights):
+            total = total + score * weight
+        return total
+
+    def project_grade(self, team_id, developer_id):
+        team_grade = self.weighted_sum(self.team_scores(team_id))
+        ind_grade = self.weighted_sum(self.developer_scores(team_id, developer_id))
+        return round(
+            team_grade * (self.group_weight / 100)
+            + ind_grade * (self.individual_weight / 100)
+        )
+
+
+class TeamPointsModel:
+    """Compact, cacheable copy of the inputs of a team's grades.
+
+    Holds plain tuples only, so it can be stored in the cache and evaluated
+    with hypothetical task changes without touching the database.
+    """
+
+    CACHE_TIMEOUT = 60 * 60
+
+    def __init__(self, team_id, version, group_weight, individual_weight, milestones, developers, tasks):
+        self.team_id = team_id
+        self.version = version
+        self.group_weight = group_weight
+        self.individual_weight = individual_weight
+        self.milestones = milestones  # [(id, name, weight, due)]
+        self.developers = developers  # [(id, name)]
+        self.tasks = tasks  # {mastertask id: (owner id, milestone id, status, difficulty, priority)}
+
+    @classmethod
+    def build(cls, team):
+        milestones = [
+            (m.pk, m.name, m.weight, m.due)
+            for m in Milestone.objects.filter(course_id=team.course_id).order_by("pk")
+        ]
+        developers = [
+            (d.pk, d.getName())
+            for d in team.developer_set.select_related("user").order_by(
+                "user__first_name", "user__last_name", "user__username"
+            )
+        ]
+        # Rows not yet backfilled by refresh_current_tasks fall back to the latest revision
+        tasks = {
+            pk: (owner_id, milestone_id, status, difficulty, priority)
+            for pk, owner_id, milestone_id, status, difficulty, priority in MasterTask.objects.filter(team=team)
+            .annotate(priority=Coalesce("current_priority", MasterTask.latest_revision("priority"), 0))
+            .values_list("pk", "owner_id", "milestone_id", "status", "difficulty", "priority")
+        }
+        return cls(
+            team.pk, team.points_version, team.course.group_weight, team.course.individual_weight,
+            milestones, developers, tasks,
+        )
+
+    @classmethod
+    def load(cls, team):
+        # Developer names come from the roster
+        key = f"tps:team-points-model:{team.pk}:{team.points_version}:{team.course.roster_version}"
+        model = cache.get(key)
+        if model is None:
+            model = cls.build(team)
+            cache.set(key, model, cls.CACHE_TIMEOUT)
+        return model
+
+    def grades(self, changes=None):
+        changes = changes or {}
+        totals = {}
+        for pk, (owner_id, milestone_id, status, difficulty, priority) in self.tasks.items():
+            change = changes.get(pk, {})
+            status = change.get("status", status)
+            points = change.get("difficulty", difficulty) * change.get("priority", priority)
+            planned, accepted = totals.get((self.team_id, milestone_id, owner_id), (0, 0))
+            totals[(self.team_id, milestone_id, owner_id)] = (
+                planned + points,
+                accepted + (points if status == 5 else 0),
+            )
+
+        milestones = [
+            Milestone(pk=pk, name=name, weight=weight, due=due)
+            for pk, name, weight, due in self.milestones
+        ]
+        members = {self.team_id: [pk for pk, _ in self.developers]}
+        course = Course(group_weight=self.group_weight, individual_weight=self.individual_weight)
+        return CourseGrades(course, milestones, members, totals)
+
+    def evaluate(self, changes=None):
+        grades = self.grades(changes)
+        team_scores = grades.team_scores(self.team_id)
+        return {
+            "milestones": [
+                {"id": m.pk, "name": m.name, "weight": m.weight, "team_score": score}
+                for m, score in zip(grades.milestones, team_scores)
+            ],
+            "team_score": grades.weighted_sum(team_scores),
+            "developers": [
+                {
+                    "id": pk,
+                    "name": name,
+                    "milestone_scores": grades.developer_scores(self.team_id, pk),
+                    "project_score": grades.project_grade(self.team_id, pk),
+                }
+                for pk, name in self.developers
+            ],
+        }
@@ -0,0 +1,104 @@
+from django.db.models import Case, CharField, Count, F, IntegerField, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce, Concat, NullIf
+
+from tasks.models import Like, MasterTask, VoteTally
+
+
+def _count(queryset):
+    # Scalar subquery counting the rows of `queryset` for the outer task
+    return Coalesce(
+        Subquery(queryset.values("mastertask").annotate(n=Count("pk")).values("n")[:1], output_field=IntegerField()),
+        0,
+    )
+
+
+def _tally(field):
+    return Coalesce(
+        Subquery(
+            VoteTally.objects.filter(task=OuterRef("current_task"), status=OuterRef("status")).values(field)[:1],
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+
+
+def task_listing(mastertasks):
+    """Rows for task tables, one query for the whole page.
+
+    Each row is a dict with the owner, team and milestone names, the current
+    title and promised date, the status label, points, the vote tally of the
+    current status and like counts.
+    """
+    return mastertasks.annotate(
+        owner_name=Concat("owner__user__first_name", Value(" "), "owner__user__last_name", output_field=CharField()),
+        team_name=F("team__name"),
+        milestone_name=F("milestone__name"),
+        # Rows not yet backfilled by refresh_current_tasks fall back to the latest revision
+        title=Coalesce(
+            NullIf("current_title", Value("")), MasterTask.latest_revision("title"), output_field=CharField()
+        ),
+        promised_date=Coalesce("current_promised_date", MasterTask.latest_revision("promised_date")),
+        status_label=Case(
+            *[When(status=value, then=Value(label)) for value, label in MasterTask.STATUS],
+            output_field=CharField(),
+        ),
+        points=F("difficulty") * Coalesce("current_priority", MasterTask.latest_revision("priority")),
+        approvals=_tally("approvals"),
+        denials=_tally("denials"),
+        likes=_count(Like.objects.filter(mastertask=OuterRef("pk"), liked=True)),
+        dislikes=_count(Like.objects.filter(mastertask=OuterRef("pk"), liked=False)),
+    ).values(
+        "pk", "team_id", "owner_id", "milestone_id", "owner_name", "team_name", "milestone_name", "title",
+        "promised_date", "status", "status_label", "difficulty", "points", "approvals", "denials",
+        "likes", "dislikes", "opened", "completed",
+    )
+
+
+# Course task feed orderings: name -> (label, sort field, descending).
+# Ties are broken by newest first, so (field, pk) is a unique keyset that
+# the (field, -id) indexes of MasterTask serve without sorting. Tasks are
+# grouped by team, owner or milestone id; their names are only looked up
+# for the rows of the page.
+FEED_SORTS = {
+    "newest": ("Newest first", "pk", True),
+    "oldest": ("Oldest first", "pk", False),
+    "team": ("Team", "team_id", False),
+    "owner": ("Owner", "owner_id", False),
+    "milestone": ("Milestone", "milestone_id", False),
+    "status": ("Status", "status", False),
+}
+FEED_PAGE_SIZE = 50
+
+
+def _feed_ordering(sort):
+    _, field, descending = FEED_SORTS[sort]
+    if field == "pk":
+        return ["-pk" if descending else "pk"]
+    return ["-" + field if descending else field, "-pk"]
+
+
+def task_feed_page(mastertasks, sort="newest", cursor=None, limit=FEED_PAGE_SIZE):
+    """One page of ``task_listing`` rows in ``sort`` order after ``cursor``.
+
+    Returns the rows and the cursor of the next page, or None on the last
+    page. Cursors are "<pk>.<sort value>"; ValueError if malformed.
+    """
+    _, field, descending = FEED_SORTS[sort]
+    rows = task_listing(mastertasks)
+    if cursor:
+        pk, separator, value = cursor.partition(".")
+        if not separator:
+            raise ValueError(f"Invalid cursor: {cursor!r}")
+        pk = int(pk)
+        if field == "pk":
+            rows = rows.filter(pk__lt=pk) if descending else rows.filter(pk__gt=pk)
+        else:
+            value = int(value)
+            beyond = f"{field}__lt" if descending else f"{field}__gt"
+            rows = rows.filter(Q(**{beyond: value}) | Q(**{field: value}, pk__lt=pk))
+
+    rows = list(rows.order_by(*_feed_ordering(sort))[:limit + 1])
+    if len(rows) <= limit:
+        return rows, None
+    last = rows[limit - 1]
+    return rows[:limit], f"{last['pk']}.{last[field]}"
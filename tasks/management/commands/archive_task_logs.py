@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from tasks.models import MasterTask, MasterTaskLog, TaskLogArchive
+from tasks.tasklog import pack_archive, unpack_archive
+
+
+class Command(BaseCommand):
+    help = "Move the task history of ended courses out of MasterTaskLog into compressed per-task archives."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--course", type=int, help="Only archive this course id (it must be inactive).")
+        parser.add_argument("--batch-size", type=int, default=200, help="Master tasks per transaction.")
+
+    def handle(self, *args, **options):
+        mastertasks = MasterTask.objects.filter(team__course__active=False, mastertasklog__isnull=False)
+        if options["course"]:
+            mastertasks = mastertasks.filter(team__course_id=options["course"])
+        pairs = list(mastertasks.values_list("pk", "team__course_id").distinct().order_by("pk"))
+
+        batch_size = options["batch_size"]
+        archived = 0
+        for start in range(0, len(pairs), batch_size):
+            chunk = dict(pairs[start:start + batch_size])
+            with transaction.atomic():
+                logs = {}
+                hot_ids = []
+                for entry in MasterTaskLog.objects.filter(mastertask_id__in=chunk).order_by("tarih", "pk"):
+                    logs.setdefault(entry.mastertask_id, []).append(entry)
+                    hot_ids.append(entry.pk)
+                existing = TaskLogArchive.objects.select_for_update().in_bulk(
+                    list(chunk), field_name="mastertask_id"
+                )
+                rows = []
+                for mastertask_id, entries in logs.items():
+                    if mastertask_id in existing:
+                        # A course that was reopened and ended again: keep the older archive
+                        entries = unpack_archive(existing[mastertask_id]) + entries
+                    rows.append(TaskLogArchive(
+                        mastertask_id=mastertask_id,
+                        course_id=chunk[mastertask_id],
+                        entries=pack_archive(entries),
+                        count=len(entries),
+                    ))
+                TaskLogArchive.objects.bulk_create(
+                    rows,
+                    update_conflicts=True,
+                    unique_fields=["mastertask"],
+                    update_fields=["entries", "count", "archived_at"],
+                )
+                archived += MasterTaskLog.objects.filter(pk__in=hot_ids).delete()[0]
+
+        self.stdout.write(self.style.SUCCESS(f"Archived {archived} log entries of {len(pairs)} tasks."))
@@ -0,0 +1,121 @@
+import base64
+import os
+import uuid
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from py_vapid import Vapid
+
+from tasks.models import PushSubscription
+from tasks.push import send_push_notification, vapid_headers
+from tasks.push_stub import BEHAVIOURS, PushStubServer
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure send_push_notification throughput and latency against a local push stand-in. "
+        "Each round seeds fresh users and subscriptions and deletes them afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--subscriptions", type=int, default=300)
+        parser.add_argument("--rounds", type=int, default=3)
+        parser.add_argument(
+            "--mix", default="ok=100",
+            help="Share of endpoints per stand-in behaviour, e.g. ok=90,slow=5,throttle=3,gone=2.",
+        )
+        parser.add_argument("--workers", type=int, help="Override PUSH_MAX_WORKERS.")
+        parser.add_argument("--slow-delay", type=float, default=0.5)
+
+    def parse_mix(self, mix, total):
+        shares = {}
+        for part in mix.split(","):
+            behaviour, _, share = part.partition("=")
+            if behaviour not in BEHAVIOURS or not share.isdigit():
+                raise CommandError(f"Bad --mix entry {part!r}; behaviours are {', '.join(BEHAVIOURS)}.")
+            shares[behaviour] = int(share)
+        weight = sum(shares.values())
+        behaviours = []
+        for behaviour, share in shares.items():
+            behaviours += [behaviour] * round(total * share / weight)
+        return (behaviours + ["ok"] * total)[:total]
+
+    def seed(self, server, behaviours):
+        prefix = f"push-bench-{uuid.uuid4().hex[:8]}"
+        users = User.objects.bulk_create([User(username=f"{prefix}-{i}") for i in range(len(behaviours))])
+        if not users[0].pk:
+            users = list(User.objects.filter(username__startswith=prefix).order_by("pk"))
+        subscriptions = []
+        for i, (user, behaviour) in enumerate(zip(users, behaviours)):
+            key = ec.generate_private_key(ec.SECP256R1()).public_key().public_bytes(
+                serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint
+            )
+            subscriptions.append(PushSubscription(
+                user=user,
+                endpoint=server.endpoint(behaviour, f"{prefix}-{i}"),
+                p256dh=_b64(key),
+                auth=_b64(os.urandom(16)),
+            ))
+        PushSubscription.objects.bulk_create(subscriptions, batch_size=500)
+        return prefix, [user.pk for user in users]
+
+    def handle(self, *args, **options):
+        behaviours = self.parse_mix(options["mix"], options["subscriptions"])
+        vapid = Vapid()
+        vapid.generate_keys()
+        private_key = _b64(vapid.private_key.private_numbers().private_value.to_bytes(32, "big"))
+        overrides = {
+            "PUSH_NOTIFICATIONS_ENABLED": True,
+            "VAPID_PRIVATE_KEY": private_key,
+            "VAPID_CLAIMS_EMAIL": settings.VAPID_CLAIMS_EMAIL or "mailto:admin@example.com",
+        }
+        if options["workers"]:
+            overrides["PUSH_MAX_WORKERS"] = options["workers"]
+
+        server = PushStubServer(slow_delay=options["slow_delay"])
+        server.start()
+        self.stdout.write(
+            f"{options['subscriptions']} subscriptions, {options['rounds']} rounds, "
+            f"{overrides.get('PUSH_MAX_WORKERS', settings.PUSH_MAX_WORKERS)} workers, stand-in at {server.origin}"
+        )
+        try:
+            with override_settings(**overrides):
+                vapid_headers.clear()
+                for round_no in range(1, options["rounds"] + 1):
+                    prefix, user_ids = self.seed(server, behaviours)
+                    try:
+                        report = send_push_notification(user_ids, "Benchmark", f"Round {round_no}")
+                    finally:
+                        User.objects.filter(username__startswith=prefix).delete()
+                    latencies = sorted(report.latencies)
+                    rate = len(latencies) / report.elapsed if report.elapsed else 0
+                    self.stdout.write(
+                        f"round {round_no}: {report} | {rate:.0f} req/s | "
+                        f"p50 {_percentile(latencies, 0.5) * 1000:.1f}ms "
+                        f"p95 {_percentile(latencies, 0.95) * 1000:.1f}ms "
+                        f"p99 {_percentile(latencies, 0.99) * 1000:.1f}ms "
+                        f"max {(latencies[-1] if latencies else 0) * 1000:.1f}ms"
+                    )
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        for (behaviour, status), count in sorted(server.counts.items()):
+            self.stdout.write(f"{behaviour:>9} {status}: {count}")
+        rejected = sum(count for (_, status), count in server.counts.items() if status in (400, 403))
+        if rejected:
+            raise CommandError(f"The stand-in rejected {rejected} requests; see the 400/403 counts above.")
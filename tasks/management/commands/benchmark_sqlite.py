@@ -0,0 +1,148 @@
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from tps.database import sqlite_init_command, sqlite_pragmas, sqlite_transaction_mode
+
+# What Django uses without tps.database: rollback journal, deferred
+# transactions and the sqlite3 module's 5 second timeout.
+STOCK_PRAGMAS = {"journal_mode": "DELETE", "synchronous": "FULL"}
+STOCK_TIMEOUT = 5.0
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def _connect(path, pragmas, timeout):
+    connection = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+    for statement in sqlite_init_command(pragmas).split(";"):
+        connection.execute(statement)
+    return connection
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare concurrent read/write throughput of a scratch SQLite database opened with Django's "
+        "stock settings and with the tps.database profile. Writers run short read-then-write "
+        "transactions like a task log write, readers page through a task's history."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--readers", type=int, default=8)
+        parser.add_argument("--writers", type=int, default=4)
+        parser.add_argument("--seconds", type=float, default=5.0)
+        parser.add_argument("--rows", type=int, default=50000, help="Rows seeded before each run.")
+        parser.add_argument("--tasks", type=int, default=500, help="Distinct master tasks in the table.")
+
+    def seed(self, path, pragmas, rows, tasks):
+        connection = _connect(path, pragmas, STOCK_TIMEOUT)
+        connection.execute(
+            "CREATE TABLE log (id INTEGER PRIMARY KEY, mastertask INTEGER NOT NULL, "
+            "tarih REAL NOT NULL, log TEXT NOT NULL)"
+        )
+        connection.execute("CREATE INDEX log_mastertask ON log (mastertask, tarih DESC, id DESC)")
+        connection.execute("BEGIN")
+        connection.executemany(
+            "INSERT INTO log (mastertask, tarih, log) VALUES (?, ?, ?)",
+            ((random.randrange(tasks), time.time(), "Task is created.") for _ in range(rows)),
+        )
+        connection.execute("COMMIT")
+        connection.close()
+
+    def run_profile(self, pragmas, transaction_mode, timeout, options):
+        counts = {"writes": 0, "reads": 0, "locked": 0}
+        latencies = []
+        lock = threading.Lock()
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "benchmark.sqlite3")
+            self.seed(path, pragmas, options["rows"], options["tasks"])
+            begin = f"BEGIN {transaction_mode}" if transaction_mode else "BEGIN"
+            start = threading.Barrier(options["readers"] + options["writers"] + 1)
+            deadline = []
+
+            def writer():
+                connection = _connect(path, pragmas, timeout)
+                writes, locked, own_latencies = 0, 0, []
+                start.wait()
+                while time.perf_counter() < deadline[0]:
+                    mastertask = random.randrange(options["tasks"])
+                    started = time.perf_counter()
+                    try:
+                        connection.execute(begin)
+                        connection.execute("SELECT COUNT(*) FROM log WHERE mastertask = ?", [mastertask]).fetchone()
+                        connection.execute(
+                            "INSERT INTO log (mastertask, tarih, log) VALUES (?, ?, ?)",
+                            [mastertask, time.time(), "Task is updated."],
+                        )
+                        connection.execute("COMMIT")
+                        writes += 1
+                        own_latencies.append(time.perf_counter() - started)
+                    except sqlite3.OperationalError as e:
+                        if "locked" not in str(e) and "busy" not in str(e):
+                            raise
+                        locked += 1
+                        if connection.in_transaction:
+                            connection.execute("ROLLBACK")
+                connection.close()
+                with lock:
+                    counts["writes"] += writes
+                    counts["locked"] += locked
+                    latencies.extend(own_latencies)
+
+            def reader():
+                connection = _connect(path, pragmas, timeout)
+                reads, locked = 0, 0
+                start.wait()
+                while time.perf_counter() < deadline[0]:
+                    try:
+                        connection.execute(
+                            "SELECT id, tarih, log FROM log WHERE mastertask = ? "
+                            "ORDER BY tarih DESC, id DESC LIMIT 21",
+                            [random.randrange(options["tasks"])],
+                        ).fetchall()
+                        reads += 1
+                    except sqlite3.OperationalError as e:
+                        if "locked" not in str(e) and "busy" not in str(e):
+                            raise
+                        locked += 1
+                connection.close()
+                with lock:
+                    counts["reads"] += reads
+                    counts["locked"] += locked
+
+            threads = [threading.Thread(target=writer) for _ in range(options["writers"])]
+            threads += [threading.Thread(target=reader) for _ in range(options["readers"])]
+            for thread in threads:
+                thread.start()
+            deadline.append(time.perf_counter() + options["seconds"])
+            start.wait()
+            for thread in threads:
+                thread.join()
+
+        seconds = options["seconds"]
+        return (
+            f"{counts['writes'] / seconds:8.0f} writes/s {counts['reads'] / seconds:9.0f} reads/s "
+            f"{counts['locked']:6d} locked | write p50 {_percentile(latencies, 0.5) * 1000:.2f}ms "
+            f"p99 {_percentile(latencies, 0.99) * 1000:.2f}ms"
+        )
+
+    def handle(self, *args, **options):
+        tuned = sqlite_pragmas()
+        self.stdout.write(
+            f"{options['writers']} writers, {options['readers']} readers, {options['seconds']}s per profile, "
+            f"SQLite {sqlite3.sqlite_version}"
+        )
+        self.stdout.write(f"  stock: {self.run_profile(STOCK_PRAGMAS, None, STOCK_TIMEOUT, options)}")
+        self.stdout.write(
+            f"  tuned: {self.run_profile(tuned, sqlite_transaction_mode(), tuned['busy_timeout'] / 1000, options)}"
+        )
@@ -0,0 +1,164 @@
+import datetime
+import hashlib
+import json
+import os
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+SOURCE_ALIAS = "sqlite_source"
+
+# Filled in by migrate on the new database, replaced by the copy
+MIGRATE_TABLES = {"django_content_type", "auth_permission"}
+
+
+def _open_source(path):
+    if not os.path.exists(path):
+        raise CommandError(f"{path} does not exist.")
+    # Read-only, so copying from the live database cannot change it
+    database = {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": f"file:{path}?mode=ro",
+        "OPTIONS": {"uri": True},
+    }
+    connections.settings[SOURCE_ALIAS] = connections.configure_settings({DEFAULT_DB_ALIAS: database})[DEFAULT_DB_ALIAS]
+    return connections[SOURCE_ALIAS]
+
+
+def _copied_models():
+    # Includes the many-to-many tables
+    return [
+        model for model in apps.get_models(include_auto_created=True)
+        if model._meta.managed and not model._meta.proxy
+    ]
+
+
+def _canonical(value):
+    # The same value read from either database: SQLite and PostgreSQL return
+    # datetimes in differently named UTC zones and binary data as bytes or memoryview
+    if isinstance(value, datetime.datetime) and value.tzinfo is not None:
+        return value.astimezone(datetime.timezone.utc).isoformat()
+    if isinstance(value, (bytes, memoryview)):
+        return bytes(value).hex()
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, sort_keys=True)
+    return value
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy an SQLite database into the configured PostgreSQL database table by table, reset its "
+        "sequences and check both against row counts and checksums. Run migrate on PostgreSQL first. "
+        "To move a live site, run it once while the site is up to see how long it takes, then stop "
+        "the site, run it again with --flush and start the site with DB_ENGINE=postgresql."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "source", nargs="?", default=str(settings.BASE_DIR / "db.sqlite3"),
+            help="SQLite database to copy (default db.sqlite3 next to manage.py).",
+        )
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS, help="PostgreSQL database to copy into.")
+        parser.add_argument("--batch-size", type=int, default=2000, help="Rows read from SQLite at a time.")
+        parser.add_argument("--flush", action="store_true", help="Replace data already in the PostgreSQL database.")
+        parser.add_argument("--verify-only", action="store_true", help="Only compare the two databases.")
+
+    def handle(self, *args, **options):
+        target = connections[options["database"]]
+        if target.vendor != "postgresql":
+            raise CommandError(f"Database {options['database']!r} is not PostgreSQL; set DB_ENGINE=postgresql.")
+        source = _open_source(options["source"])
+        models = _copied_models()
+
+        # One read transaction, so every table comes from the same snapshot
+        # even while the site keeps writing to the SQLite database
+        with transaction.atomic(using=source.alias):
+            if not options["verify_only"]:
+                started = time.perf_counter()
+                rows = self.copy(models, target, options)
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f"Copied {rows} rows in {len(models)} tables in {time.perf_counter() - started:.1f}s."
+                    )
+                )
+            mismatches = self.verify(models, target, options["batch_size"])
+        if mismatches:
+            raise CommandError(f"Tables differ: {', '.join(mismatches)}")
+        self.stdout.write(self.style.SUCCESS(f"All {len(models)} tables match."))
+
+    def copy(self, models, target, options):
+        if not options["flush"]:
+            filled = [
+                model._meta.db_table for model in models
+                if model._meta.db_table not in MIGRATE_TABLES and model._base_manager.using(target.alias).exists()
+            ]
+            if filled:
+                raise CommandError(f"{', '.join(filled)} already have rows; use --flush to replace them.")
+
+        total = 0
+        # Django creates PostgreSQL foreign keys DEFERRABLE INITIALLY DEFERRED,
+        # so tables can be filled in any order inside one transaction
+        with transaction.atomic(using=target.alias), target.cursor() as cursor:
+            tables = [model._meta.db_table for model in models]
+            for statement in target.ops.sql_flush(no_style(), tables, allow_cascade=True):
+                cursor.execute(statement)
+            for model in models:
+                rows = self.copy_table(model, cursor, target, options["batch_size"])
+                self.stdout.write(f"  {model._meta.db_table}: {rows} rows")
+                total += rows
+            for statement in target.ops.sequence_reset_sql(no_style(), models):
+                cursor.execute(statement)
+        with target.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        return total
+
+    def copy_table(self, model, cursor, target, batch_size):
+        fields = model._meta.concrete_fields
+        columns = ", ".join(target.ops.quote_name(field.column) for field in fields)
+        rows = (
+            model._base_manager.using(SOURCE_ALIAS)
+            .order_by()
+            .values_list(*[field.attname for field in fields])
+            .iterator(chunk_size=batch_size)
+        )
+        count = 0
+        # COPY streams the rows to the server instead of one INSERT per batch
+        with cursor.cursor.copy(f"COPY {target.ops.quote_name(model._meta.db_table)} ({columns}) FROM STDIN") as copy:
+            for row in rows:
+                copy.write_row([field.get_db_prep_save(value, target) for field, value in zip(fields, row)])
+                count += 1
+        return count
+
+    def checksum(self, model, alias, batch_size):
+        """Row count and an order independent checksum of a table."""
+        rows = (
+            model._base_manager.using(alias)
+            .order_by()
+            .values_list(*[field.attname for field in model._meta.concrete_fields])
+            .iterator(chunk_size=batch_size)
+        )
+        count, total = 0, 0
+        for row in rows:
+            digest = hashlib.sha256(repr([_canonical(value) for value in row]).encode()).digest()
+            total = (total + int.from_bytes(digest[:16], "big")) % (1 << 128)
+            count += 1
+        return count, total
+
+    def verify(self, models, target, batch_size):
+        mismatches = []
+        with transaction.atomic(using=target.alias):
+            for model in models:
+                table = model._meta.db_table
+                source_count, source_sum = self.checksum(model, SOURCE_ALIAS, batch_size)
+                target_count, target_sum = self.checksum(model, target.alias, batch_size)
+                if source_count != target_count:
+                    mismatches.append(table)
+                    self.stdout.write(self.style.ERROR(f"  {table}: {source_count} rows in SQLite, {target_count} copied"))
+                elif source_sum != target_sum:
+                    mismatches.append(table)
+                    self.stdout.write(self.style.ERROR(f"  {table}: {source_count} rows, checksums differ"))
+        return mismatches
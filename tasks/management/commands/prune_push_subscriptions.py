@@ -0,0 +1,36 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from tasks.models import PushSubscription
+
+
+class Command(BaseCommand):
+    help = "Delete push subscriptions that keep failing and have not delivered anything recently."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--failures", type=int, default=10, help="Minimum consecutive failures.")
+        parser.add_argument("--days", type=int, default=30, help="Days without a successful delivery.")
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - datetime.timedelta(days=options["days"])
+        dead = PushSubscription.objects.filter(
+            Q(last_success_at__isnull=True) | Q(last_success_at__lt=cutoff),
+            failure_count__gte=options["failures"],
+        )
+        if options["dry_run"]:
+            self.stdout.write(f"{dead.count()} subscriptions would be deleted.")
+            return
+
+        deleted = 0
+        while True:
+            ids = list(dead.order_by("pk").values_list("pk", flat=True)[:options["batch_size"]])
+            if not ids:
+                break
+            deleted += PushSubscription.objects.filter(pk__in=ids).delete()[0]
+
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} push subscriptions."))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from tasks.models import MasterTask, PointsLedger
+
+
+class Command(BaseCommand):
+    help = "Recompute the points ledger from MasterTask and Task rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--course", type=int, help="Only rebuild rows of this course id.")
+
+    def handle(self, *args, **options):
+        mastertasks = MasterTask.objects.all()
+        ledger = PointsLedger.objects.all()
+        if options["course"]:
+            mastertasks = mastertasks.filter(team__course_id=options["course"])
+            ledger = ledger.filter(team__course_id=options["course"])
+
+        totals = PointsLedger.accumulate(PointsLedger.points_queryset(mastertasks).iterator())
+        rows = [
+            PointsLedger(
+                team_id=team_id,
+                milestone_id=milestone_id,
+                owner_id=owner_id,
+                planned_points=planned,
+                accepted_points=accepted,
+            )
+            for (team_id, milestone_id, owner_id), (planned, accepted) in totals.items()
+        ]
+
+        with transaction.atomic():
+            ledger.delete()
+            PointsLedger.objects.bulk_create(rows, batch_size=500)
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(rows)} ledger rows."))
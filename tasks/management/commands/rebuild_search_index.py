@@ -0,0 +1,65 @@
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from tasks.models import Comment, MasterTask, MasterTaskLog, SearchDocument, TaskLogArchive
+from tasks.search import ensure_search_index, optimize_search_index
+from tasks.tasklog import unpack_archive
+
+
+def _batches(rows, size):
+    rows = iter(rows)
+    while batch := list(islice(rows, size)):
+        yield batch
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the full-text search documents from current task revisions, comments and task logs, "
+        "including archived logs, and create the database index if it is missing."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        ensure_search_index()
+
+        # (label, document kind, rows of (object_id, mastertask_id, title, body))
+        sources = [
+            ("task", "task", (
+                (pk, pk, title, description)
+                for pk, title, description in MasterTask.objects.filter(current_task__isnull=False)
+                .values_list("pk", "current_task__title", "current_task__description")
+                .iterator(chunk_size=batch_size)
+            )),
+            ("comment", "comment", (
+                (pk, mastertask_id, "", body)
+                for pk, mastertask_id, body in Comment.objects.values_list("pk", "mastertask_id", "body")
+                .iterator(chunk_size=batch_size)
+            )),
+            ("log", "log", (
+                (pk, mastertask_id, "", log)
+                for pk, mastertask_id, log in MasterTaskLog.objects.values_list("pk", "mastertask_id", "log")
+                .iterator(chunk_size=batch_size)
+            )),
+            ("archived log", "log", (
+                (entry.pk, entry.mastertask_id, "", entry.log)
+                for archive in TaskLogArchive.objects.iterator(chunk_size=50)
+                for entry in unpack_archive(archive)
+            )),
+        ]
+
+        with transaction.atomic():
+            SearchDocument.objects.all().delete()
+            for label, kind, rows in sources:
+                count = 0
+                for batch in _batches(rows, batch_size):
+                    SearchDocument.store(kind, batch, batch_size)
+                    count += len(batch)
+                self.stdout.write(f"{count} {label} documents")
+        optimize_search_index()
+
+        self.stdout.write(self.style.SUCCESS(f"Indexed {SearchDocument.objects.count()} documents."))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Q
+
+from tasks.models import Vote, VoteTally
+
+
+class Command(BaseCommand):
+    help = "Recompute the per-(task, status) vote counters from Vote rows."
+
+    def handle(self, *args, **options):
+        counts = (
+            Vote.objects.values("task_id", "status")
+            .annotate(approvals=Count("pk", filter=Q(vote=True)), denials=Count("pk", filter=Q(vote=False)))
+            .order_by()
+        )
+        tallies = [
+            VoteTally(task_id=row["task_id"], status=row["status"], approvals=row["approvals"], denials=row["denials"])
+            for row in counts
+        ]
+        with transaction.atomic():
+            VoteTally.objects.all().delete()
+            VoteTally.objects.bulk_create(tallies, batch_size=500)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(tallies)} vote tallies."))
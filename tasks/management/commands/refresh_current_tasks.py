@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+
+from tasks.models import MasterTask, Task
+
+
+class Command(BaseCommand):
+    help = "Point every MasterTask at its latest Task revision and copy its title, priority and promised date."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        latest_task = Task.objects.filter(masterTask=OuterRef("pk")).order_by("-pk").values("pk")[:1]
+        pairs = list(
+            MasterTask.objects.annotate(latest_task_id=Subquery(latest_task))
+            .filter(latest_task_id__isnull=False)
+            .values_list("pk", "latest_task_id")
+        )
+
+        updated = 0
+        for start in range(0, len(pairs), batch_size):
+            chunk = dict(pairs[start:start + batch_size])
+            tasks = Task.objects.in_bulk(chunk.values())
+            mastertasks = []
+            for mastertask in MasterTask.objects.filter(pk__in=chunk.keys()):
+                task = tasks[chunk[mastertask.pk]]
+                mastertask.current_task = task
+                mastertask.current_title = task.title
+                mastertask.current_priority = task.priority
+                mastertask.current_promised_date = task.promised_date
+                mastertasks.append(mastertask)
+            with transaction.atomic():
+                MasterTask.objects.bulk_update(
+                    mastertasks,
+                    ["current_task", "current_title", "current_priority", "current_promised_date"],
+                )
+            updated += len(mastertasks)
+
+        self.stdout.write(self.style.SUCCESS(f"Updated {updated} master tasks."))
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from tasks.deadlines import reject_overdue_tasks
+
+
+class Command(BaseCommand):
+    help = "Reject overdue tasks of all active courses. Run it from cron, or with --interval as a worker."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=int, default=0, help="Repeat every N seconds instead of running once.")
+
+    def handle(self, *args, **options):
+        while True:
+            counts = reject_overdue_tasks()
+            self.stdout.write(
+                f"Rejected {counts['milestone']} tasks past milestone due, "
+                f"{counts['promised_date']} past promised date."
+            )
+            if not options["interval"]:
+                break
+            time.sleep(options["interval"])
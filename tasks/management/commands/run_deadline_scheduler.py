@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from tasks.deadlines import next_deadline, reject_due_tasks
+from tasks.models import MasterTask, TaskDeadline
+
+
+class Command(BaseCommand):
+    help = "Reject tasks at the moment they become overdue, sleeping until the next indexed deadline."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rebuild", action="store_true", help="Rebuild the deadline index before starting.")
+        parser.add_argument("--once", action="store_true", help="Drain the deadlines that are due now and exit.")
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--max-sleep", type=int, default=300,
+            help="Upper bound in seconds on each sleep, so deadlines added meanwhile are picked up.",
+        )
+
+    def handle(self, *args, **options):
+        if options["rebuild"]:
+            TaskDeadline.objects.all().delete()
+            TaskDeadline.refresh(MasterTask.objects.filter(status__lt=4, team__course__active=True))
+            self.stdout.write(f"Indexed {TaskDeadline.objects.count()} deadlines.")
+
+        while True:
+            rejected = reject_due_tasks(batch_size=options["batch_size"])
+            if rejected:
+                self.stdout.write(f"{timezone.now():%Y-%m-%d %H:%M:%S} rejected {rejected} tasks.")
+            if options["once"]:
+                break
+
+            sleep_for = options["max_sleep"]
+            upcoming = next_deadline()
+            if upcoming is not None:
+                sleep_for = min(sleep_for, max((upcoming - timezone.now()).total_seconds(), 0))
+            time.sleep(sleep_for)
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from tasks.push_stub import BEHAVIOURS, PushStubServer
+
+
+class Command(BaseCommand):
+    help = "Run a local stand-in push service that validates VAPID and simulates push-service responses."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8089)
+        parser.add_argument("--slow-delay", type=float, default=0.5, help="Seconds /slow/ endpoints wait.")
+        parser.add_argument("--retry-after", type=int, default=30, help="Retry-After of /throttle/ responses.")
+
+    def handle(self, *args, **options):
+        server = PushStubServer(
+            options["host"], options["port"], slow_delay=options["slow_delay"], retry_after=options["retry_after"]
+        )
+        self.stdout.write(f"Push stand-in listening on {server.origin}/<{'|'.join(BEHAVIOURS)}>/<id>")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            for (behaviour, status), count in sorted(server.counts.items()):
+                self.stdout.write(f"{behaviour:>9} {status}: {count}")
@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from tasks.notifications import flush_push_events, next_event_due
+from tasks.push import drain_push_outbox, next_outbox_attempt
+
+
+class Command(BaseCommand):
+    help = (
+        "Deliver queued push notifications, retrying failed deliveries with exponential backoff. "
+        "Grouped and digest notifications are summarized once their window closes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Send the notifications that are due now and exit.")
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument(
+            "--interval", type=float, default=2,
+            help="Seconds to wait between polls when the outbox is empty.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            flushed = flush_push_events()
+            if flushed:
+                self.stdout.write(f"{timezone.now():%Y-%m-%d %H:%M:%S} summarized {flushed} grouped notifications.")
+            sent, retried, failed = drain_push_outbox(batch_size=options["batch_size"])
+            if sent or retried or failed:
+                self.stdout.write(
+                    f"{timezone.now():%Y-%m-%d %H:%M:%S} sent {sent}, retrying {retried}, failed {failed}."
+                )
+            if options["once"]:
+                break
+            if sent + retried + failed >= options["batch_size"]:
+                continue
+
+            sleep_for = options["interval"]
+            for upcoming in (next_outbox_attempt(), next_event_due()):
+                if upcoming is not None:
+                    sleep_for = min(sleep_for, max((upcoming - timezone.now()).total_seconds(), 0))
+            time.sleep(sleep_for)
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from tasks.models import Course
+from tasks.views import _save_grade_snapshot
+
+
+class Command(BaseCommand):
+    help = "Save frozen grade snapshots for ended courses (end_course does this automatically)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--course", type=int, help="Only snapshot this course id.")
+        parser.add_argument("--missing-only", action="store_true", help="Skip courses that already have a snapshot.")
+
+    def handle(self, *args, **options):
+        courses = Course.objects.filter(active=False)
+        if options["course"]:
+            courses = courses.filter(pk=options["course"])
+        if options["missing_only"]:
+            courses = courses.filter(grade_snapshot__isnull=True)
+
+        count = 0
+        for course in courses:
+            with transaction.atomic():
+                _save_grade_snapshot(course)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f"Saved {count} grade snapshots."))
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from tasks.search import optimize_search_index
+
+CHECKPOINT_MODES = ("PASSIVE", "FULL", "RESTART", "TRUNCATE")
+
+
+class Command(BaseCommand):
+    help = (
+        "Checkpoint the SQLite write-ahead log and refresh query planner statistics. "
+        "Run it from cron, e.g. every few minutes with --checkpoint and nightly with --optimize."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--checkpoint", nargs="?", const="PASSIVE", choices=CHECKPOINT_MODES,
+            help="Copy the WAL into the database; TRUNCATE also shrinks the WAL file (default PASSIVE).",
+        )
+        parser.add_argument(
+            "--optimize", action="store_true",
+            help="Refresh query planner statistics and merge the full-text search index segments.",
+        )
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        connection = connections[options["database"]]
+        if connection.vendor != "sqlite":
+            raise CommandError(f"Database {options['database']!r} is not SQLite.")
+        checkpoint = options["checkpoint"]
+        if checkpoint is None and not options["optimize"]:
+            checkpoint = "PASSIVE"
+
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode")
+            journal_mode = cursor.fetchone()[0]
+            if checkpoint and journal_mode.lower() == "wal":
+                cursor.execute(f"PRAGMA wal_checkpoint({checkpoint})")
+                busy, log_pages, checkpointed = cursor.fetchone()
+                message = f"Checkpoint {checkpoint}: {checkpointed} of {log_pages} WAL pages copied."
+                if busy:
+                    self.stdout.write(self.style.WARNING(message + " Readers kept it from finishing."))
+                else:
+                    self.stdout.write(self.style.SUCCESS(message))
+            elif checkpoint:
+                self.stdout.write(f"Journal mode is {journal_mode}, nothing to checkpoint.")
+
+            if options["optimize"]:
+                # PRAGMA optimize only looks at tables this connection has
+                # used; a bounded ANALYZE covers every table
+                cursor.execute("PRAGMA analysis_limit=1000")
+                cursor.execute("ANALYZE")
+                optimize_search_index(options["database"])
+                self.stdout.write(self.style.SUCCESS("Optimized query planner statistics and search index."))
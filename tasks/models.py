@@ -1,8 +1,10 @@
 from django.db import models
 from django.db.models.deletion import CASCADE, SET_NULL
 from django.db.models.fields.related import ForeignKey
+from django.db.models.functions import Coalesce
 from django.core.exceptions import ValidationError
 from django.contrib.auth.models import User 
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 import datetime
 
@@ -55,6 +57,8 @@ class Course(models.Model):
     group_weight = models.PositiveSmallIntegerField("Group Weight", default=40)
     individual_weight = models.PositiveSmallIntegerField("Individual Weight", default=60)
     active = models.BooleanField("Active", default=True)
+    # Bumped whenever the course's teams, members or sections change
+    roster_version = models.PositiveIntegerField("Roster Version", default=0)
 
     def clean(self):
         super().clean()
@@ -81,6 +85,10 @@ class Course(models.Model):
     def get_term_label(self):
         return f"{self.academic_year} {self.get_semester_display()}"
 
+    @staticmethod
+    def bump_roster_version(**filters):
+        Course.objects.filter(**filters).update(roster_version=models.F('roster_version') + 1)
+
     def get_current_milestone(self):
         import datetime 
         milestones = self.milestone_set.all().order_by('due').exclude(due__lte=datetime.date.today())
@@ -101,34 +109,49 @@ class Team(models.Model):
     name = models.CharField(max_length=256)
     github = models.CharField("Git Page", max_length=512, null=True)
     supervisor = models.ForeignKey(Lecturer, on_delete=SET_NULL, blank=True, null=True)
+    # Bumped whenever anything that feeds the team's points changes
+    points_version = models.PositiveIntegerField("Points Version", default=0)
 
     def __str__(self):
         return self.name 
 
+    @staticmethod
+    def bump_points_version(**filters):
+        Team.objects.filter(**filters).update(points_version=models.F('points_version') + 1)
+
+    def get_ledger_totals(self):
+        # (planned, accepted) per milestone id, summed over every owner in the team
+        totals = {}
+        for row in self.pointsledger_set.all():
+            planned, accepted = totals.get(row.milestone_id, (0, 0))
+            totals[row.milestone_id] = (planned + row.planned_points, accepted + row.accepted_points)
+        return totals
+
     def get_all_milestone_points(self, m):
-        p = 0
-        for task in self.mastertask_set.all().filter(milestone=m):
-            p = p + task.get_points() 
-        return p 
+        return PointsLedger.objects.filter(team=self, milestone=m).aggregate(
+            p=models.Sum('planned_points'))['p'] or 0
     
     def get_all_accepted_points(self, m):
-        p = 0
-        for task in self.mastertask_set.all().filter(milestone=m):
-            if task.status == 5:
-                p = p + task.get_points() 
-        return p 
+        return PointsLedger.objects.filter(team=self, milestone=m).aggregate(
+            p=models.Sum('accepted_points'))['p'] or 0
     
     def get_milestone_list(self):
         milestone_list = {}
+        totals = self.get_ledger_totals()
         for m in self.course.milestone_set.all():
-            milestone_list[m.name] = self.get_team_points(m)
+            planned, accepted = totals.get(m.pk, (0, 0))
+            milestone_list[m.name] = self.calculate_team_points(planned, accepted)
         return milestone_list 
 
-    def get_team_points(self, m):
+    @staticmethod
+    def calculate_team_points(planned, accepted):
         g = 0
-        if self.get_all_milestone_points(m) > 0:
-            g = round((self.get_all_accepted_points(m) / self.get_all_milestone_points(m)) * 100)
-        return g 
+        if planned > 0:
+            g = round((accepted / planned) * 100)
+        return g
+
+    def get_team_points(self, m):
+        return self.calculate_team_points(self.get_all_milestone_points(m), self.get_all_accepted_points(m))
 
     def get_developer_average(self, m):
         count = self.developer_set.count()
@@ -152,20 +175,21 @@ class Developer(models.Model):
         return self.user.first_name + " " + self.user.last_name
 
     def get_all_accepted_points(self, m):
-        p = 0
-        for task in self.mastertask_set.all().filter(milestone=m):
-            if task.status == 5:
-                p = p + task.get_points() 
-        return p 
+        return PointsLedger.objects.filter(owner=self, milestone=m).aggregate(
+            p=models.Sum('accepted_points'))['p'] or 0
 
-    def get_developer_grade(self, m, team):
+    @staticmethod
+    def calculate_developer_grade(accepted, average):
         g = 0
-        if team.get_developer_average(m) > 0:
-            g = round((self.get_all_accepted_points(m) / team.get_developer_average(m)) * 100)
+        if average > 0:
+            g = round((accepted / average) * 100)
             if g > 100:
                 g = 100
         return g
 
+    def get_developer_grade(self, m, team):
+        return self.calculate_developer_grade(self.get_all_accepted_points(m), team.get_developer_average(m))
+
     def get_milestone_list(self, team_id):
         milestone_list = {}
         t = Team.objects.get(pk=team_id)
@@ -176,11 +200,18 @@ class Developer(models.Model):
     def get_project_grade(self, team_id):
         team_grade = 0
         ind_grade = 0
-        t = Team.objects.get(pk=team_id)
+        t = Team.objects.select_related('course').get(pk=team_id)
         c = t.course
+        team_totals = t.get_ledger_totals()
+        developer_count = t.developer_set.count()
+        accepted_by_milestone = {}
+        for row in PointsLedger.objects.filter(owner=self, milestone__course=c):
+            accepted_by_milestone[row.milestone_id] = accepted_by_milestone.get(row.milestone_id, 0) + row.accepted_points
         for m in c.milestone_set.all():
-            team_grade = team_grade + t.get_team_points(m) * (m.weight / 100)
-            ind_grade  = ind_grade  + self.get_developer_grade(m, t) * (m.weight / 100)
+            planned, accepted = team_totals.get(m.pk, (0, 0))
+            average = planned / developer_count if developer_count > 0 else 0
+            team_grade = team_grade + t.calculate_team_points(planned, accepted) * (m.weight / 100)
+            ind_grade  = ind_grade  + self.calculate_developer_grade(accepted_by_milestone.get(m.pk, 0), average) * (m.weight / 100)
         return round(team_grade * (c.group_weight / 100) + ind_grade * (c.individual_weight / 100))
 
     # TODO check permissions https://docs.djangoproject.com/en/3.2/topics/auth/default/
@@ -224,8 +255,27 @@ class MasterTask(models.Model):
     status = models.PositiveSmallIntegerField("Status", choices=STATUS, default=1)
     used_ai = models.BooleanField("Used Generative AI", default=False)
     ai_usage = models.CharField("AI Usage Details", max_length=256, blank=True, default='')
+    # Latest Task revision and its denormalized fields, kept in sync by Task.save()
+    current_task = models.ForeignKey('Task', on_delete=SET_NULL, null=True, blank=True, related_name='+')
+    current_title = models.CharField("Current Title", max_length=256, blank=True, default='')
+    # Null until set_current_task or refresh_current_tasks fills it in
+    current_priority = models.PositiveSmallIntegerField("Current Priority", null=True, blank=True)
+    current_promised_date = models.DateField("Current Promised Date", null=True, blank=True)
+
+    class Meta:
+        # Newest-first pages of the lecturer course task feed filtered by team,
+        # owner, milestone or status (tasks.listings.task_feed_page)
+        indexes = [
+            models.Index(fields=["team", "-id"]),
+            models.Index(fields=["owner", "-id"]),
+            models.Index(fields=["milestone", "-id"]),
+            models.Index(fields=["status", "-id"]),
+            models.Index(fields=["team", "status", "-id"]),
+        ]
 
     def __str__(self):
+        if self.current_task_id is not None:
+            return self.current_title
         task = self.task_set.order_by('-pk').first()
         if task is None:
             return f"MasterTask #{self.pk}"
@@ -239,11 +289,55 @@ class MasterTask(models.Model):
         return self.DIFFICULTY[self.difficulty-1][1]
 
     def get_points(self):
+        if self.current_priority is not None:
+            return self.difficulty * self.current_priority
         return self.difficulty * self.get_task().priority 
     
     def get_task(self):
+        if self.current_task_id is not None:
+            return self.current_task
         return self.task_set.order_by('-pk').first()
 
+    def set_current_task(self, task):
+        self.current_task = task
+        self.current_title = task.title
+        self.current_priority = task.priority
+        self.current_promised_date = task.promised_date
+        MasterTask.objects.filter(pk=self.pk).update(
+            current_task=task,
+            current_title=task.title,
+            current_priority=task.priority,
+            current_promised_date=task.promised_date,
+        )
+        TaskDeadline.refresh(MasterTask.objects.filter(pk=self.pk))
+        SearchDocument.index_task(task)
+
+    def reset_current_task(self):
+        # After the current revision is deleted: the newest one left, or none
+        task = Task.objects.filter(masterTask=self).order_by('-pk').first()
+        if task is not None:
+            self.set_current_task(task)
+            return
+        self.current_task = None
+        self.current_title = ''
+        self.current_priority = None
+        self.current_promised_date = None
+        MasterTask.objects.filter(pk=self.pk).update(
+            current_task=None, current_title='', current_priority=None, current_promised_date=None,
+        )
+        TaskDeadline.refresh(MasterTask.objects.filter(pk=self.pk))
+        SearchDocument.objects.filter(kind='task', object_id=self.pk).delete()
+
+    @staticmethod
+    def latest_revision(field):
+        # `field` of the newest Task, for rows whose current_* fields are not filled in yet
+        return models.Subquery(
+            Task.objects.filter(masterTask=models.OuterRef('pk')).order_by('-pk').values(field)[:1]
+        )
+
+    def refresh_points_ledger(self):
+        PointsLedger.refresh(self.team_id, self.milestone_id, self.owner_id)
+
 class Task(models.Model):
     PRIORITY = ( 
         (1, 'Low'),
@@ -260,6 +354,12 @@ class Task(models.Model):
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        mastertask = self.masterTask
+        if mastertask.current_task_id is None or self.pk >= mastertask.current_task_id:
+            mastertask.set_current_task(self)
+
     def getPriority(self):
         return self.PRIORITY[self.priority-1][1]
 
@@ -269,6 +369,16 @@ class Vote(models.Model):
     vote = models.BooleanField("Approve")
     status = models.SmallIntegerField("Status", default=1)
 
+class VoteTally(models.Model):
+    # Approve/deny counters per (task revision, voting status), maintained by tasks.voting
+    task = models.ForeignKey(Task, on_delete=CASCADE)
+    status = models.SmallIntegerField("Status")
+    approvals = models.PositiveIntegerField("Approvals", default=0)
+    denials = models.PositiveIntegerField("Denials", default=0)
+
+    class Meta:
+        unique_together = ("task", "status")
+
 class Comment(models.Model):
     owner = models.ForeignKey(User, on_delete=models.CASCADE)
     mastertask = models.ForeignKey(MasterTask, on_delete=models.CASCADE)
@@ -294,16 +404,262 @@ class MasterTaskLog(models.Model):
     log = models.TextField("Log")
     gizli = models.BooleanField("Gizli", default=False)
 
+    class Meta:
+        # Keyset pagination of a task's history, newest first
+        indexes = [models.Index(fields=["mastertask", "-tarih", "-id"])]
+
+
+class TaskLogArchive(models.Model):
+    # MasterTaskLog rows of an ended course, moved here by
+    # `manage.py archive_task_logs`; read through tasks.tasklog.task_log_page.
+    mastertask = models.OneToOneField(MasterTask, on_delete=models.CASCADE, related_name='log_archive')
+    course = models.ForeignKey(Course, on_delete=models.CASCADE)
+    entries = models.BinaryField("Entries")  # zlib-compressed JSON, oldest first
+    count = models.PositiveIntegerField("Entry Count", default=0)
+    archived_at = models.DateTimeField("Archived At", auto_now=True)
+
+    def __str__(self):
+        return f"{self.mastertask_id}: {self.count} archived log entries"
+
+
+class SearchDocument(models.Model):
+    # Searchable text of a task revision, comment or log entry, kept current
+    # by tasks.signals and indexed by the database's full-text engine
+    # (see tasks.search). Log documents outlive archived log rows.
+    KINDS = (
+        ('task', 'Task'),
+        ('comment', 'Comment'),
+        ('log', 'Log'),
+    )
+
+    kind = models.CharField("Kind", max_length=16, choices=KINDS)
+    object_id = models.PositiveBigIntegerField("Object ID")
+    mastertask = models.ForeignKey(MasterTask, on_delete=models.CASCADE)
+    course = models.ForeignKey(Course, on_delete=models.CASCADE)
+    title = models.CharField("Title", max_length=256, blank=True, default='')
+    body = models.TextField("Body", blank=True, default='')
+
+    class Meta:
+        unique_together = ("kind", "object_id")
+
+    def __str__(self):
+        return f"{self.kind} #{self.object_id}"
+
+    @classmethod
+    def store(cls, kind, rows, batch_size=500):
+        """Insert or replace documents from (object_id, mastertask_id, title, body) rows."""
+        if not rows:
+            return
+        courses = dict(
+            MasterTask.objects.filter(pk__in={row[1] for row in rows}).values_list("pk", "team__course_id")
+        )
+        cls.objects.bulk_create(
+            [
+                cls(kind=kind, object_id=object_id, mastertask_id=mastertask_id,
+                    course_id=courses[mastertask_id], title=title, body=body)
+                for object_id, mastertask_id, title, body in rows
+                if mastertask_id in courses
+            ],
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=["kind", "object_id"],
+            update_fields=["title", "body"],
+        )
+
+    @classmethod
+    def index_task(cls, task):
+        # One document per master task, holding its current revision
+        cls.store('task', [(task.masterTask_id, task.masterTask_id, task.title, task.description)])
+
+    @classmethod
+    def index_comments(cls, comments):
+        cls.store('comment', [(c.pk, c.mastertask_id, '', c.body) for c in comments if c.pk])
+
+    @classmethod
+    def index_logs(cls, entries):
+        cls.store('log', [(e.pk, e.mastertask_id, '', e.log) for e in entries if e.pk])
+
 class PushSubscription(models.Model):
     user = models.ForeignKey(User, on_delete=CASCADE, related_name='push_subscriptions')
     endpoint = models.URLField("Endpoint", max_length=512, unique=True)
     p256dh = models.CharField("p256dh Key", max_length=256)
     auth = models.CharField("Auth Key", max_length=256)
     created_at = models.DateTimeField("Created", auto_now_add=True)
+    # Delivery health: consecutive failures back the endpoint off until
+    # retry_after; `manage.py prune_push_subscriptions` removes dead ones.
+    failure_count = models.PositiveIntegerField("Consecutive Failures", default=0)
+    last_success_at = models.DateTimeField("Last Success", null=True, blank=True)
+    last_failure_at = models.DateTimeField("Last Failure", null=True, blank=True)
+    retry_after = models.DateTimeField("Retry After", null=True, blank=True, db_index=True)
+
+    BACKOFF = 60
+    MAX_BACKOFF = 24 * 60 * 60
 
     def __str__(self):
         return f"{self.user.username} — {self.endpoint[:60]}"
 
+    @classmethod
+    def backoff(cls, failure_count):
+        return datetime.timedelta(seconds=min(cls.BACKOFF * 2 ** (failure_count - 1), cls.MAX_BACKOFF))
+
+
+class PushOutbox(models.Model):
+    # Push notifications waiting to be delivered by `manage.py send_push_outbox`.
+    # Views write rows in the same transaction as the change they announce.
+    user_ids = models.JSONField("Recipients")
+    title = models.CharField("Title", max_length=256)
+    body = models.TextField("Body")
+    url = models.CharField("URL", max_length=512, blank=True)
+    tag = models.CharField("Tag", max_length=128, blank=True)
+    created_at = models.DateTimeField("Created", auto_now_add=True)
+    attempts = models.PositiveSmallIntegerField("Attempts", default=0)
+    next_attempt_at = models.DateTimeField("Next Attempt", default=timezone.now, db_index=True)
+    last_error = models.TextField("Last Error", blank=True)
+    failed = models.BooleanField("Failed", default=False)
+
+    def __str__(self):
+        return f"{self.title} → {len(self.user_ids)} users ({self.attempts} attempts)"
+
+
+class NotificationPreference(models.Model):
+    INSTANT = 'instant'
+    GROUPED = 'grouped'
+    DIGEST = 'digest'
+    MODES = (
+        (INSTANT, 'Send every notification right away'),
+        (GROUPED, 'Group bursts of activity on the same task'),
+        (DIGEST, 'Send an hourly digest'),
+    )
+    user = models.OneToOneField(User, on_delete=CASCADE, related_name='notification_preference')
+    mode = models.CharField("Delivery", max_length=10, choices=MODES, default=INSTANT)
+
+    def __str__(self):
+        return f"{self.user.username}: {self.mode}"
+
+
+class PushEvent(models.Model):
+    # A notification held back by a grouped or digest preference until due_at;
+    # see tasks.notifications.flush_push_events.
+    user = models.ForeignKey(User, on_delete=CASCADE, related_name='push_events')
+    tag = models.CharField("Tag", max_length=128, blank=True)
+    subject = models.CharField("Subject", max_length=256, blank=True)
+    title = models.CharField("Title", max_length=256)
+    body = models.TextField("Body")
+    url = models.CharField("URL", max_length=512, blank=True)
+    digest = models.BooleanField("Digest", default=False)
+    created_at = models.DateTimeField("Created", auto_now_add=True)
+    due_at = models.DateTimeField("Due At", db_index=True)
+
+    def __str__(self):
+        return f"{self.user_id} {self.tag} @ {self.due_at}"
+
+
+class PointsLedger(models.Model):
+    # Denormalized planned/accepted points per (team, milestone, owner).
+    # Refreshed by the MasterTask and Task signal receivers and by guarded
+    # status UPDATEs; `manage.py rebuild_points_ledger` recomputes it from scratch.
+    team = models.ForeignKey(Team, on_delete=models.CASCADE)
+    milestone = models.ForeignKey(Milestone, on_delete=models.CASCADE)
+    owner = models.ForeignKey(Developer, on_delete=models.CASCADE)
+    planned_points = models.PositiveIntegerField("Planned Points", default=0)
+    accepted_points = models.PositiveIntegerField("Accepted Points", default=0)
+
+    class Meta:
+        unique_together = ("team", "milestone", "owner")
+
+    def __str__(self):
+        return f"{self.team} / {self.milestone} / {self.owner}: {self.accepted_points}/{self.planned_points}"
+
+    @staticmethod
+    def points_queryset(queryset):
+        latest_priority = Task.objects.filter(
+            masterTask=models.OuterRef('pk')
+        ).order_by('-pk').values('priority')[:1]
+        return queryset.annotate(
+            latest_priority=models.Subquery(latest_priority)
+        ).values('team_id', 'milestone_id', 'owner_id', 'status', 'difficulty', 'latest_priority')
+
+    @staticmethod
+    def accumulate(rows):
+        totals = {}
+        for row in rows:
+            key = (row['team_id'], row['milestone_id'], row['owner_id'])
+            points = row['difficulty'] * (row['latest_priority'] or 0)
+            planned, accepted = totals.get(key, (0, 0))
+            totals[key] = (planned + points, accepted + (points if row['status'] == 5 else 0))
+        return totals
+
+    @classmethod
+    def refresh(cls, team_id, milestone_id, owner_id):
+        rows = cls.points_queryset(MasterTask.objects.filter(
+            team_id=team_id, milestone_id=milestone_id, owner_id=owner_id
+        ))
+        totals = cls.accumulate(rows)
+        if (team_id, milestone_id, owner_id) in totals:
+            planned, accepted = totals[(team_id, milestone_id, owner_id)]
+            cls.objects.update_or_create(
+                team_id=team_id,
+                milestone_id=milestone_id,
+                owner_id=owner_id,
+                defaults={"planned_points": planned, "accepted_points": accepted},
+            )
+        else:
+            # No tasks left, as after rebuild_points_ledger; the team, milestone
+            # or owner may be being deleted, so no row is created for them
+            cls.objects.filter(team_id=team_id, milestone_id=milestone_id, owner_id=owner_id).delete()
+        Team.bump_points_version(pk=team_id)
+
+
+class TaskDeadline(models.Model):
+    # Moment an unfinished task becomes overdue: the start of the day after
+    # the earlier of its milestone due date and its promised date.
+    mastertask = models.OneToOneField(MasterTask, on_delete=models.CASCADE, related_name='deadline')
+    due_at = models.DateTimeField("Due At")
+
+    class Meta:
+        indexes = [models.Index(fields=["due_at", "mastertask"])]
+
+    def __str__(self):
+        return f"{self.mastertask_id} @ {self.due_at}"
+
+    @staticmethod
+    def deadline_for(milestone_due, promised_date):
+        day = min(d for d in (milestone_due, promised_date) if d is not None)
+        return timezone.make_aware(
+            datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time.min)
+        )
+
+    @classmethod
+    def refresh(cls, mastertasks):
+        # Rows not yet backfilled by refresh_current_tasks fall back to the latest revision
+        rows = list(
+            mastertasks.annotate(
+                promised=Coalesce('current_promised_date', MasterTask.latest_revision('promised_date'))
+            ).values_list('pk', 'status', 'milestone__due', 'promised')
+        )
+        cls.objects.filter(mastertask_id__in=[pk for pk, status, _, _ in rows if status >= 4]).delete()
+        cls.objects.bulk_create(
+            [
+                cls(mastertask_id=pk, due_at=cls.deadline_for(due, promised))
+                for pk, status, due, promised in rows
+                if status < 4
+            ],
+            update_conflicts=True,
+            unique_fields=['mastertask'],
+            update_fields=['due_at'],
+            batch_size=500,
+        )
+
+
+class GradeSnapshot(models.Model):
+    # Grades frozen by end_course; see tasks.grading.CourseGrades.snapshot_data
+    course = models.OneToOneField(Course, on_delete=models.CASCADE, related_name='grade_snapshot')
+    computed_at = models.DateTimeField("Computed At")
+    data = models.JSONField("Grades")
+
+    def __str__(self):
+        return f"{self.course} grades @ {self.computed_at:%Y-%m-%d %H:%M}"
+
 
 class TeamMilestoneGrade(models.Model):
     milestone = models.ForeignKey(Milestone, on_delete=models.CASCADE)
@@ -0,0 +1,125 @@
+import datetime
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from tasks.models import NotificationPreference, PushEvent, PushOutbox
+
+DIGEST_INTERVAL = 60 * 60
+
+# Tag family (the tag without its task id) -> noun used in summaries
+FAMILY_NOUNS = {
+    "task-vote": "approve votes",
+    "task-revision": "revision requests",
+    "task-edit": "edits",
+    "task-complete": "completion updates",
+    "task-create": "tasks",
+    "task-open": "status changes",
+    "task-accepted": "status changes",
+}
+
+
+def tag_family(tag):
+    family, _, suffix = tag.rpartition("-")
+    return family if family and suffix.isdigit() else tag
+
+
+def preference_modes(user_ids):
+    modes = dict(
+        NotificationPreference.objects.filter(user_id__in=user_ids).values_list("user_id", "mode")
+    )
+    return {pk: modes.get(pk, NotificationPreference.INSTANT) for pk in user_ids}
+
+
+def _next_digest(now):
+    seconds = int(now.timestamp())
+    return datetime.datetime.fromtimestamp(
+        seconds - seconds % DIGEST_INTERVAL + DIGEST_INTERVAL, tz=datetime.timezone.utc
+    )
+
+
+def buffer_push_events(user_ids, title, body, url="", tag="", subject="", digest=False, now=None):
+    """Hold a notification for users who group or digest their notifications."""
+    now = now or timezone.now()
+    if digest:
+        due_at = _next_digest(now)
+    else:
+        due_at = now + datetime.timedelta(seconds=getattr(settings, "PUSH_COALESCE_WINDOW", 120))
+    PushEvent.objects.bulk_create([
+        PushEvent(
+            user_id=pk, tag=tag, subject=subject, title=title, body=body, url=url,
+            digest=digest, due_at=due_at,
+        )
+        for pk in user_ids
+    ])
+
+
+def _phrase(events):
+    # One line for events sharing a tag family and subject
+    if len(events) == 1:
+        return events[0].body
+    noun = FAMILY_NOUNS.get(tag_family(events[0].tag), "updates")
+    subject = events[0].subject or "your tasks"
+    return f"{len(events)} new {noun} on {subject}"
+
+
+def summarize(events):
+    """Title, body, url and tag of the single push replacing ``events``."""
+    if len(events) == 1:
+        e = events[0]
+        return e.title, e.body, e.url, e.tag
+
+    groups = {}
+    for e in events:
+        groups.setdefault((tag_family(e.tag), e.subject), []).append(e)
+    urls = {e.url for e in events}
+    url = urls.pop() if len(urls) == 1 else f"{settings.SITE_URL}/"
+
+    if events[0].digest:
+        return "Task Updates", "; ".join(_phrase(group) for group in groups.values()), url, "digest"
+    if len(groups) == 1:
+        return events[-1].title, _phrase(events), url, events[-1].tag
+    return events[-1].title, "; ".join(_phrase(group) for group in groups.values()), url, events[-1].tag
+
+
+def flush_push_events(now=None):
+    """Move buffered events whose window has closed into the outbox.
+
+    A group is a user's events with the same tag, or all of a user's digest
+    events. The whole group is sent as soon as its earliest event is due, so
+    the window starts with the first event of a burst. Returns the number of
+    outbox rows written.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        due = PushEvent.objects.filter(due_at__lte=now)
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        keys = {
+            (user_id, digest, "" if digest else tag)
+            for user_id, digest, tag in due.values_list("user_id", "digest", "tag")
+        }
+        if not keys:
+            return 0
+
+        pending = PushEvent.objects.filter(user_id__in={user_id for user_id, _, _ in keys}).order_by("pk")
+        if connection.features.has_select_for_update_skip_locked:
+            pending = pending.select_for_update(skip_locked=True)
+        groups = {}
+        for e in pending:
+            key = (e.user_id, e.digest, "" if e.digest else e.tag)
+            if key in keys:
+                groups.setdefault(key, []).append(e)
+
+        rows = []
+        for (user_id, _, _), events in groups.items():
+            title, body, url, tag = summarize(events)
+            rows.append(PushOutbox(user_ids=[user_id], title=title, body=body, url=url, tag=tag))
+        PushOutbox.objects.bulk_create(rows)
+        PushEvent.objects.filter(pk__in=[e.pk for events in groups.values() for e in events]).delete()
+    return len(rows)
+
+
+def next_event_due():
+    return PushEvent.objects.order_by("due_at").values_list("due_at", flat=True).first()
@@ -1,11 +1,22 @@
+import datetime
 import json
 import logging
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
 
+import requests
 from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from py_vapid import Vapid
 from pywebpush import webpush, WebPushException
+from requests.adapters import HTTPAdapter
 
-from tasks.models import PushSubscription
+from tasks.models import NotificationPreference, PushOutbox, PushSubscription
+from tasks.notifications import buffer_push_events, preference_modes
 
 logger = logging.getLogger(__name__)
 
@@ -19,25 +30,220 @@ def _vapid_private_key():
     return getattr(settings, "VAPID_PRIVATE_KEY", "")
 
 
+# Outbox retry policy: attempt n waits OUTBOX_BACKOFF * 2**(n-1) seconds,
+# capped at OUTBOX_MAX_BACKOFF, and the row is given up after OUTBOX_MAX_ATTEMPTS.
+OUTBOX_BACKOFF = 30
+OUTBOX_MAX_BACKOFF = 60 * 60
+OUTBOX_MAX_ATTEMPTS = 8
+# A claimed row is invisible to other workers for this many seconds
+OUTBOX_LEASE = 5 * 60
+
+
+def queue_push_notification(user_list, title, body, url=None, tag=None, subject=""):
+    """Store a notification in the outbox for `manage.py send_push_outbox`.
+
+    Users who group or digest their notifications get a buffered PushEvent
+    instead; ``subject`` names the task in their summaries. Call it inside the
+    transaction of the change being announced, so the notification is only
+    sent if that change is committed.
+    """
+    if not getattr(settings, "PUSH_NOTIFICATIONS_ENABLED", False):
+        return None
+    user_ids = [u.pk for u in user_list]
+    if not user_ids:
+        return None
+
+    by_mode = {}
+    for pk, mode in preference_modes(user_ids).items():
+        by_mode.setdefault(mode, []).append(pk)
+    for mode in (NotificationPreference.GROUPED, NotificationPreference.DIGEST):
+        if mode in by_mode:
+            buffer_push_events(
+                by_mode[mode], title, body, url=url or "", tag=tag or "", subject=subject,
+                digest=mode == NotificationPreference.DIGEST,
+            )
+    if NotificationPreference.INSTANT not in by_mode:
+        return None
+    return PushOutbox.objects.create(
+        user_ids=by_mode[NotificationPreference.INSTANT], title=title, body=body, url=url or "", tag=tag or ""
+    )
+
+
+class PushReport:
+    """Outcome of one fan-out: counts, failed and deferred users and latency per origin."""
+
+    def __init__(self):
+        self.sent = 0
+        self.expired = 0
+        self.errors = 0
+        self.failed_users = set()
+        # Users with a subscription skipped because it is backing off
+        self.deferred_users = set()
+        # Earliest retry_after of the failed and skipped subscriptions
+        self.retry_at = None
+        self.elapsed = 0.0
+        self.origins = {}  # origin: [answered, errors, total seconds]
+        self.latencies = []  # seconds per delivery, in completion order
+
+    def retry_not_before(self, moment):
+        if self.retry_at is None or moment < self.retry_at:
+            self.retry_at = moment
+
+    def add(self, origin, ok, seconds):
+        self.latencies.append(seconds)
+        stats = self.origins.setdefault(origin, [0, 0, 0.0])
+        stats[0 if ok else 1] += 1
+        stats[2] += seconds
+
+    def __str__(self):
+        return (
+            f"{self.sent} sent, {self.expired} expired, {self.errors} failed "
+            f"in {self.elapsed:.2f}s over {len(self.origins)} origins"
+        )
+
+
+class VapidHeaderCache:
+    """Signed VAPID headers per push-service origin (the JWT audience).
+
+    Signing is the expensive part of a push, and a header is valid for every
+    endpoint of the same origin until the token expires, so it is reused until
+    VAPID_REFRESH_MARGIN seconds before that.
+    """
+
+    VAPID_TTL = 12 * 60 * 60
+    VAPID_REFRESH_MARGIN = 10 * 60
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._vapid = {}
+        self._headers = {}
+
+    def _signer(self, private_key):
+        if private_key not in self._vapid:
+            if os.path.isfile(private_key):
+                self._vapid[private_key] = Vapid.from_file(private_key_file=private_key)
+            else:
+                self._vapid[private_key] = Vapid.from_string(private_key=private_key)
+        return self._vapid[private_key]
+
+    def get(self, private_key, email, audience, now=None):
+        now = int(now or time.time())
+        key = (private_key, email, audience)
+        with self._lock:
+            cached = self._headers.get(key)
+            if cached is not None and cached[1] - self.VAPID_REFRESH_MARGIN > now:
+                return cached[0]
+            expires = now + self.VAPID_TTL
+            headers = self._signer(private_key).sign({"sub": email, "aud": audience, "exp": expires})
+            self._headers[key] = (headers, expires)
+            return headers
+
+    def clear(self):
+        with self._lock:
+            self._vapid.clear()
+            self._headers.clear()
+
+
+vapid_headers = VapidHeaderCache()
+
+# One keep-alive session per push-service origin, shared by the pool workers
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _origin(endpoint):
+    parts = urlparse(endpoint)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def _session(origin):
+    with _sessions_lock:
+        session = _sessions.get(origin)
+        if session is None:
+            size = getattr(settings, "PUSH_MAX_WORKERS", 8)
+            session = requests.Session()
+            session.mount(origin, HTTPAdapter(pool_connections=1, pool_maxsize=size))
+            _sessions[origin] = session
+        return session
+
+
+def _retry_after(response):
+    # Seconds asked for by a 429 response, if given as a number
+    try:
+        return int(response.headers.get("Retry-After"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def _deliver(sub, payload, headers, timeout):
+    # Runs in a pool thread: no database access here.
+    # Returns (outcome, error, seconds, retry after seconds).
+    subscription_info = {
+        "endpoint": sub.endpoint,
+        "keys": {
+            "p256dh": sub.p256dh,
+            "auth": sub.auth,
+        },
+    }
+    started = time.monotonic()
+    try:
+        webpush(
+            subscription_info=subscription_info,
+            data=payload,
+            headers=headers,
+            timeout=timeout,
+            requests_session=_session(_origin(sub.endpoint)),
+        )
+        return "sent", None, time.monotonic() - started, None
+    except WebPushException as e:
+        response = getattr(e, "response", None)
+        status_code = getattr(response, "status_code", None)
+        if status_code in (404, 410):
+            return "expired", e, time.monotonic() - started, None
+        retry_after = _retry_after(response) if status_code == 429 else None
+        return "failed", f"HTTP {status_code}: {e}", time.monotonic() - started, retry_after
+    except Exception as e:
+        return "failed", e, time.monotonic() - started, None
+
+
 def send_push_notification(user_list, title, body, url=None, tag=None):
+    """Send a notification to every subscription of the given users.
+
+    Subscriptions are sent concurrently on PUSH_MAX_WORKERS threads, over one
+    pooled keep-alive session per push-service origin. Returns a PushReport;
+    its failed_users are the users with a delivery worth retrying. Expired
+    subscriptions are deleted instead. Subscriptions that keep failing are
+    skipped until their retry_after; their users are the report's
+    deferred_users, still owed the notification after report.retry_at.
+    """
+    report = PushReport()
     if not getattr(settings, "PUSH_NOTIFICATIONS_ENABLED", False):
         logger.debug("Push notifications disabled, skipping.")
-        return
+        return report
 
     private_key = _vapid_private_key()
     vapid_claims_email = getattr(settings, "VAPID_CLAIMS_EMAIL", "")
     if not private_key or not vapid_claims_email:
         logger.warning("VAPID private key or claims email not configured.")
-        return
+        return report
 
-    user_ids = [u.pk for u in user_list]
+    user_ids = [u if isinstance(u, int) else u.pk for u in user_list]
     if not user_ids:
-        return
+        return report
 
-    subscriptions = list(PushSubscription.objects.filter(user_id__in=user_ids))
+    now = timezone.now()
+    subscriptions = []
+    for sub in PushSubscription.objects.filter(user_id__in=user_ids).only(
+        "pk", "user_id", "endpoint", "p256dh", "auth", "failure_count", "retry_after"
+    ):
+        if sub.retry_after is not None and sub.retry_after > now:
+            report.deferred_users.add(sub.user_id)
+            report.retry_not_before(sub.retry_after)
+        else:
+            subscriptions.append(sub)
     if not subscriptions:
-        logger.debug("No push subscriptions found for users: %s", user_ids)
-        return
+        logger.debug("No push subscriptions to send to for users: %s", user_ids)
+        return report
 
     payload = json.dumps({
         "title": title,
@@ -45,32 +251,120 @@ def send_push_notification(user_list, title, body, url=None, tag=None):
         "url": url or "",
         "tag": tag or "",
     })
+    timeout = getattr(settings, "PUSH_TIMEOUT", 10)
+    subscriptions.sort(key=lambda sub: _origin(sub.endpoint))
+
+    started = time.monotonic()
+    expired = []
+    delivered = []
+    failing = []
+    with ThreadPoolExecutor(max_workers=getattr(settings, "PUSH_MAX_WORKERS", 8)) as pool:
+        futures = {}
+        for sub in subscriptions:
+            origin = _origin(sub.endpoint)
+            headers = vapid_headers.get(private_key, vapid_claims_email, origin)
+            futures[pool.submit(_deliver, sub, payload, headers, timeout)] = (sub, origin)
+        for future in as_completed(futures):
+            sub, origin = futures[future]
+            outcome, error, seconds, retry_after = future.result()
+            report.add(origin, outcome != "failed", seconds)
+            if outcome == "sent":
+                report.sent += 1
+                if sub.failure_count:
+                    delivered.append(sub.pk)
+                logger.debug("Push sent to user %s (%s)", sub.user_id, sub.endpoint[:50])
+            elif outcome == "expired":
+                report.expired += 1
+                expired.append(sub.pk)
+            else:
+                report.errors += 1
+                report.failed_users.add(sub.user_id)
+                sub.failure_count += 1
+                sub.last_failure_at = now
+                sub.retry_after = now + max(
+                    PushSubscription.backoff(sub.failure_count),
+                    datetime.timedelta(seconds=retry_after or 0),
+                )
+                report.retry_not_before(sub.retry_after)
+                failing.append(sub)
+                logger.warning("Push failed for %s: %s", sub.endpoint[:50], error)
+    report.elapsed = time.monotonic() - started
+
+    if report.sent:
+        # Healthy subscriptions only need their timestamp; failure counters
+        # are reset for the ones that had failed before.
+        skipped = set(expired) | {sub.pk for sub in failing}
+        sent = [sub.pk for sub in subscriptions if sub.pk not in skipped]
+        PushSubscription.objects.filter(pk__in=sent).update(last_success_at=now)
+        PushSubscription.objects.filter(pk__in=delivered).update(failure_count=0, retry_after=None)
+    if failing:
+        PushSubscription.objects.bulk_update(failing, ["failure_count", "last_failure_at", "retry_after"])
+    if expired:
+        PushSubscription.objects.filter(pk__in=expired).delete()
+        logger.info("Deleted %d expired push subscriptions", len(expired))
+    logger.info("Push batch '%s': %s", title, report)
+    return report
+
+
+def _claim_outbox(now, batch_size):
+    with transaction.atomic():
+        due = PushOutbox.objects.filter(failed=False, next_attempt_at__lte=now).order_by("next_attempt_at", "pk")
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        ids = list(due.values_list("pk", flat=True)[:batch_size])
+        # Leasing the rows keeps other workers off them while they are sent;
+        # a worker that dies mid-batch leaves them to be retried after the lease.
+        PushOutbox.objects.filter(pk__in=ids).update(
+            next_attempt_at=now + datetime.timedelta(seconds=OUTBOX_LEASE)
+        )
+    return list(PushOutbox.objects.filter(pk__in=ids).order_by("pk"))
 
-    vapid_claims = {"sub": vapid_claims_email}
 
-    for sub in subscriptions:
-        subscription_info = {
-            "endpoint": sub.endpoint,
-            "keys": {
-                "p256dh": sub.p256dh,
-                "auth": sub.auth,
-            },
-        }
+def outbox_backoff(attempts):
+    return datetime.timedelta(seconds=min(OUTBOX_BACKOFF * 2 ** (attempts - 1), OUTBOX_MAX_BACKOFF))
+
+
+def drain_push_outbox(batch_size=100, now=None):
+    """Send the outbox rows that are due. Returns (sent, retried, failed)."""
+    now = now or timezone.now()
+    sent = retried = failed = 0
+    for item in _claim_outbox(now, batch_size):
+        retry_at = None
         try:
-            webpush(
-                subscription_info=subscription_info,
-                data=payload,
-                vapid_private_key=private_key,
-                vapid_claims=vapid_claims,
-            )
-            logger.info("Push sent to %s (%s)", sub.user.username, sub.endpoint[:50])
-        except WebPushException as e:
-            response = getattr(e, "response", None)
-            status_code = getattr(response, "status_code", None)
-            if status_code in (404, 410):
-                sub.delete()
-                logger.info("Deleted expired push subscription %s", sub.endpoint)
-            else:
-                logger.warning("Push failed (HTTP %s) for %s: %s", status_code, sub.endpoint[:50], e)
+            report = send_push_notification(item.user_ids, item.title, item.body, url=item.url, tag=item.tag)
+            failed_users, retry_at = report.failed_users, report.retry_at
+            pending = report.failed_users | report.deferred_users
+            error = "Delivery failed for users %s" % sorted(failed_users)
         except Exception as e:
-            logger.warning("Push error for %s: %s", sub.endpoint[:50], e)
+            logger.exception("Push outbox item %s raised", item.pk)
+            failed_users = pending = set(item.user_ids)
+            error = repr(e)
+        if not pending:
+            item.delete()
+            sent += 1
+            continue
+        # Only the users whose delivery failed or was put off are retried;
+        # putting off a backing-off subscription is not a failed attempt
+        item.user_ids = sorted(pending)
+        if failed_users:
+            item.attempts += 1
+            item.last_error = error
+        if item.attempts >= OUTBOX_MAX_ATTEMPTS:
+            item.failed = True
+            failed += 1
+        else:
+            next_attempt_at = timezone.now() + outbox_backoff(item.attempts) if failed_users else retry_at
+            # Not before the first of the subscriptions may be tried again
+            item.next_attempt_at = max(next_attempt_at, retry_at or next_attempt_at)
+            retried += 1
+        item.save(update_fields=["user_ids", "attempts", "last_error", "failed", "next_attempt_at"])
+    return sent, retried, failed
+
+
+def next_outbox_attempt():
+    return (
+        PushOutbox.objects.filter(failed=False)
+        .order_by("next_attempt_at")
+        .values_list("next_attempt_at", flat=True)
+        .first()
+    )
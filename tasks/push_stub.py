@@ -0,0 +1,135 @@
+"""Local stand-in for a browser push service, for benchmarks and tests.
+
+It implements the receiving side of Web Push (RFC 8030/8291/8292): a POST
+must carry a valid ``vapid t=<jwt>,k=<key>`` Authorization header whose
+audience is this server, a TTL header and an aes128gcm body. The first path
+segment of the endpoint picks the response, so one server can mix outcomes:
+
+    /ok/<id>        201 Created
+    /slow/<id>      201 Created after ``slow_delay`` seconds
+    /gone/<id>      410 Gone
+    /notfound/<id>  404 Not Found
+    /throttle/<id>  429 Too Many Requests with a Retry-After header
+"""
+import base64
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.asymmetric.utils import encode_dss_signature
+
+BEHAVIOURS = {
+    "ok": 201,
+    "slow": 201,
+    "gone": 410,
+    "notfound": 404,
+    "throttle": 429,
+}
+
+
+def _b64decode(value):
+    return base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+
+
+def check_vapid(authorization, audience, now=None):
+    """Return None if the VAPID header is valid for ``audience``, else the reason."""
+    if not authorization or not authorization.startswith("vapid "):
+        return "missing vapid authorization"
+    params = dict(
+        part.strip().split("=", 1) for part in authorization[len("vapid "):].split(",") if "=" in part
+    )
+    token, key = params.get("t"), params.get("k")
+    if not token or not key:
+        return "malformed vapid authorization"
+    try:
+        header, claims, signature = token.split(".")
+        public_key = ec.EllipticCurvePublicKey.from_encoded_point(ec.SECP256R1(), _b64decode(key))
+        raw = _b64decode(signature)
+        public_key.verify(
+            encode_dss_signature(int.from_bytes(raw[:32], "big"), int.from_bytes(raw[32:], "big")),
+            f"{header}.{claims}".encode(),
+            ec.ECDSA(hashes.SHA256()),
+        )
+        claims = json.loads(_b64decode(claims))
+    except (ValueError, InvalidSignature):
+        return "bad vapid signature"
+    if claims.get("aud") != audience:
+        return "wrong audience"
+    if int(claims.get("exp", 0)) <= (now or time.time()):
+        return "expired token"
+    if not str(claims.get("sub", "")).startswith(("mailto:", "https:")):
+        return "bad subject"
+    return None
+
+
+def check_payload(headers, body):
+    if headers.get("Content-Encoding") != "aes128gcm":
+        return "unsupported content encoding"
+    if headers.get("TTL") is None:
+        return "missing TTL"
+    # salt (16) + record size (4) + key id length (1) + key id + at least one record
+    if len(body) < 21 or len(body) <= 21 + body[20]:
+        return "truncated aes128gcm body"
+    return None
+
+
+class PushStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        behaviour = self.path.strip("/").split("/")[0]
+        for status, error in (
+            (403, check_vapid(self.headers.get("Authorization"), self.server.origin)),
+            (400, check_payload(self.headers, body)),
+        ):
+            if error is not None:
+                self.server.record(behaviour, status)
+                return self._reply(status, error)
+
+        status = BEHAVIOURS.get(behaviour, 404)
+        if behaviour == "slow":
+            time.sleep(self.server.slow_delay)
+        self.server.record(behaviour, status)
+        headers = {"Retry-After": str(self.server.retry_after)} if status == 429 else {}
+        self._reply(status, "", headers)
+
+    def _reply(self, status, text, headers=None):
+        data = text.encode()
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PushStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, slow_delay=0.5, retry_after=30):
+        super().__init__((host, port), PushStubHandler)
+        self.origin = f"http://{host}:{self.server_port}"
+        self.slow_delay = slow_delay
+        self.retry_after = retry_after
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def record(self, behaviour, status):
+        with self._lock:
+            self.counts[(behaviour, status)] = self.counts.get((behaviour, status), 0) + 1
+
+    def endpoint(self, behaviour, ident):
+        return f"{self.origin}/{behaviour}/{ident}"
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
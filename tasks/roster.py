@@ -0,0 +1,445 @@
+"""Bulk roster import for create_team.
+
+Roster rows are validated by views._manual_team_row and
+views._random_team_row. RosterImport resolves the students of a batch of
+rows with a handful of queries and writes missing users, developers,
+enrolments, teams and memberships with bulk_create, so the cost of an
+import grows with the number of batches rather than students.
+read_roster_file reads uploaded CSV and XLSX rosters one row at a time.
+CourseRoster is the read side: a course's teams, members and sections.
+"""
+import codecs
+import csv
+import random
+import re
+import time
+import zipfile
+from xml.etree.ElementTree import ParseError, iterparse
+
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, get_hasher, make_password
+from django.conf import settings
+from django.contrib.auth.models import Group, User
+from django.db.models import F, FilteredRelation, Q
+
+from tasks.caching import VersionedLRUCache
+from tasks.models import Course, Developer, DeveloperCourse, Team
+
+# Initial passwords are the student id, which is also the username, so a
+# full-strength hash protects nothing until the student logs in. A cheap
+# PBKDF2 hash is verified as usual and Django re-hashes it with the
+# configured iterations on the first successful login.
+ROSTER_PASSWORD_ITERATIONS = 1000
+
+Membership = Developer.team.through
+
+
+def initial_password(student_id):
+    hasher = get_hasher()
+    if isinstance(hasher, PBKDF2PasswordHasher):
+        return hasher.encode(student_id, hasher.salt(), iterations=ROSTER_PASSWORD_ITERATIONS)
+    return make_password(student_id)
+
+
+def next_default_team_name(existing_team_names, start_no):
+    team_no = start_no
+    while True:
+        team_name = f"Team {team_no}"
+        if team_name not in existing_team_names:
+            return team_name, team_no + 1
+        team_no += 1
+
+
+def balanced_group_sizes(total_students, target_size):
+    if total_students <= 0:
+        return []
+    if target_size <= 0:
+        target_size = 1
+    if total_students <= target_size:
+        return [total_students]
+
+    group_count = total_students // target_size
+    remainder = total_students % target_size
+
+    if remainder > group_count:
+        group_count += 1
+        base_size = total_students // group_count
+        extra = total_students % group_count
+        return [base_size + 1] * extra + [base_size] * (group_count - extra)
+
+    sizes = [target_size] * group_count
+    for idx in range(remainder):
+        sizes[idx] += 1
+    return sizes
+
+
+def _created(model, objects, **lookup):
+    # bulk_create sets primary keys only where the backend returns them
+    if objects and objects[0].pk is None:
+        return list(model.objects.filter(**lookup))
+    return objects
+
+
+class RosterImport:
+    """Enrols roster rows into a course.
+
+    Manual imports (no ``team_size``) put each student into the team named
+    on their row; random imports collect the students and deal them into
+    new teams of about ``team_size`` in ``finish()``. Students already in a
+    team of the course keep it. Inside one transaction, feed rows with
+    ``add()`` in one or more batches, then call ``finish()``.
+    """
+
+    def __init__(self, course, lecturer, photo_url, team_size=None):
+        self.course = course
+        self.lecturer = lecturer
+        self.photo_url = photo_url
+        self.team_size = team_size
+        self.teams = {}
+        self.assigned = set()
+        self.pending = {}
+        self.seen = set()
+        self.group = None
+        self.users_created = 0
+        self.developers_created = 0
+        self.enrolled = 0
+        self.teams_created = 0
+        self.students_assigned = 0
+        self.elapsed = 0.0
+
+    @property
+    def is_random(self):
+        return self.team_size is not None
+
+    def add(self, rows):
+        started = time.perf_counter()
+        if self.is_random:
+            # The first line of a student wins, later duplicates are ignored
+            rows = [row for row in rows if row["student_id"] not in self.seen]
+            self.seen.update(row["student_id"] for row in rows)
+        if rows:
+            developers = self._enrol(rows)
+            if self.is_random:
+                for row in rows:
+                    developer = developers[row["student_id"]]
+                    if developer.pk not in self.assigned:
+                        self.pending[developer.pk] = developer
+            else:
+                self._assign_manual(rows, developers)
+        self.elapsed += time.perf_counter() - started
+
+    def finish(self):
+        if not self.is_random:
+            return
+        started = time.perf_counter()
+        pending = list(self.pending.values())
+        random.shuffle(pending)
+        existing_names = set(Team.objects.filter(course=self.course).values_list("name", flat=True))
+        next_team_no = Team.objects.filter(course=self.course).count() + 1
+        group_sizes = balanced_group_sizes(len(pending), self.team_size)
+        teams = []
+        for _ in group_sizes:
+            team_name, next_team_no = next_default_team_name(existing_names, next_team_no)
+            existing_names.add(team_name)
+            teams.append(Team(course=self.course, name=team_name, github=None, supervisor=self.lecturer))
+        teams = self._create_teams(teams)
+
+        memberships = []
+        cursor = 0
+        for team, group_size in zip(teams, group_sizes):
+            for developer in pending[cursor:cursor + group_size]:
+                memberships.append(Membership(developer_id=developer.pk, team_id=team.pk))
+            cursor += group_size
+        self._add_memberships(memberships)
+        self.pending = {}
+        self.elapsed += time.perf_counter() - started
+
+    def summary(self):
+        return (
+            f"Teams created: {self.teams_created}. Students assigned: {self.students_assigned}. "
+            f"New accounts: {self.users_created}. Enrolments: {self.enrolled}."
+        )
+
+    def _enrol(self, rows):
+        # Developer of every student id in rows, creating what is missing
+        names = {}
+        for row in rows:
+            names.setdefault(row["student_id"], (row["first_name"], row["last_name"]))
+
+        users = User.objects.in_bulk(list(names), field_name="username")
+        missing = [student_id for student_id in names if student_id not in users]
+        if missing:
+            created = User.objects.bulk_create([
+                User(
+                    username=student_id,
+                    first_name=names[student_id][0],
+                    last_name=names[student_id][1],
+                    password=initial_password(student_id),
+                )
+                for student_id in missing
+            ], batch_size=500)
+            created = _created(User, created, username__in=missing)
+            users.update((user.username, user) for user in created)
+            if self.group is None:
+                self.group, _ = Group.objects.get_or_create(name="student")
+            User.groups.through.objects.bulk_create(
+                [User.groups.through(user_id=user.pk, group_id=self.group.pk) for user in created],
+                batch_size=500,
+                ignore_conflicts=True,
+            )
+            self.users_created += len(created)
+
+        # Existing accounts only get names they do not have yet
+        renamed = []
+        for student_id, user in users.items():
+            first_name, last_name = names[student_id]
+            if (not user.first_name and first_name) or (not user.last_name and last_name):
+                user.first_name = user.first_name or first_name
+                user.last_name = user.last_name or last_name
+                renamed.append(user)
+        User.objects.bulk_update(renamed, ["first_name", "last_name"], batch_size=500)
+        if renamed:
+            Course.bump_roster_version(team__developer__user__in=renamed)
+
+        user_ids = [user.pk for user in users.values()]
+        developers = {developer.user_id: developer for developer in Developer.objects.filter(user_id__in=user_ids)}
+        new_user_ids = [user_id for user_id in user_ids if user_id not in developers]
+        if new_user_ids:
+            created = Developer.objects.bulk_create(
+                [Developer(user_id=user_id, photoURL=self.photo_url) for user_id in new_user_ids],
+                batch_size=500,
+            )
+            created = _created(Developer, created, user_id__in=new_user_ids)
+            developers.update((developer.user_id, developer) for developer in created)
+            self.developers_created += len(created)
+        by_student = {student_id: developers[users[student_id].pk] for student_id in names}
+
+        # The last line of a student sets their section
+        enrolments = {}
+        for row in rows:
+            developer = by_student[row["student_id"]]
+            enrolments[developer.pk] = DeveloperCourse(
+                developer=developer,
+                course=self.course,
+                section=row["section"],
+                description=row["description"],
+            )
+        DeveloperCourse.objects.bulk_create(
+            list(enrolments.values()),
+            batch_size=500,
+            update_conflicts=True,
+            unique_fields=["developer", "course"],
+            update_fields=["section", "description"],
+        )
+        self.enrolled += len(enrolments)
+        Course.bump_roster_version(pk=self.course.pk)
+
+        self.assigned.update(
+            Membership.objects.filter(
+                developer_id__in=list(enrolments), team__course=self.course
+            ).values_list("developer_id", flat=True)
+        )
+        return by_student
+
+    def _assign_manual(self, rows, developers):
+        team_names = [name for name in dict.fromkeys(row["team_name"] for row in rows) if name not in self.teams]
+        if team_names:
+            # Several teams may share a name; like before, the oldest one is used
+            for team in Team.objects.filter(course=self.course, name__in=team_names).order_by("-pk"):
+                self.teams[team.name] = team
+            self._create_teams([
+                Team(course=self.course, name=name, github=None, supervisor=self.lecturer)
+                for name in team_names
+                if name not in self.teams
+            ])
+
+        memberships = []
+        for row in rows:
+            developer = developers[row["student_id"]]
+            if developer.pk in self.assigned:
+                continue
+            self.assigned.add(developer.pk)
+            memberships.append(Membership(developer_id=developer.pk, team_id=self.teams[row["team_name"]].pk))
+        self._add_memberships(memberships)
+
+    def _create_teams(self, teams):
+        if not teams:
+            return []
+        names = [team.name for team in teams]
+        teams = Team.objects.bulk_create(teams)
+        if teams[0].pk is None:
+            teams = list(Team.objects.filter(course=self.course, name__in=names).order_by("pk"))[-len(names):]
+        for team in teams:
+            self.teams.setdefault(team.name, team)
+        self.teams_created += len(teams)
+        return teams
+
+    def _add_memberships(self, memberships):
+        if not memberships:
+            return
+        Membership.objects.bulk_create(memberships, batch_size=500)
+        self.assigned.update(membership.developer_id for membership in memberships)
+        self.students_assigned += len(memberships)
+        # bulk_create skips m2m_changed, which would bump the versions
+        Team.bump_points_version(pk__in={membership.team_id for membership in memberships})
+        Course.bump_roster_version(pk=self.course.pk)
+
+
+course_roster_cache = VersionedLRUCache(getattr(settings, "COURSE_ROSTER_CACHE_SIZE", 128))
+
+
+class CourseRoster:
+    """Teams of a course with their members and the members' sections.
+
+    Built from one query over the course's teams, their memberships,
+    developers, users and course enrolments, and cached per process until
+    Course.roster_version changes. Teams and members are plain dicts shared
+    through the cache, so callers must not modify them.
+    """
+
+    def __init__(self, course_id, rows):
+        self.course_id = course_id
+        self.teams = []
+        self.members = {}
+        teams = {}
+        for row in rows:
+            team = teams.get(row["pk"])
+            if team is None:
+                team = teams[row["pk"]] = {"id": row["pk"], "name": row["name"], "members": []}
+                self.teams.append(team)
+            if row["developer"] is None:
+                continue
+            member = {
+                "developer_id": row["developer"],
+                "user_id": row["developer__user"],
+                "username": row["developer__user__username"],
+                "first_name": row["developer__user__first_name"],
+                "last_name": row["developer__user__last_name"],
+                "name": f'{row["developer__user__first_name"]} {row["developer__user__last_name"]}',
+                "photo_url": row["developer__photoURL"],
+                "section": row["enrolment__section"],
+                "description": row["enrolment__description"] or "",
+                "team_id": team["id"],
+                "team_name": team["name"],
+            }
+            team["members"].append(member)
+            # A student in two teams of the course counts in the older one
+            current = self.members.get(member["developer_id"])
+            if current is None or current["team_id"] > member["team_id"]:
+                self.members[member["developer_id"]] = member
+        self._teams_by_id = teams
+
+    @classmethod
+    def load(cls, course_id):
+        rows = Team.objects.filter(course_id=course_id).annotate(
+            enrolment=FilteredRelation(
+                "developer__developercourse",
+                condition=Q(developer__developercourse__course_id=F("course_id")),
+            ),
+        ).order_by(
+            "name", "pk", "developer__user__first_name", "developer__user__last_name", "developer__user__username",
+        ).values(
+            "pk", "name", "developer", "developer__user", "developer__user__username",
+            "developer__user__first_name", "developer__user__last_name", "developer__photoURL",
+            "enrolment__section", "enrolment__description",
+        )
+        return cls(course_id, rows)
+
+    @classmethod
+    def for_course(cls, course):
+        roster = course_roster_cache.get(course.pk, course.roster_version)
+        if roster is None:
+            roster = cls.load(course.pk)
+            course_roster_cache.put(course.pk, course.roster_version, roster)
+        return roster
+
+    def team(self, team_id):
+        return self._teams_by_id.get(team_id)
+
+
+class RosterFileError(ValueError):
+    pass
+
+
+XLSX_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+
+
+def _xlsx_text(element):
+    return "".join(t.text or "" for t in element.iter(f"{XLSX_NS}t"))
+
+
+def _xlsx_column(reference):
+    index = 0
+    for letter in re.match(r"[A-Z]*", reference or "").group():
+        index = index * 26 + ord(letter) - ord("A") + 1
+    return index - 1
+
+
+def _xlsx_rows(upload):
+    # (row number, cell texts) of the first worksheet. The sheet is parsed
+    # incrementally; only the shared strings table is held in memory.
+    try:
+        book = zipfile.ZipFile(upload)
+    except zipfile.BadZipFile:
+        raise RosterFileError("The uploaded file is not a valid .xlsx workbook.")
+    with book:
+        names = book.namelist()
+        shared = []
+        if "xl/sharedStrings.xml" in names:
+            with book.open("xl/sharedStrings.xml") as f:
+                for _, element in iterparse(f):
+                    if element.tag == f"{XLSX_NS}si":
+                        shared.append(_xlsx_text(element))
+                        element.clear()
+        sheets = sorted(
+            (name for name in names if re.fullmatch(r"xl/worksheets/sheet\d+\.xml", name)),
+            key=lambda name: int(re.search(r"\d+", name).group()),
+        )
+        if not sheets:
+            raise RosterFileError("The uploaded workbook has no worksheet.")
+        with book.open(sheets[0]) as f:
+            for _, element in iterparse(f):
+                if element.tag != f"{XLSX_NS}row":
+                    continue
+                cells = {}
+                for position, cell in enumerate(element.iter(f"{XLSX_NS}c")):
+                    column = _xlsx_column(cell.get("r")) if cell.get("r") else position
+                    kind = cell.get("t")
+                    value = cell.find(f"{XLSX_NS}v")
+                    text = (value.text or "") if value is not None else ""
+                    if kind == "s" and text:
+                        text = shared[int(text)]
+                    elif kind == "inlineStr":
+                        text = _xlsx_text(cell)
+                    elif kind in (None, "n") and text.endswith(".0"):
+                        # Student ids typed as numbers
+                        text = text[:-2]
+                    cells[column] = text
+                row_no = int(element.get("r") or 0)
+                element.clear()
+                yield row_no, [cells.get(column, "") for column in range(max(cells, default=-1) + 1)]
+
+
+def _csv_rows(upload):
+    reader = csv.reader(codecs.iterdecode(upload, "utf-8-sig"))
+    for fields in reader:
+        yield reader.line_num, fields
+
+
+def read_roster_file(upload, skip_header=False):
+    """(line number, stripped fields) of every non-empty row of an uploaded
+    CSV or XLSX roster, read incrementally from the upload."""
+    rows = _xlsx_rows(upload) if upload.name.lower().endswith(".xlsx") else _csv_rows(upload)
+    try:
+        for line_no, fields in rows:
+            if skip_header:
+                skip_header = False
+                continue
+            fields = [field.strip() for field in fields]
+            if any(fields):
+                yield line_no, fields
+    except RosterFileError:
+        raise
+    except UnicodeDecodeError:
+        raise RosterFileError("The uploaded CSV file must be UTF-8 encoded.")
+    except (csv.Error, ParseError, KeyError, IndexError, ValueError):
+        raise RosterFileError("The uploaded file could not be read.")
@@ -0,0 +1,184 @@
+"""Full-text search over SearchDocument.
+
+SQLite indexes the documents with an FTS5 external-content table kept in
+step by triggers, PostgreSQL with a GIN index on their tsvector. Both are
+created by ``ensure_search_index`` after ``migrate``. Other databases fall
+back to unranked substring matching.
+"""
+import re
+import time
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from tasks.models import SearchDocument
+
+SEARCH_LIMIT = 50
+MAX_TERMS = 8
+
+# Highlight markers put around matches by the database; private use
+# characters, so they survive HTML escaping and never occur in the text.
+START, STOP = "\ue000", "\ue001"
+
+TABLE = SearchDocument._meta.db_table
+FTS_TABLE = f"{TABLE}_fts"
+
+SQLITE_SCHEMA = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        title, body, content='{TABLE}', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TABLE}_ai AFTER INSERT ON {TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TABLE}_ad AFTER DELETE ON {TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TABLE}_au AFTER UPDATE ON {TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+        INSERT INTO {FTS_TABLE}(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END""",
+]
+
+# 'simple' rather than a language configuration: texts mix Turkish and English
+PG_VECTOR = "to_tsvector('simple', d.title || ' ' || d.body)"
+PG_HEADLINE = f"StartSel={START}, StopSel={STOP}, MaxWords=30, MinWords=12, MaxFragments=2"
+
+
+def ensure_search_index(using=DEFAULT_DB_ALIAS):
+    """Create the full-text index of SearchDocument if it is missing."""
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE name = %s", [FTS_TABLE])
+            created = cursor.fetchone() is None
+            for statement in SQLITE_SCHEMA:
+                cursor.execute(statement)
+            if created:
+                # Documents written before the index existed
+                cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        elif connection.vendor == "postgresql":
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {TABLE}_tsv ON {TABLE} "
+                f"USING gin ((to_tsvector('simple', title || ' ' || body)))"
+            )
+
+
+def optimize_search_index(using=DEFAULT_DB_ALIAS):
+    connection = connections[using]
+    if connection.vendor == "sqlite":
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+
+
+def search_terms(query):
+    # Case is folded by the tokenizers; str.lower() would split a dotted İ
+    return re.findall(r"\w+", query)[:MAX_TERMS]
+
+
+def _highlight(text):
+    return mark_safe(escape(text).replace(START, "<mark>").replace(STOP, "</mark>"))
+
+
+def _sqlite_hits(cursor, terms, course_ids, limit):
+    # Every term must match, each as a prefix; quoting keeps FTS5 syntax out
+    match = " ".join(f'"{term}"*' for term in terms)
+    placeholders = ", ".join(["%s"] * len(course_ids))
+    cursor.execute(
+        f"""SELECT d.id, bm25({FTS_TABLE}, 4.0, 1.0),
+                   highlight({FTS_TABLE}, 0, %s, %s),
+                   snippet({FTS_TABLE}, 1, %s, %s, '…', 24)
+            FROM {FTS_TABLE} JOIN {TABLE} d ON d.id = {FTS_TABLE}.rowid
+            WHERE {FTS_TABLE} MATCH %s AND d.course_id IN ({placeholders})
+            ORDER BY 2 LIMIT %s""",
+        [START, STOP, START, STOP, match, *course_ids, limit],
+    )
+    # bm25 is lower for better matches
+    return [(pk, -score, title, snippet) for pk, score, title, snippet in cursor.fetchall()]
+
+
+def _postgresql_hits(cursor, terms, course_ids, limit):
+    cursor.execute(
+        f"""SELECT d.id, ts_rank({PG_VECTOR}, q),
+                   ts_headline('simple', d.title, q, %s),
+                   ts_headline('simple', d.body, q, %s)
+            FROM {TABLE} d, to_tsquery('simple', %s) q
+            WHERE {PG_VECTOR} @@ q AND d.course_id = ANY(%s)
+            ORDER BY 2 DESC LIMIT %s""",
+        [PG_HEADLINE + ", HighlightAll=true", PG_HEADLINE, " & ".join(f"{term}:*" for term in terms),
+         list(course_ids), limit],
+    )
+    return cursor.fetchall()
+
+
+def _fallback_hits(terms, course_ids, limit):
+    documents = SearchDocument.objects.filter(course_id__in=course_ids)
+    for term in terms:
+        documents = documents.filter(title__icontains=term) | documents.filter(body__icontains=term)
+    pattern = re.compile("|".join(re.escape(term) for term in terms), re.IGNORECASE)
+
+    def mark(text):
+        return pattern.sub(lambda match: START + match.group(0) + STOP, text)
+
+    return [
+        (pk, 0.0, mark(title), mark(body[:200]))
+        for pk, title, body in documents.order_by("-pk").values_list("pk", "title", "body")[:limit]
+    ]
+
+
+class SearchResults:
+    """Ranked hits of one search, best first."""
+
+    def __init__(self, query, hits, elapsed):
+        self.query = query
+        self.hits = hits
+        self.elapsed = elapsed
+
+    def __iter__(self):
+        return iter(self.hits)
+
+    def __len__(self):
+        return len(self.hits)
+
+    @property
+    def milliseconds(self):
+        return self.elapsed * 1000
+
+
+def search_documents(query, course_ids, limit=SEARCH_LIMIT, using=DEFAULT_DB_ALIAS):
+    """Search the documents of ``course_ids``.
+
+    Each hit is a dict with the SearchDocument (with its master task, team
+    and course loaded), its score and the highlighted title and snippet as
+    safe HTML.
+    """
+    started = time.perf_counter()
+    terms = search_terms(query)
+    course_ids = list(course_ids)
+    if not terms or not course_ids:
+        return SearchResults(query, [], time.perf_counter() - started)
+
+    connection = connections[using]
+    if connection.vendor == "sqlite":
+        with connection.cursor() as cursor:
+            rows = _sqlite_hits(cursor, terms, course_ids, limit)
+    elif connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            rows = _postgresql_hits(cursor, terms, course_ids, limit)
+    else:
+        rows = _fallback_hits(terms, course_ids, limit)
+
+    documents = SearchDocument.objects.using(using).select_related(
+        "mastertask__team", "course__masterCourse"
+    ).in_bulk([row[0] for row in rows])
+    hits = [
+        {
+            "document": documents[pk],
+            "score": score,
+            "title": _highlight(title),
+            "snippet": _highlight(snippet),
+        }
+        for pk, score, title, snippet in rows
+        if pk in documents
+    ]
+    return SearchResults(query, hits, time.perf_counter() - started)
@@ -0,0 +1,152 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from tasks.models import (
+    Comment, Course, Developer, DeveloperCourse, MasterTask, MasterTaskLog, Milestone, PointsLedger, SearchDocument, Task, TaskDeadline, Team, Vote,
+)
+
+
+# Every write below can change a team's points breakdown, so it bumps
+# Team.points_version and the cached breakdowns of that team miss. Writes
+# of MasterTask and Task also refresh the points ledger rows they touch.
+
+LEDGER_KEY = ("team_id", "milestone_id", "owner_id")
+
+
+@receiver(pre_save, sender=MasterTask)
+def mastertask_moving(sender, instance, update_fields=None, **kwargs):
+    # A task moved to another team, milestone or owner leaves its old ledger row stale
+    before = None
+    if instance.pk is not None and (update_fields is None or {"team", "milestone", "owner"} & set(update_fields)):
+        before = MasterTask.objects.filter(pk=instance.pk).values_list(*LEDGER_KEY).first()
+    instance._ledger_key_before = before
+
+
+@receiver(post_save, sender=MasterTask)
+@receiver(post_delete, sender=MasterTask)
+def mastertask_changed(sender, instance, **kwargs):
+    key = tuple(getattr(instance, field) for field in LEDGER_KEY)
+    before = getattr(instance, "_ledger_key_before", None)
+    if before is not None and before != key:
+        PointsLedger.refresh(*before)
+    # Also bumps Team.points_version
+    PointsLedger.refresh(*key)
+
+
+@receiver(post_save, sender=MasterTask)
+def mastertask_status_changed(sender, instance, created, **kwargs):
+    if not created and instance.status >= 4:
+        TaskDeadline.objects.filter(mastertask=instance).delete()
+
+
+@receiver(pre_delete, sender=Task)
+def task_deleting(sender, instance, origin=None, **kwargs):
+    # SET_NULL clears current_task before post_delete runs. Revisions deleted
+    # along with their master task (or its team, milestone...) need nothing.
+    if isinstance(origin, Task) or getattr(origin, "model", None) is Task:
+        instance._was_current = MasterTask.objects.filter(pk=instance.masterTask_id, current_task=instance).exists()
+
+
+@receiver(post_save, sender=Task)
+@receiver(post_delete, sender=Task)
+def task_changed(sender, instance, **kwargs):
+    if getattr(instance, "_was_current", False):
+        # The current_* fields still describe the deleted revision
+        mastertask = MasterTask.objects.filter(pk=instance.masterTask_id).first()
+        if mastertask is not None:
+            mastertask.reset_current_task()
+    # A new revision may change the priority
+    key = MasterTask.objects.filter(pk=instance.masterTask_id).values_list(*LEDGER_KEY).first()
+    if key is not None:
+        PointsLedger.refresh(*key)
+
+
+@receiver(post_save, sender=Vote)
+@receiver(post_delete, sender=Vote)
+def vote_changed(sender, instance, **kwargs):
+    Team.bump_points_version(mastertask__task__pk=instance.task_id)
+
+
+@receiver(post_save, sender=Milestone)
+@receiver(post_delete, sender=Milestone)
+def milestone_changed(sender, instance, **kwargs):
+    Team.bump_points_version(course_id=instance.course_id)
+
+
+@receiver(post_save, sender=Milestone)
+def milestone_due_changed(sender, instance, created, **kwargs):
+    if not created:
+        TaskDeadline.refresh(MasterTask.objects.filter(milestone=instance, status__lt=4))
+
+
+@receiver(post_save, sender=Course)
+def course_changed(sender, instance, created, **kwargs):
+    if not created:
+        Team.bump_points_version(course=instance)
+
+
+@receiver(m2m_changed, sender=Developer.team.through)
+def team_membership_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            Team.bump_points_version(pk=instance.pk)
+            Course.bump_roster_version(pk=instance.course_id)
+    elif action == "pre_clear":
+        # post_clear does not report which teams the developer was removed from
+        instance._cleared_team_ids = list(instance.team.values_list("pk", flat=True))
+    elif action == "post_clear":
+        team_ids = getattr(instance, "_cleared_team_ids", [])
+        Team.bump_points_version(pk__in=team_ids)
+        Course.bump_roster_version(team__pk__in=team_ids)
+    elif action in ("post_add", "post_remove"):
+        Team.bump_points_version(pk__in=pk_set)
+        Course.bump_roster_version(team__pk__in=pk_set)
+
+
+# Writes that change a course roster (tasks.roster.CourseRoster) bump
+# Course.roster_version, so cached rosters of the course miss.
+
+@receiver(post_save, sender=Team)
+@receiver(post_delete, sender=Team)
+def team_changed(sender, instance, **kwargs):
+    Course.bump_roster_version(pk=instance.course_id)
+
+
+@receiver(post_save, sender=DeveloperCourse)
+@receiver(post_delete, sender=DeveloperCourse)
+def enrolment_changed(sender, instance, **kwargs):
+    Course.bump_roster_version(pk=instance.course_id)
+
+
+@receiver(post_save, sender=Developer)
+@receiver(pre_delete, sender=Developer)
+def developer_changed(sender, instance, **kwargs):
+    Course.bump_roster_version(team__developer=instance)
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, update_fields=None, **kwargs):
+    # Logins save last_login only
+    if update_fields is not None and set(update_fields) <= {"last_login", "password"}:
+        return
+    Course.bump_roster_version(team__developer__user=instance)
+
+
+# Search documents of single writes; bulk writers of MasterTaskLog call
+# SearchDocument.index_logs themselves. Task revisions are indexed by
+# MasterTask.set_current_task.
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, **kwargs):
+    SearchDocument.index_comments([instance])
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    SearchDocument.objects.filter(kind='comment', object_id=instance.pk).delete()
+
+
+@receiver(post_save, sender=MasterTaskLog)
+def task_log_saved(sender, instance, **kwargs):
+    SearchDocument.index_logs([instance])
@@ -0,0 +1,109 @@
+import datetime
+import json
+import threading
+import zlib
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Q
+
+from tasks.models import MasterTaskLog, SearchDocument, TaskLogArchive
+
+LOG_PAGE_SIZE = 20
+
+_local = threading.local()
+
+
+def _pending(connection, callback):
+    return any(func is callback for _, func, _ in connection.run_on_commit)
+
+
+def write_task_log(entry, using=DEFAULT_DB_ALIAS):
+    """Save a MasterTaskLog, batching the writes of a transaction.
+
+    Inside an atomic block the entry is buffered and all entries of the
+    block are inserted with one bulk_create once it commits; entries of a
+    rolled back block or savepoint are dropped with it. Outside a transaction
+    the entry is saved immediately.
+    """
+    connection = connections[using]
+    if not connection.in_atomic_block:
+        entry.save(using=using)
+        return entry
+
+    buffers = getattr(_local, "buffers", None)
+    if buffers is None:
+        buffers = _local.buffers = {}
+    # One buffer per savepoint level, so rolling a savepoint back also
+    # discards the flush callback holding its entries.
+    key = (using, frozenset(connection.savepoint_ids))
+    callback, entries = buffers.get(key, (None, None))
+    if callback is None or not _pending(connection, callback):
+        for stale in [k for k, (cb, _) in buffers.items() if not _pending(connections[k[0]], cb)]:
+            del buffers[stale]
+        entries = []
+
+        def callback():
+            MasterTaskLog.objects.using(using).bulk_create(entries, batch_size=500)
+            SearchDocument.index_logs(entries)
+
+        transaction.on_commit(callback, using=using)
+        buffers[key] = (callback, entries)
+    entries.append(entry)
+    return entry
+
+
+def encode_cursor(entry):
+    return f"{int(entry.tarih.timestamp() * 1_000_000)}-{entry.pk}"
+
+
+def decode_cursor(cursor):
+    """(tarih, pk) of a cursor from encode_cursor; ValueError if malformed."""
+    micros, _, pk = cursor.partition("-")
+    seconds, micros = divmod(int(micros), 1_000_000)
+    tarih = datetime.datetime.fromtimestamp(seconds, tz=datetime.timezone.utc)
+    return tarih.replace(microsecond=micros), int(pk)
+
+
+def pack_archive(entries):
+    return zlib.compress(json.dumps([
+        [e.pk, e.tarih.isoformat(), e.taskstatus, e.log, e.gizli] for e in entries
+    ], separators=(",", ":")).encode())
+
+
+def unpack_archive(archive):
+    return [
+        MasterTaskLog(
+            pk=pk, mastertask_id=archive.mastertask_id, tarih=datetime.datetime.fromisoformat(tarih),
+            taskstatus=taskstatus, log=log, gizli=gizli,
+        )
+        for pk, tarih, taskstatus, log, gizli in json.loads(zlib.decompress(bytes(archive.entries)))
+    ]
+
+
+def task_log_page(mastertask, cursor=None, limit=LOG_PAGE_SIZE, include_hidden=False):
+    """One page of a task's history, newest first, and the cursor of the next.
+
+    Pages are keyed on (tarih, pk) so appending entries never shifts them.
+    Entries archived for ended courses are merged in, so callers do not need
+    to know where a task's history lives.
+    """
+    hot = MasterTaskLog.objects.filter(mastertask=mastertask)
+    if not include_hidden:
+        hot = hot.filter(gizli=False)
+    position = None
+    if cursor:
+        position = decode_cursor(cursor)
+        hot = hot.filter(Q(tarih__lt=position[0]) | Q(tarih=position[0], pk__lt=position[1]))
+    entries = list(hot.order_by("-tarih", "-pk")[:limit + 1])
+
+    archive = TaskLogArchive.objects.filter(mastertask=mastertask).first()
+    if archive is not None:
+        archived = [
+            e for e in unpack_archive(archive)
+            if (include_hidden or not e.gizli) and (position is None or (e.tarih, e.pk) < position)
+        ]
+        entries = sorted(entries + archived, key=lambda e: (e.tarih, e.pk), reverse=True)[:limit + 1]
+
+    if len(entries) > limit:
+        return entries[:limit], encode_cursor(entries[limit - 1])
+    return entries, None
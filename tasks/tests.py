@@ -1,3 +1,672 @@
-from django.test import TestCase
+import csv
+import datetime
+import io
+import json
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import Permission, User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from tasks import deadlines, notifications, push, views
+from tasks.forms import TaskFeedFilterForm
+from tasks.grading import CourseGrades, TeamPointsModel
+from tasks.listings import task_feed_page, task_listing
+from tasks.roster import CourseRoster, RosterImport, course_roster_cache
+from tasks.search import search_documents
+from tasks.tasklog import task_log_page, write_task_log
+from tasks.views import _cached_team_points_breakdown, team_points_cache
+from tasks.models import Comment, Course, Developer, DeveloperCourse, Lecturer, MasterCourse, MasterTask, MasterTaskLog, Milestone, NotificationPreference, PointsLedger, PushEvent, PushOutbox, PushSubscription, SearchDocument, Task, TaskDeadline, TaskLogArchive, Team
+
+
+class TeamTestCase(TestCase):
+    """A course with one milestone and a team of three developers."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.lecturer = Lecturer.objects.create(user=User.objects.create_user("lecturer", password="pw"))
+        master_course = MasterCourse.objects.create(code="SE 302", name="Software Engineering")
+        cls.course = Course.objects.create(masterCourse=master_course, lecturer=cls.lecturer)
+        cls.today = datetime.date.today()
+        cls.milestone = Milestone.objects.create(
+            course=cls.course, name="M1", description="First", weight=100, due=cls.today + datetime.timedelta(days=7)
+        )
+        cls.team = Team.objects.create(course=cls.course, name="Team 1", supervisor=cls.lecturer)
+        cls.developers = []
+        for i in range(3):
+            user = User.objects.create_user(f"student{i}", password="pw", first_name=f"Student{i}", last_name="Test")
+            developer = Developer.objects.create(user=user)
+            developer.team.add(cls.team)
+            DeveloperCourse.objects.create(developer=developer, course=cls.course)
+            cls.developers.append(developer)
+
+    def setUp(self):
+        # Versions roll back with each test, the caches do not
+        cache.clear()
+        course_roster_cache.clear()
+        team_points_cache.clear()
+
+    def create_task(self, owner=None, difficulty=2, priority=2, status=2, milestone=None):
+        mastertask = MasterTask.objects.create(
+            milestone=milestone or self.milestone, owner=owner or self.developers[0], team=self.team,
+            difficulty=difficulty, status=status,
+        )
+        Task.objects.create(
+            masterTask=mastertask, title=f"Task {mastertask.pk}", description="Do it",
+            promised_date=self.today + datetime.timedelta(days=3), priority=priority,
+        )
+        mastertask.refresh_from_db()
+        return mastertask
+
+
+class PointsLedgerTests(TeamTestCase):
+    def ledger(self, owner):
+        row = PointsLedger.objects.filter(team=self.team, milestone=self.milestone, owner=owner).first()
+        return None if row is None else (row.planned_points, row.accepted_points)
+
+    def test_task_writes_refresh_ledger(self):
+        mastertask = self.create_task(difficulty=2, priority=3)
+        self.assertEqual(self.ledger(self.developers[0]), (6, 0))
+
+        mastertask.status = 5
+        mastertask.difficulty = 1
+        mastertask.save()
+        self.assertEqual(self.ledger(self.developers[0]), (3, 3))
+
+        Task.objects.create(
+            masterTask=mastertask, title="Revised", description="Do it",
+            promised_date=self.today, priority=1, version=2,
+        )
+        self.assertEqual(self.ledger(self.developers[0]), (1, 1))
+
+    def test_moved_task_refreshes_both_rows(self):
+        mastertask = self.create_task()
+        mastertask.owner = self.developers[1]
+        mastertask.save()
+        self.assertIsNone(self.ledger(self.developers[0]))
+        self.assertEqual(self.ledger(self.developers[1]), (4, 0))
+
+    def test_deletes_refresh_ledger(self):
+        kept = self.create_task(priority=1)
+        deleted = self.create_task(priority=3)
+        deleted.delete()
+        self.assertEqual(self.ledger(self.developers[0]), (2, 0))
+
+        kept.delete()
+        self.assertIsNone(self.ledger(self.developers[0]))
+
+    def test_team_delete_leaves_no_ledger_rows(self):
+        self.create_task()
+        self.team.delete()
+        self.assertFalse(PointsLedger.objects.exists())
+
+
+class CourseGradesTests(TeamTestCase):
+    def setUp(self):
+        super().setUp()
+        Milestone.objects.filter(pk=self.milestone.pk).update(weight=40)
+        self.milestone.refresh_from_db()
+        second = Milestone.objects.create(
+            course=self.course, name="M2", description="Second", weight=60, due=self.today + datetime.timedelta(days=14)
+        )
+        other_team = Team.objects.create(course=self.course, name="Team 2", supervisor=self.lecturer)
+        self.developers[2].team.add(other_team)
+        tasks = [
+            (0, self.milestone, 3, 3, 5), (0, second, 2, 1, 5), (1, self.milestone, 1, 2, 5),
+            (1, second, 3, 2, 3), (2, self.milestone, 2, 2, 4), (2, second, 2, 3, 5),
+        ]
+        for owner, milestone, difficulty, priority, status in tasks:
+            self.create_task(
+                owner=self.developers[owner], milestone=milestone, difficulty=difficulty, priority=priority, status=status
+            )
+        MasterTask.objects.create(
+            milestone=second, owner=self.developers[2], team=other_team, difficulty=3, status=5
+        )
+
+    def test_matches_per_object_grades(self):
+        teams = Team.objects.filter(course=self.course).order_by("pk")
+        for from_tasks in (False, True):
+            grades = CourseGrades.for_course(self.course, from_tasks=from_tasks)
+            for team in teams:
+                with self.subTest(team=team.name, from_tasks=from_tasks):
+                    milestones = list(self.course.milestone_set.order_by("pk"))
+                    self.assertEqual(grades.team_scores(team.pk), [team.get_team_points(m) for m in milestones])
+                    for developer in team.developer_set.all():
+                        self.assertEqual(
+                            grades.developer_scores(team.pk, developer.pk),
+                            [developer.get_developer_grade(m, team) for m in milestones],
+                        )
+                        self.assertEqual(grades.project_grade(team.pk, developer.pk), developer.get_project_grade(team.pk))
+
+
+class CurrentRevisionFallbackTests(TeamTestCase):
+    def setUp(self):
+        super().setUp()
+        self.mastertask = self.create_task(difficulty=3, priority=3, status=5)
+        # A row written before the current_* fields existed
+        MasterTask.objects.filter(pk=self.mastertask.pk).update(
+            current_task=None, current_title="", current_priority=None, current_promised_date=None
+        )
+
+    def test_listing_uses_latest_revision(self):
+        row = task_listing(MasterTask.objects.filter(pk=self.mastertask.pk)).get()
+        self.assertEqual(row["points"], 9)
+        self.assertEqual(row["title"], f"Task {self.mastertask.pk}")
+        self.assertEqual(row["promised_date"], self.today + datetime.timedelta(days=3))
+
+    def test_points_model_uses_latest_revision(self):
+        model = TeamPointsModel.build(self.team)
+        self.assertEqual(model.tasks[self.mastertask.pk][4], 3)
+
+
+class CurrentRevisionDeletedTests(TeamTestCase):
+    def setUp(self):
+        super().setUp()
+        self.mastertask = self.create_task(difficulty=2, priority=1, status=5)
+        self.first = self.mastertask.current_task
+        self.second = Task.objects.create(
+            masterTask=self.mastertask, title="Second revision", description="Second revision",
+            priority=3, promised_date=self.today + datetime.timedelta(days=5),
+        )
+        self.mastertask.refresh_from_db()
+
+    def test_falls_back_to_previous_revision(self):
+        self.assertEqual(self.mastertask.current_task, self.second)
+        self.second.delete()
+        self.mastertask.refresh_from_db()
+        self.assertEqual(self.mastertask.current_task, self.first)
+        self.assertEqual(self.mastertask.current_title, self.first.title)
+        self.assertEqual(self.mastertask.current_priority, 1)
+        self.assertEqual(self.mastertask.current_promised_date, self.first.promised_date)
+        self.assertEqual(PointsLedger.objects.get(team=self.team).accepted_points, 2)
+
+    def test_clears_fields_when_no_revision_is_left(self):
+        Task.objects.filter(masterTask=self.mastertask).delete()
+        self.mastertask.refresh_from_db()
+        self.assertIsNone(self.mastertask.current_task)
+        self.assertEqual(self.mastertask.current_title, "")
+        self.assertIsNone(self.mastertask.current_priority)
+        self.assertIsNone(self.mastertask.current_promised_date)
+
+    def test_deleting_an_older_revision_keeps_the_current_one(self):
+        self.first.delete()
+        self.mastertask.refresh_from_db()
+        self.assertEqual(self.mastertask.current_task, self.second)
+        self.assertEqual(self.mastertask.current_priority, 3)
+
+
+class PointsSimulationTests(TeamTestCase):
+    def setUp(self):
+        super().setUp()
+        self.mastertask = self.create_task(difficulty=2, priority=2)
+        self.client.force_login(self.developers[0].user)
+
+    def simulate(self, payload):
+        return self.client.post(
+            reverse("team_points_simulate", args=[self.team.pk]), json.dumps(payload), content_type="application/json"
+        )
+
+    def test_simulates_accepting_a_task(self):
+        response = self.simulate({"accept": [self.mastertask.pk]})
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()["current"]["team_score"], 0)
+        self.assertGreater(response.json()["simulated"]["team_score"], 0)
+
+    def test_malformed_payloads_are_rejected(self):
+        pk = self.mastertask.pk
+        payloads = [
+            {"accept": 5},
+            {"accept": [[pk]]},
+            {"accept": [True]},
+            {"changes": {"task": pk}},
+            {"changes": [pk]},
+            {"changes": [{"task": [pk]}]},
+            {"changes": [{"task": str(pk)}]},
+            {"changes": [{"task": pk, "priority": "3"}]},
+            {"changes": [{"task": pk, "difficulty": [1]}]},
+            {"changes": [{"task": pk, "status": 2.0}]},
+            {"changes": [{"task": pk + 1000}]},
+        ]
+        for payload in payloads:
+            with self.subTest(payload=payload):
+                self.assertEqual(self.simulate(payload).status_code, 400)
+
+
+class TeamPointsCacheTests(TeamTestCase):
+    def names(self):
+        team = Team.objects.select_related("course").get(pk=self.team.pk)
+        return sorted(str(row["developer"]) for row in _cached_team_points_breakdown(team)["developer_rows"])
+
+    def test_renamed_developer_misses_cache(self):
+        self.create_task()
+        self.assertIn("Student0 Test", self.names())
+
+        user = self.developers[0].user
+        user.first_name = "Renamed"
+        user.save()
+        self.assertIn("Renamed Test", self.names())
+
+
+class GradesExportTests(TeamTestCase):
+    def setUp(self):
+        super().setUp()
+        self.create_task(difficulty=3, status=5)
+        self.client.force_login(User.objects.create_user("registrar", password="pw", is_staff=True))
+
+    def export(self, **params):
+        response = self.client.get(reverse("lecturer_grades_export"), params)
+        self.assertEqual(response.status_code, 200)
+        return list(csv.reader(b"".join(response.streaming_content).decode().splitlines()))
+
+    def test_staff_exports_every_course(self):
+        rows = self.export()
+        self.assertEqual(len(rows), 1 + len(self.developers))
+        self.assertEqual(rows[0][:2], ["Course", "Term"])
+
+    def test_students_cannot_export(self):
+        self.client.force_login(self.developers[0].user)
+        response = self.client.get(reverse("lecturer_grades_export"))
+        self.assertEqual(response.status_code, 302)
+
+    def test_ended_course_exports_snapshot_milestones(self):
+        views._save_grade_snapshot(self.course)
+        Course.objects.filter(pk=self.course.pk).update(active=False)
+        # Added after the grades were frozen
+        Milestone.objects.create(course=self.course, name="M2", description="Late", weight=0, due=self.today)
+        rows = self.export(milestones="1")
+        self.assertEqual(rows[0][-3:], ["Milestone 1", "Milestone 1 Team Score", "Milestone 1 Individual Score"])
+        self.assertTrue(all(row[-3] == "M1" for row in rows[1:]))
+
+
+class RejectOverdueTasksTests(TeamTestCase):
+    def rejection_logs(self, mastertask):
+        return MasterTaskLog.objects.filter(mastertask=mastertask, taskstatus="Rejected").count()
+
+    def test_repeated_runs_log_once(self):
+        mastertask = self.create_task()
+        later = self.today + datetime.timedelta(days=30)
+        self.assertEqual(deadlines.reject_overdue_tasks(later), {"milestone": 1, "promised_date": 0})
+        self.assertEqual(deadlines.reject_overdue_tasks(later), {"milestone": 0, "promised_date": 0})
+        self.assertEqual(self.rejection_logs(mastertask), 1)
+
+    def test_task_rejected_by_a_concurrent_run_is_not_logged(self):
+        mastertask = self.create_task()
+        reject = deadlines._reject
+
+        def rejected_in_between(rows):
+            # Another sweeper rejects the task after this one selected it
+            MasterTask.objects.filter(pk=mastertask.pk).update(status=deadlines.REJECTED)
+            return reject(rows)
+
+        with mock.patch.object(deadlines, "_reject", rejected_in_between):
+            counts = deadlines.reject_overdue_tasks(self.today + datetime.timedelta(days=30))
+        self.assertEqual(counts["milestone"], 0)
+        self.assertEqual(self.rejection_logs(mastertask), 0)
+
+    def test_promised_date_falls_back_to_latest_revision(self):
+        mastertask = self.create_task()
+        # A row written before the current_* fields existed
+        MasterTask.objects.filter(pk=mastertask.pk).update(
+            current_task=None, current_title="", current_priority=None, current_promised_date=None
+        )
+        counts = deadlines.reject_overdue_tasks(self.today + datetime.timedelta(days=5))
+        self.assertEqual(counts, {"milestone": 0, "promised_date": 1})
+        self.assertEqual(self.rejection_logs(mastertask), 1)
+
+
+class TaskDeadlineTests(TeamTestCase):
+    def deadline(self, days):
+        return timezone.make_aware(datetime.datetime.combine(self.today + datetime.timedelta(days=days), datetime.time.min))
+
+    def test_earlier_of_promised_date_and_milestone(self):
+        mastertask = self.create_task()
+        self.assertEqual(TaskDeadline.objects.get(mastertask=mastertask).due_at, self.deadline(4))
+
+    def test_promised_date_falls_back_to_latest_revision(self):
+        mastertask = self.create_task()
+        # A row written before the current_* fields existed
+        MasterTask.objects.filter(pk=mastertask.pk).update(
+            current_task=None, current_title="", current_priority=None, current_promised_date=None
+        )
+        TaskDeadline.refresh(MasterTask.objects.filter(pk=mastertask.pk))
+        self.assertEqual(TaskDeadline.objects.get(mastertask=mastertask).due_at, self.deadline(4))
+
+
+class CompleteTaskTests(TeamTestCase):
+    def setUp(self):
+        super().setUp()
+        self.mastertask = self.create_task(status=2)
+        self.client.force_login(self.developers[0].user)
+
+    def complete(self):
+        return self.client.post(
+            reverse("complete_task", args=[self.mastertask.pk]),
+            {"completion_summary": "Done", "completion_file_url": "https://example.com/pr/1", "difficulty": 3},
+        )
+
+    def test_completes_open_task(self):
+        self.complete()
+        self.mastertask.refresh_from_db()
+        self.assertEqual((self.mastertask.status, self.mastertask.difficulty), (3, 3))
+
+    def test_status_changed_by_a_vote_is_kept(self):
+        lock_status = views.lock_status
+
+        def accepted_in_between(mastertask):
+            # A vote reaches quorum after the view read the task
+            MasterTask.objects.filter(pk=mastertask.pk).update(status=5)
+            return lock_status(mastertask)
+
+        with mock.patch.object(views, "lock_status", accepted_in_between):
+            self.complete()
+        self.mastertask.refresh_from_db()
+        self.assertEqual((self.mastertask.status, self.mastertask.difficulty), (5, 2))
+        self.assertFalse(Comment.objects.filter(mastertask=self.mastertask).exists())
+
+
+@override_settings(PUSH_NOTIFICATIONS_ENABLED=True, PUSH_COALESCE_WINDOW=120)
+class NotificationDeliveryTests(TeamTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.developers[0].user
+
+    def notify(self, count, tag="task-vote-1"):
+        for _ in range(count):
+            push.queue_push_notification([self.user], "Task Approved", "Student1 approved Task 1", tag=tag, subject="Task 1")
+
+    def prefer(self, mode):
+        NotificationPreference.objects.create(user=self.user, mode=mode)
+
+    def test_instant_by_default(self):
+        self.notify(1)
+        self.assertFalse(PushEvent.objects.exists())
+        self.assertEqual(PushOutbox.objects.get().user_ids, [self.user.pk])
+
+    def test_grouped_burst_is_one_summary(self):
+        self.prefer(NotificationPreference.GROUPED)
+        self.notify(3)
+        self.assertFalse(PushOutbox.objects.exists())
+        self.assertEqual(notifications.flush_push_events(), 0)
+
+        later = timezone.now() + datetime.timedelta(seconds=121)
+        self.assertEqual(notifications.flush_push_events(now=later), 1)
+        item = PushOutbox.objects.get()
+        self.assertEqual(item.body, "3 new approve votes on Task 1")
+        self.assertEqual(item.tag, "task-vote-1")
+        self.assertFalse(PushEvent.objects.exists())
+
+    def test_digest_waits_for_the_hour(self):
+        self.prefer(NotificationPreference.DIGEST)
+        self.notify(2)
+        self.notify(1, tag="task-edit-1")
+        due_at = PushEvent.objects.values_list("due_at", flat=True).first()
+        self.assertEqual(notifications.flush_push_events(now=due_at - datetime.timedelta(seconds=1)), 0)
+
+        self.assertEqual(notifications.flush_push_events(now=due_at), 1)
+        item = PushOutbox.objects.get()
+        self.assertEqual((item.title, item.tag), ("Task Updates", "digest"))
+        self.assertEqual(item.body, "2 new approve votes on Task 1; Student1 approved Task 1")
+
+
+@override_settings(PUSH_NOTIFICATIONS_ENABLED=True, VAPID_PRIVATE_KEY="test-key", VAPID_CLAIMS_EMAIL="mailto:tps@example.com")
+class PushOutboxTests(TeamTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.developers[0].user
+        self.subscription = PushSubscription.objects.create(
+            user=self.user, endpoint="https://push.example.com/send/1", p256dh="key", auth="auth"
+        )
+        self.item = PushOutbox.objects.create(user_ids=[self.user.pk], title="Task Created", body="Task 1")
+        self.outcomes = []
+        patches = [
+            mock.patch.object(push, "_deliver", lambda *args: self.outcomes.pop(0)),
+            mock.patch.object(push.vapid_headers, "get", return_value={}),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def drain(self):
+        # Run the outbox as if every row were due now
+        PushOutbox.objects.update(next_attempt_at=timezone.now())
+        return push.drain_push_outbox()
+
+    def test_retry_within_backoff_window_keeps_the_notification(self):
+        self.outcomes = [("failed", "HTTP 429", 0.01, None)]
+        self.assertEqual(push.drain_push_outbox(), (0, 1, 0))
+        self.item.refresh_from_db()
+        self.subscription.refresh_from_db()
+        self.assertEqual(self.item.attempts, 1)
+        self.assertGreaterEqual(self.item.next_attempt_at, self.subscription.retry_after)
+
+        # Still backing off: not sent, not counted as an attempt, kept until the backoff ends
+        self.assertEqual(self.drain(), (0, 1, 0))
+        self.item.refresh_from_db()
+        self.assertEqual((self.item.user_ids, self.item.attempts), ([self.user.pk], 1))
+        self.assertEqual(self.item.next_attempt_at, self.subscription.retry_after)
+
+        PushSubscription.objects.update(retry_after=timezone.now())
+        self.outcomes = [("sent", None, 0.01, None)]
+        self.assertEqual(self.drain(), (1, 0, 0))
+        self.assertFalse(PushOutbox.objects.exists())
+        self.assertEqual(self.outcomes, [])
+
+
+class TaskLogWriteTests(TeamTestCase):
+    def setUp(self):
+        super().setUp()
+        self.mastertask = self.create_task()
+        MasterTaskLog.objects.all().delete()
+
+    def log(self, text):
+        return write_task_log(MasterTaskLog(mastertask=self.mastertask, taskstatus="Open", log=text))
+
+    def test_entries_are_inserted_at_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.log("first")
+                self.log("second")
+                self.assertFalse(MasterTaskLog.objects.exists())
+        self.assertEqual(sorted(MasterTaskLog.objects.values_list("log", flat=True)), ["first", "second"])
+        self.assertTrue(SearchDocument.objects.filter(kind="log", body="second").exists())
+
+    def test_rolled_back_savepoint_drops_its_entries(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.log("kept")
+                try:
+                    with transaction.atomic():
+                        self.log("dropped")
+                        raise ValueError
+                except ValueError:
+                    pass
+        self.assertEqual(list(MasterTaskLog.objects.values_list("log", flat=True)), ["kept"])
+
+
+class TaskLogPageTests(TeamTestCase):
+    def setUp(self):
+        super().setUp()
+        self.mastertask = self.create_task()
+        MasterTaskLog.objects.all().delete()
+        start = timezone.now() - datetime.timedelta(days=1)
+        # Two entries share a timestamp, so pages must break ties on the pk
+        for i, minutes in enumerate([0, 1, 2, 2, 3, 4]):
+            entry = MasterTaskLog.objects.create(
+                mastertask=self.mastertask, taskstatus="Open", log=f"entry {i}", gizli=i == 4
+            )
+            MasterTaskLog.objects.filter(pk=entry.pk).update(tarih=start + datetime.timedelta(minutes=minutes))
+
+    def read_all(self, include_hidden=False):
+        logs, cursor = [], None
+        while True:
+            entries, cursor = task_log_page(self.mastertask, cursor, limit=2, include_hidden=include_hidden)
+            logs += [e.log for e in entries]
+            if cursor is None:
+                return logs
+
+    def test_pages_are_newest_first(self):
+        self.assertEqual(self.read_all(), ["entry 5", "entry 3", "entry 2", "entry 1", "entry 0"])
+        self.assertEqual(self.read_all(include_hidden=True)[:2], ["entry 5", "entry 4"])
+
+    def test_archived_history_reads_the_same(self):
+        before = self.read_all(include_hidden=True)
+        Course.objects.filter(pk=self.course.pk).update(active=False)
+        call_command("archive_task_logs", stdout=io.StringIO())
+        self.assertFalse(MasterTaskLog.objects.exists())
+        self.assertEqual(TaskLogArchive.objects.get(mastertask=self.mastertask).count, 6)
+        self.assertEqual(self.read_all(include_hidden=True), before)
+
+        # Entries written after archiving are merged with the archive
+        MasterTaskLog.objects.create(mastertask=self.mastertask, taskstatus="Open", log="reopened")
+        self.assertEqual(self.read_all()[:2], ["reopened", "entry 5"])
+
+
+class TaskFeedTests(TeamTestCase):
+    def test_owner_sort_pages_by_owner(self):
+        # Created in a different order than the owners sort
+        for developer in (self.developers[2], self.developers[0], self.developers[1], self.developers[0], self.developers[2]):
+            self.create_task(owner=developer)
+        mastertasks = MasterTask.objects.filter(team=self.team)
+
+        seen, cursor = [], None
+        while True:
+            rows, cursor = task_feed_page(mastertasks, "owner", cursor, limit=2)
+            seen += [(row["owner_id"], row["pk"]) for row in rows]
+            if cursor is None:
+                break
+        expected = sorted(mastertasks.values_list("owner_id", "pk"), key=lambda row: (row[0], -row[1]))
+        self.assertEqual(seen, expected)
+
+    def test_due_filter_falls_back_to_latest_revision(self):
+        mastertask = self.create_task()
+        self.create_task()
+        # A row written before the current_* fields existed
+        MasterTask.objects.filter(pk=mastertask.pk).update(
+            current_task=None, current_title="", current_priority=None, current_promised_date=None
+        )
+        due = (self.today + datetime.timedelta(days=3)).isoformat()
+        form = TaskFeedFilterForm(self.course, {"due_from": due, "due_to": due})
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(form.filter(MasterTask.objects.all()).count(), 2)
+
+    def test_malformed_cursor(self):
+        with self.assertRaises(ValueError):
+            task_feed_page(MasterTask.objects.all(), "status", "12")
+
+
+class SearchTests(TeamTestCase):
+    def setUp(self):
+        super().setUp()
+        self.mastertask = self.create_task()
+        task = Task.objects.create(
+            masterTask=self.mastertask, title="Login page", description="Build the sign-in form",
+            promised_date=self.today, priority=2,
+        )
+        Comment.objects.create(
+            owner=self.developers[1].user, mastertask=self.mastertask, task=task, body="Does the login page need a captcha?"
+        )
+
+    def search(self, query, course_ids=None):
+        results = search_documents(query, [self.course.pk] if course_ids is None else course_ids)
+        return [(hit["document"].kind, hit["document"].mastertask_id) for hit in results]
+
+    def test_prefix_matches_are_highlighted(self):
+        results = search_documents("log", [self.course.pk])
+        self.assertEqual(
+            sorted((hit["document"].kind, hit["document"].mastertask_id) for hit in results),
+            [("comment", self.mastertask.pk), ("task", self.mastertask.pk)],
+        )
+        task_hit = next(hit for hit in results if hit["document"].kind == "task")
+        self.assertIn("<mark>Login</mark>", task_hit["title"])
+
+    def test_every_term_must_match(self):
+        self.assertEqual(self.search("login captcha"), [("comment", self.mastertask.pk)])
+        self.assertEqual(self.search("login nothing"), [])
+
+    def test_other_courses_are_not_searched(self):
+        other = Course.objects.create(masterCourse=self.course.masterCourse, lecturer=self.lecturer)
+        self.assertEqual(self.search("login", [other.pk]), [])
+
+    def test_query_syntax_is_not_interpreted(self):
+        self.assertEqual(self.search('"sign-in* (form'), [("task", self.mastertask.pk)])
+
+    def test_latest_revision_replaces_the_old_one(self):
+        self.assertEqual(self.search(f"Task {self.mastertask.pk}"), [])
+
+
+class RosterImportTests(TeamTestCase):
+    def setUp(self):
+        super().setUp()
+        # Cached before the import, so reading it afterwards checks the version bump
+        CourseRoster.for_course(self.course)
+
+    def row(self, student_id, team_name="", section=1):
+        return {
+            "student_id": student_id, "team_name": team_name, "first_name": "New", "last_name": student_id,
+            "section": section, "description": "",
+        }
+
+    def roster(self):
+        self.course.refresh_from_db(fields=["roster_version"])
+        return CourseRoster.for_course(self.course)
+
+    def test_manual_import(self):
+        roster_import = RosterImport(self.course, self.lecturer, "avatar.png")
+        roster_import.add([self.row("student0", "Team 2"), self.row("s100", "Team 2")])
+        # A later batch: the last line of a student sets their section
+        roster_import.add([self.row("s101", "Team 1"), self.row("s100", "Team 2", section=3)])
+        roster_import.finish()
+        self.assertEqual((roster_import.users_created, roster_import.teams_created), (2, 1))
+
+        members = {m["username"]: m for m in self.roster().members.values()}
+        self.assertEqual(members["student0"]["team_name"], "Team 1")
+        self.assertEqual(members["s101"]["team_name"], "Team 1")
+        self.assertEqual((members["s100"]["team_name"], members["s100"]["section"]), ("Team 2", 3))
+        user = User.objects.get(username="s100")
+        self.assertTrue(user.check_password("s100"))
+        self.assertTrue(user.groups.filter(name="student").exists())
+
+    def test_random_import_balances_teams(self):
+        roster_import = RosterImport(self.course, self.lecturer, "avatar.png", team_size=3)
+        roster_import.add([self.row(f"s{i}") for i in range(100, 104)] + [self.row("student1")])
+        roster_import.add([self.row(f"s{i}") for i in range(104, 107)] + [self.row("s100")])
+        roster_import.finish()
+
+        teams = {team["name"]: team for team in self.roster().teams}
+        self.assertEqual(sorted(teams), ["Team 1", "Team 2", "Team 3"])
+        self.assertEqual(sorted(len(teams[name]["members"]) for name in ("Team 2", "Team 3")), [3, 4])
+        self.assertEqual(len(teams["Team 1"]["members"]), 3)
+        self.assertEqual(roster_import.students_assigned, 7)
+
+
+class RosterUploadTests(TeamTestCase):
+    def setUp(self):
+        super().setUp()
+        self.lecturer.user.user_permissions.add(
+            *Permission.objects.filter(codename__in=["add_team", "add_developer"])
+        )
+        self.client.force_login(self.lecturer.user)
+
+    def upload(self, content, name="roster.csv"):
+        return self.client.post(reverse("create_team", args=[self.course.pk]), {
+            "mode": "manual", "has_header": "1", "roster_file": SimpleUploadedFile(name, content),
+        })
+
+    def test_csv_upload(self):
+        response = self.upload("Team,Student ID,Name,Surname\nTeam 2,s100,Ayşe,Yılmaz\n".encode("utf-8-sig"))
+        self.assertEqual(response.context["errors"], [])
+        self.assertEqual(User.objects.get(username="s100").first_name, "Ayşe")
+
+    def test_invalid_row_rolls_back_the_upload(self):
+        response = self.upload(b"Team,Student ID,Name,Surname\nTeam 2,s100,New,Student\nTeam 2,s101\n")
+        self.assertEqual(response.context["errors"], ["Line 3: expected 'Team Name, Student ID, Name, Surname'."])
+        self.assertFalse(User.objects.filter(username="s100").exists())
+
+    def test_unreadable_workbook(self):
+        response = self.upload(b"not a zip", name="roster.xlsx")
+        self.assertEqual(response.context["errors"], ["The uploaded file is not a valid .xlsx workbook."])
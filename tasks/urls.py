@@ -8,8 +8,11 @@ urlpatterns = [
     path('updates/', views.update_view, name='view_updates'),
     path('lecturer/', views.lecturer_view, name='lecturer_view'),
     path('lecturer/course/<int:course_id>/', views.lecturer_course_view, name='lecturer_view_course'),
+    path('lecturer/course/<int:course_id>/tasks/', views.lecturer_course_tasks, name='lecturer_course_tasks'),
     path('lecturer/course/<int:course_id>/end/', views.end_course, name='end_course'),
     path('lecturer/course/<int:course_id>/points/', views.lecturer_course_points_view, name='lecturer_course_points'),
+    path('lecturer/grades/export/', views.lecturer_grades_export, name='lecturer_grades_export'),
+    path('lecturer/search/', views.lecturer_search, name='lecturer_search'),
     path('lecturer/team/<int:team_id>/', views.lecturer_team_view, name='lecturer_view_team'),
     path('lecturer/team/<int:team_id>/points/', views.lecturer_team_points_detail, name='lecturer_team_points_detail'),
     path('lecturer/task/<int:task_id>/', views.lecturer_task_view, name='lecturer_view_task'),
@@ -19,6 +22,7 @@ urlpatterns = [
     path('courses/milestone/<int:milestone_id>/grade/', views.lecturer_grade_milestone, name='grade_milestone'),
     path('team/<int:team_id>/', views.team_view, name='team_view'),
     path('team/<int:team_id>/points/', views.team_points_detail, name='team_points_detail'),
+    path('team/<int:team_id>/points/simulate/', views.team_points_simulate, name='team_points_simulate'),
     path('team/<int:team_id>/edit/', views.edit_team, name='edit_team'),
     path('team/create/<int:course_id>/', views.create_team, name='create_team'),
     path('tasks/<int:team_id>/create/', views.create_task, name='create_task'),
@@ -26,6 +30,7 @@ urlpatterns = [
     path('tasks/<int:task_id>/edit/', views.edit_task, name='edit_task'),
     path('tasks/<int:task_id>/complete/', views.complete_task, name='complete_task'),
     path('tasks/<int:task_id>/liked/<int:liked>/', views.like_task, name='like_task'),
+    path('tasks/<int:task_id>/logs/', views.task_logs, name='task_logs'),
     path('accounts/login/', views.tpslogin, name='login'),
     path('accounts/logout/', views.tpslogout, name='logout'),
     path('accounts/profile/', views.profile, name='profile'),
@@ -1,34 +1,48 @@
 import csv
 import json
+import zlib
 from pathlib import Path
 from datetime import datetime
 from django.conf import settings
 from django.contrib.auth import authenticate, login, logout, update_session_auth_hash
-from django.contrib.auth.models import Group, User
+from django.contrib.auth.models import User
 from django.contrib.auth.forms import PasswordChangeForm
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
-from django.contrib.auth.decorators import login_required, permission_required
+from django.urls import reverse
+from django.contrib.auth.decorators import login_required, permission_required, user_passes_test
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import Count
 from django.templatetags.static import static
+from django.utils import timezone
+from django.utils.formats import date_format
+from django.utils.timesince import timeuntil
 from django.views.decorators.http import require_POST, require_GET
 
 from tasks.models import *
 from datetime import datetime  # re-import after wildcard; models.py exports datetime module via *
-from tasks.push import send_push_notification
-from .forms import CommentForm, CourseForm, MasterCourseForm, MilestoneForm, TaskForm, TeamFormStd, EmailChangeForm
+from tasks.caching import VersionedLRUCache
+from tasks.grading import CourseGrades, TeamPointsModel
+from tasks.listings import task_feed_page, task_listing
+from tasks.push import queue_push_notification
+from tasks.roster import CourseRoster, RosterFileError, RosterImport, read_roster_file
+from tasks.search import search_documents
+from tasks.tasklog import task_log_page, write_task_log
+from tasks.voting import VoteResult, cast_vote, get_tally, lock_status, reset_votes
+from .forms import CommentForm, CourseForm, MasterCourseForm, MilestoneForm, TaskForm, TeamFormStd, EmailChangeForm, NotificationPreferenceForm, TaskFeedFilterForm
 
 
 # Create your views here.
 
-def saveLog(mt: MasterTask, message, gizli: bool = False):
+def saveLog(mt: MasterTask, message, gizli: bool = False, status: int = None):
     l = MasterTaskLog()
     l.mastertask = mt
-    l.taskstatus = mt.getStatus()
+    l.taskstatus = MasterTask.STATUS[status-1][1] if status else mt.getStatus()
     l.log = message
     l.gizli = gizli
-    l.save()
+    write_task_log(l)
 
 
 def _task_url(task_id):
@@ -106,11 +120,7 @@ def _developer_default_team(dev: Developer):
 def _has_revision_request(mastertask: MasterTask, task: Task):
     if mastertask.status not in (1, 3):
         return False
-    return Vote.objects.filter(
-        task=task,
-        status=mastertask.status,
-        vote=False
-    ).exists()
+    return get_tally(task, mastertask.status)[1] > 0
 
 
 def _parse_positive_int(value, fallback):
@@ -140,124 +150,135 @@ def _parse_student_section_meta(fields, section_index, description_index, defaul
     return section, description
 
 
-def _parse_manual_team_rows(raw_text, default_section, default_description):
-    rows = []
-    errors = []
-    for line_no, line in enumerate((raw_text or "").splitlines(), start=1):
-        stripped = line.strip()
-        if not stripped:
-            continue
-        fields = [f.strip() for f in stripped.split(",")]
-        if len(fields) < 4:
-            errors.append(f"Line {line_no}: expected 'Team Name, Student ID, Name, Surname'.")
-            continue
-        team_name, student_id, first_name, last_name = fields[:4]
-        if not team_name or not student_id or not first_name or not last_name:
-            errors.append(f"Line {line_no}: all four values must be non-empty.")
-            continue
-        section, description = _parse_student_section_meta(
-            fields, 4, 5, default_section, default_description, line_no, errors
-        )
-        rows.append({
-            "line_no": line_no,
-            "team_name": team_name,
-            "student_id": student_id,
-            "first_name": first_name,
-            "last_name": last_name,
-            "section": section,
-            "description": description,
-        })
-    return rows, errors
+ROSTER_CHUNK_SIZE = 500
+ROSTER_MAX_ERRORS = 100
 
 
-def _parse_random_team_rows(raw_text, default_section, default_description):
-    rows = []
-    errors = []
+def _manual_team_row(fields, line_no, default_section, default_description, errors):
+    if len(fields) < 4:
+        errors.append(f"Line {line_no}: expected 'Team Name, Student ID, Name, Surname'.")
+        return None
+    team_name, student_id, first_name, last_name = fields[:4]
+    if not team_name or not student_id or not first_name or not last_name:
+        errors.append(f"Line {line_no}: all four values must be non-empty.")
+        return None
+    section, description = _parse_student_section_meta(
+        fields, 4, 5, default_section, default_description, line_no, errors
+    )
+    return {
+        "line_no": line_no,
+        "team_name": team_name,
+        "student_id": student_id,
+        "first_name": first_name,
+        "last_name": last_name,
+        "section": section,
+        "description": description,
+    }
+
+
+def _random_team_row(fields, line_no, default_section, default_description, errors):
+    if len(fields) < 3:
+        errors.append(f"Line {line_no}: expected 'Student ID, Name, Surname'.")
+        return None
+    student_id, first_name, last_name = fields[:3]
+    if not student_id or not first_name or not last_name:
+        errors.append(f"Line {line_no}: all three values must be non-empty.")
+        return None
+    section, description = _parse_student_section_meta(
+        fields, 3, 4, default_section, default_description, line_no, errors
+    )
+    return {
+        "line_no": line_no,
+        "student_id": student_id,
+        "first_name": first_name,
+        "last_name": last_name,
+        "section": section,
+        "description": description,
+    }
+
+
+def _pasted_roster_lines(raw_text):
     for line_no, line in enumerate((raw_text or "").splitlines(), start=1):
         stripped = line.strip()
-        if not stripped:
-            continue
-        fields = [f.strip() for f in stripped.split(",")]
-        if len(fields) < 3:
-            errors.append(f"Line {line_no}: expected 'Student ID, Name, Surname'.")
-            continue
-        student_id, first_name, last_name = fields[:3]
-        if not student_id or not first_name or not last_name:
-            errors.append(f"Line {line_no}: all three values must be non-empty.")
-            continue
-        section, description = _parse_student_section_meta(
-            fields, 3, 4, default_section, default_description, line_no, errors
-        )
-        rows.append({
-            "line_no": line_no,
-            "student_id": student_id,
-            "first_name": first_name,
-            "last_name": last_name,
-            "section": section,
-            "description": description,
-        })
-    return rows, errors
+        if stripped:
+            yield line_no, [f.strip() for f in stripped.split(",")]
+
+
+def _roster_row_chunks(lines, parse_row, default_section, default_description, errors):
+    # Valid rows of `lines` in chunks of ROSTER_CHUNK_SIZE. Invalid lines are
+    # reported in `errors`, keeping only the first ROSTER_MAX_ERRORS messages.
+    chunk = []
+    hidden = 0
+    for line_no, fields in lines:
+        row = parse_row(fields, line_no, default_section, default_description, errors)
+        if len(errors) > ROSTER_MAX_ERRORS:
+            hidden += len(errors) - ROSTER_MAX_ERRORS
+            del errors[ROSTER_MAX_ERRORS:]
+        if row is not None:
+            chunk.append(row)
+            if len(chunk) == ROSTER_CHUNK_SIZE:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+    if hidden:
+        errors.append(f"... and {hidden} more errors.")
 
 
 def _course_team_assignments(course: Course):
-    teams = Team.objects.filter(course=course).order_by("name", "pk")
-    enrollment_map = {
-        enrollment.developer_id: enrollment
-        for enrollment in DeveloperCourse.objects.filter(course=course)
-    }
-    team_map = {}
-    for team in teams:
-        developers = list(
-            Developer.objects.filter(team=team).select_related("user").order_by(
-                "user__first_name", "user__last_name", "user__username"
-            )
-        )
-        team_map[team.name] = []
-        for developer in developers:
-            enrollment = enrollment_map.get(developer.pk)
-            team_map[team.name].append({
-                "developer": developer,
-                "section": enrollment.section if enrollment else None,
-                "description": enrollment.description if enrollment else "",
-            })
-    return team_map
+    # Team name -> members (username, name, section, description, ...)
+    return {team["name"]: team["members"] for team in CourseRoster.for_course(course).teams}
 
 
-def _course_section_score_rows(course: Course):
-    teams = list(
-        Team.objects.filter(course=course).prefetch_related("developer_set__user")
-    )
-    team_by_developer = {}
-    for team in teams:
-        for developer in team.developer_set.all():
-            if developer.pk not in team_by_developer:
-                team_by_developer[developer.pk] = team
+def _group_rows_by_section(rows):
+    section_rows = {}
+    for row in rows:
+        section_key = row["section"] if row["section"] is not None else "Unassigned"
+        if section_key not in section_rows:
+            section_rows[section_key] = []
+        section_rows[section_key].append(row)
+    return section_rows
 
-    enrollments = {
-        enrollment.developer_id: enrollment
-        for enrollment in DeveloperCourse.objects.filter(course=course).select_related("developer__user")
-    }
 
-    developer_ids = set(team_by_developer.keys()) | set(enrollments.keys())
-    developers = {
-        developer.pk: developer
-        for developer in Developer.objects.filter(pk__in=developer_ids).select_related("user")
-    }
+def _course_grade_snapshot(course: Course):
+    if course.active:
+        return None
+    return GradeSnapshot.objects.filter(course=course).first()
+
+
+def _course_section_score_rows(course: Course, grades=None):
+    roster = CourseRoster.for_course(course)
+    unassigned = DeveloperCourse.objects.filter(course=course).exclude(developer__team__course=course).values(
+        "developer_id", "developer__user__username", "developer__user__first_name", "developer__user__last_name",
+        "section", "description",
+    )
+    if grades is None:
+        grades = CourseGrades.for_course(course)
 
     rows = []
-    for developer_id in developer_ids:
-        developer = developers[developer_id]
-        enrollment = enrollments.get(developer_id)
-        team = team_by_developer.get(developer_id)
-        score = developer.get_project_grade(team.pk) if team is not None else 0
+    for member in roster.members.values():
+        rows.append({
+            "developer_id": member["developer_id"],
+            "team_id": member["team_id"],
+            "student_id": member["username"],
+            "first_name": member["first_name"],
+            "last_name": member["last_name"],
+            "team_name": member["team_name"],
+            "section": member["section"],
+            "section_description": member["description"],
+            "score": grades.project_grade(member["team_id"], member["developer_id"]),
+        })
+    for enrollment in unassigned:
         rows.append({
-            "student_id": developer.user.username,
-            "first_name": developer.user.first_name,
-            "last_name": developer.user.last_name,
-            "team_name": team.name if team is not None else "",
-            "section": enrollment.section if enrollment is not None else None,
-            "section_description": enrollment.description if enrollment is not None else "",
-            "score": score,
+            "developer_id": enrollment["developer_id"],
+            "team_id": None,
+            "student_id": enrollment["developer__user__username"],
+            "first_name": enrollment["developer__user__first_name"],
+            "last_name": enrollment["developer__user__last_name"],
+            "team_name": "",
+            "section": enrollment["section"],
+            "section_description": enrollment["description"],
+            "score": 0,
         })
 
     rows.sort(
@@ -267,106 +288,127 @@ def _course_section_score_rows(course: Course):
             row["student_id"]
         )
     )
+    return rows, _group_rows_by_section(rows)
 
-    section_rows = {}
-    for row in rows:
-        section_key = row["section"] if row["section"] is not None else "Unassigned"
-        if section_key not in section_rows:
-            section_rows[section_key] = []
-        section_rows[section_key].append(row)
-    return rows, section_rows
-
-
-def _get_or_create_student_developer(student_id, first_name, last_name):
-    user = User.objects.filter(username=student_id).first()
-    if user is None:
-        user = User.objects.create_user(student_id, None, student_id)
-        user.first_name = first_name
-        user.last_name = last_name
-        group, _ = Group.objects.get_or_create(name="student")
-        user.groups.add(group)
-        user.save()
-        developer = Developer.objects.create(user=user, photoURL=_default_avatar_url())
-        return developer
-
-    developer, created = Developer.objects.get_or_create(
-        user=user,
-        defaults={"photoURL": _default_avatar_url()}
+
+def _course_grade_rows(course: Course):
+    snapshot = _course_grade_snapshot(course)
+    if snapshot is not None:
+        return snapshot.data["rows"], CourseGrades.for_snapshot(course, snapshot)
+    grades = CourseGrades.for_course(course)
+    rows, _ = _course_section_score_rows(course, grades)
+    return rows, grades
+
+
+class _Echo:
+    # csv.writer target that hands each formatted line back to the caller
+    def write(self, value):
+        return value
+
+
+def _gzip_stream(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+GRADE_EXPORT_HEADER = [
+    "Section",
+    "Section Description",
+    "Student ID",
+    "Name",
+    "Surname",
+    "Team",
+    "Final Score",
+]
+
+
+def _grade_export_lines(courses, multi_course=False, milestone_columns=0):
+    writer = csv.writer(_Echo())
+    header = list(GRADE_EXPORT_HEADER)
+    if multi_course:
+        header = ["Course", "Term"] + header
+    for i in range(1, milestone_columns + 1):
+        header += [f"Milestone {i}", f"Milestone {i} Team Score", f"Milestone {i} Individual Score"]
+    yield writer.writerow(header)
+
+    for course in courses:
+        rows, grades = _course_grade_rows(course)
+        for row in rows:
+            line = [
+                row["section"] if row["section"] is not None else "",
+                row["section_description"],
+                row["student_id"],
+                row["first_name"],
+                row["last_name"],
+                row["team_name"],
+                row["score"],
+            ]
+            if multi_course:
+                line = [course.masterCourse.compact_code, course.get_term_label()] + line
+            if milestone_columns:
+                team_id = row.get("team_id")
+                team_scores = grades.team_scores(team_id) if team_id is not None else []
+                developer_scores = grades.developer_scores(team_id, row["developer_id"]) if team_id is not None else []
+                for i in range(milestone_columns):
+                    if i < len(grades.milestones):
+                        line += [
+                            grades.milestones[i].name,
+                            team_scores[i] if team_scores else "",
+                            developer_scores[i] if developer_scores else "",
+                        ]
+                    else:
+                        line += ["", "", ""]
+            yield writer.writerow(line)
+
+
+def _grade_export_response(courses, filename, multi_course=False, milestone_columns=0, compress=False):
+    lines = _grade_export_lines(courses, multi_course, milestone_columns)
+    if compress:
+        response = StreamingHttpResponse(_gzip_stream(lines), content_type="application/gzip")
+        filename += ".gz"
+    else:
+        response = StreamingHttpResponse(lines, content_type="text/csv")
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
+def _save_grade_snapshot(course: Course):
+    grades = CourseGrades.for_course(course, from_tasks=True)
+    rows, _ = _course_section_score_rows(course, grades)
+    data = grades.snapshot_data()
+    data["rows"] = rows
+    snapshot, _ = GradeSnapshot.objects.update_or_create(
+        course=course,
+        defaults={"computed_at": timezone.now(), "data": data},
     )
-    if created:
-        return developer
-
-    updated = False
-    if not user.first_name and first_name:
-        user.first_name = first_name
-        updated = True
-    if not user.last_name and last_name:
-        user.last_name = last_name
-        updated = True
-    if updated:
-        user.save(update_fields=["first_name", "last_name"])
-    return developer
-
-
-def _next_default_team_name(existing_team_names, start_no):
-    team_no = start_no
-    while True:
-        team_name = f"Team {team_no}"
-        if team_name not in existing_team_names:
-            return team_name, team_no + 1
-        team_no += 1
-
-
-def _balanced_group_sizes(total_students, target_size):
-    if total_students <= 0:
-        return []
-    if target_size <= 0:
-        target_size = 1
-    if total_students <= target_size:
-        return [total_students]
-
-    group_count = total_students // target_size
-    remainder = total_students % target_size
-
-    if remainder > group_count:
-        group_count += 1
-        base_size = total_students // group_count
-        extra = total_students % group_count
-        return [base_size + 1] * extra + [base_size] * (group_count - extra)
-
-    sizes = [target_size] * group_count
-    for idx in range(remainder):
-        sizes[idx] += 1
-    return sizes
+    return snapshot
 
 
 def _build_team_points_breakdown(team: Team, current_user=None):
-    milestones = list(team.course.milestone_set.all().order_by("due", "pk"))
+    grades = CourseGrades.frozen(team.course) or CourseGrades.for_team(team)
+    milestones = sorted(grades.milestones, key=lambda m: (m.due, m.pk))
     developers = list(
         team.developer_set.select_related("user").order_by(
             "user__first_name", "user__last_name", "user__username"
         )
     )
-    developer_count = len(developers)
-
-    accepted_points_lookup = {}
-    accepted_tasks = MasterTask.objects.filter(
-        team=team,
-        status=5,
-        milestone__in=milestones
-    )
-    for mastertask in accepted_tasks:
-        key = (mastertask.owner_id, mastertask.milestone_id)
-        accepted_points_lookup[key] = accepted_points_lookup.get(key, 0) + mastertask.get_points()
+    planned_points = grades.planned_points(team.pk)
+    team_accepted_points = grades.accepted_points(team.pk)
+    team_scores = grades.team_scores(team.pk)
 
     milestone_rows = []
     overall_planned_points = 0
     overall_accepted_points = 0
     team_weighted_score = 0.0
     for milestone in milestones:
-        total_points = team.get_all_milestone_points(milestone)
-        accepted_points = team.get_all_accepted_points(milestone)
-        team_score = round((accepted_points / total_points) * 100) if total_points > 0 else 0
+        i = grades.index[milestone.pk]
+        total_points = planned_points[i]
+        accepted_points = team_accepted_points[i]
+        team_score = team_scores[i]
         weighted_team_score = team_score * (milestone.weight / 100)
 
         overall_planned_points += total_points
@@ -381,29 +423,24 @@ def _build_team_points_breakdown(team: Team, current_user=None):
         })
 
     overall_team_score = round((overall_accepted_points / overall_planned_points) * 100) if overall_planned_points > 0 else 0
-    team_component = team_weighted_score * (team.course.group_weight / 100)
+    team_component = team_weighted_score * (grades.group_weight / 100)
 
+    developer_averages = grades.developer_averages(team.pk)
     developer_rows = []
     developers_summary = {}
     for developer in developers:
         milestone_scores = []
         milestone_score_map = {}
         individual_weighted_score = 0.0
+        developer_accepted_points = grades.developer_accepted_points(developer.pk)
+        developer_scores = grades.developer_scores(team.pk, developer.pk)
 
         for milestone_row in milestone_rows:
             milestone = milestone_row["milestone"]
-            planned_points_per_developer = (
-                milestone_row["total_points"] / developer_count
-                if developer_count > 0 else 0
-            )
-            accepted_points = accepted_points_lookup.get((developer.pk, milestone.pk), 0)
-
-            if planned_points_per_developer > 0:
-                developer_score = round((accepted_points / planned_points_per_developer) * 100)
-                if developer_score > 100:
-                    developer_score = 100
-            else:
-                developer_score = 0
+            i = grades.index[milestone.pk]
+            planned_points_per_developer = developer_averages[i]
+            accepted_points = developer_accepted_points[i]
+            developer_score = developer_scores[i]
 
             weighted_individual_score = developer_score * (milestone.weight / 100)
             individual_weighted_score += weighted_individual_score
@@ -416,8 +453,8 @@ def _build_team_points_breakdown(team: Team, current_user=None):
             })
             milestone_score_map[milestone.name] = developer_score
 
-        individual_component = individual_weighted_score * (team.course.individual_weight / 100)
-        project_score = round(team_component + individual_component)
+        individual_component = individual_weighted_score * (grades.individual_weight / 100)
+        project_score = grades.project_grade(team.pk, developer.pk)
         row = {
             "developer": developer,
             "milestone_scores": milestone_scores,
@@ -441,35 +478,23 @@ def _build_team_points_breakdown(team: Team, current_user=None):
         "team_component": team_component,
     }
 
-def _reject_overdue_tasks(teams):
-    from datetime import date
-    today = date.today()
-    overdue_tasks = MasterTask.objects.filter(
-        team__in=teams,
-        status__lt=4
-    ).select_related('milestone')
-
-    # Bulk reject tasks whose milestone is past due
-    milestone_overdue = overdue_tasks.filter(milestone__due__lt=today)
-    for mt in milestone_overdue:
-        mt.status = 4
-        mt.save(update_fields=['status'])
-        saveLog(mt, "Task is rejected because milestone is due.")
-
-    # Bulk reject tasks whose promised date is past due
-    from django.db.models import Max, Subquery, OuterRef
-    latest_promised = Task.objects.filter(
-        masterTask=OuterRef('pk')
-    ).order_by('-pk').values('promised_date')[:1]
-
-    promised_overdue = overdue_tasks.annotate(
-        latest_promised_date=Subquery(latest_promised)
-    ).filter(latest_promised_date__lt=today)
-
-    for mt in promised_overdue:
-        mt.status = 4
-        mt.save(update_fields=['status'])
-        saveLog(mt, "Task is rejected because due date has passed.")
+team_points_cache = VersionedLRUCache(getattr(settings, "TEAM_POINTS_CACHE_SIZE", 256))
+
+
+def _cached_team_points_breakdown(team: Team, current_user=None):
+    # Keyed by Team.points_version and, for the developer names and photos
+    # it holds, Course.roster_version; the signals in tasks.signals bump both
+    version = (team.points_version, team.course.roster_version)
+    data = team_points_cache.get(team.pk, version)
+    if data is None:
+        data = _build_team_points_breakdown(team)
+        team_points_cache.put(team.pk, version, data)
+
+    developer_rows = [
+        dict(row, is_current_user=bool(current_user and row["developer"].user_id == current_user.id))
+        for row in data["developer_rows"]
+    ]
+    return dict(data, developer_rows=developer_rows)
 
 
 @login_required
@@ -477,7 +502,6 @@ def index(request):
     # redirect to another page for lecturer!
     try:
         d: Developer = Developer.objects.get(user=request.user)
-        _reject_overdue_tasks(d.team.all())
         default_team = _developer_default_team(d)
         if default_team is not None:
             return redirect('team_view', default_team.pk)
@@ -526,10 +550,10 @@ def team_view(request, team_id):
 
     teams_for_selector = active_teams if active_teams.exists() and t.course.active else all_teams
 
-    points_data = _build_team_points_breakdown(t, current_user=request.user)
+    points_data = _cached_team_points_breakdown(t, current_user=request.user)
     devs = points_data["developers"]
     milestone = t.course.get_current_milestone()
-    task_qs = MasterTask.objects.filter(team=t).order_by("-pk")
+    task_qs = task_listing(MasterTask.objects.filter(team=t).order_by("-pk"))
     task_paginator = Paginator(task_qs, 10)
     tasks_page = task_paginator.get_page(request.GET.get("page"))
 
@@ -566,7 +590,7 @@ def team_points_detail(request, team_id):
             return redirect('team_points_detail', fallback_team.pk)
         return redirect('my_details')
 
-    points_data = _build_team_points_breakdown(t, current_user=request.user)
+    points_data = _cached_team_points_breakdown(t, current_user=request.user)
     context = {
         'page_title': 'Team Points Breakdown',
         'team': t,
@@ -576,11 +600,75 @@ def team_points_detail(request, team_id):
     return render(request, 'tasks/team_points_detail.html', context)
 
 
+SIMULATION_FIELDS = {
+    "status": (1, 2, 3, 4, 5),
+    "difficulty": (1, 2, 3),
+    "priority": (1, 2, 3),
+}
+
+
+def _simulation_int(value, allowed):
+    # JSON true/false would pass as 1/0
+    return isinstance(value, int) and not isinstance(value, bool) and value in allowed
+
+
+def _parse_simulation_changes(data, task_ids):
+    entries = data.get("changes", [])
+    accepted = data.get("accept", [])
+    if not isinstance(entries, list) or not isinstance(accepted, list):
+        return None, "changes and accept must be lists."
+    changes = {}
+    for entry in entries:
+        if not isinstance(entry, dict):
+            return None, "Each change must be an object."
+        task_id = entry.get("task")
+        if not _simulation_int(task_id, task_ids):
+            return None, f"Unknown task: {task_id}"
+        change = changes.setdefault(task_id, {})
+        for field, allowed in SIMULATION_FIELDS.items():
+            if field in entry:
+                if not _simulation_int(entry[field], allowed):
+                    return None, f"Invalid {field} for task {task_id}."
+                change[field] = entry[field]
+    for task_id in accepted:
+        if not _simulation_int(task_id, task_ids):
+            return None, f"Unknown task: {task_id}"
+        changes.setdefault(task_id, {})["status"] = 5
+    return changes, None
+
+
+@login_required
+@require_POST
+def team_points_simulate(request, team_id):
+    t = get_object_or_404(Team.objects.select_related("course"), pk=team_id)
+    is_member = Developer.objects.filter(user=request.user, team=t).exists()
+    is_lecturer = t.course.lecturer is not None and t.course.lecturer.user_id == request.user.id
+    if not is_member and not is_lecturer:
+        return JsonResponse({"error": "Not allowed"}, status=403)
+
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
+    if not isinstance(data, dict):
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
+
+    model = TeamPointsModel.load(t)
+    changes, error = _parse_simulation_changes(data, model.tasks.keys())
+    if error:
+        return JsonResponse({"error": error}, status=400)
+
+    return JsonResponse({
+        "version": model.version,
+        "current": model.evaluate(),
+        "simulated": model.evaluate(changes),
+    })
+
+
 @login_required
 def edit_task(request, task_id):
-    mt: MasterTask = get_object_or_404(MasterTask, pk=task_id)
-    t: Task = Task.objects.all().filter(
-        masterTask=mt).order_by('pk').reverse()[0]
+    mt: MasterTask = get_object_or_404(MasterTask.objects.select_related('current_task'), pk=task_id)
+    t: Task = mt.get_task()
     d: Developer = Developer.objects.get(user=request.user)
     tm = mt.team
     if mt.owner != d:  # return to team view if the owner of the task is not this user
@@ -593,22 +681,22 @@ def edit_task(request, task_id):
     if request.method == 'POST':
         form = TaskForm(request.POST)
         if form.is_valid():
-            task: Task = form.save(commit=False)
-            task.pk = None
-            task.masterTask = mt
-            task.version = t.version + 1
-            task.save()
-
-            devs = Developer.objects.all().filter(team=tm)
-            notify_users = [dev.user for dev in devs if dev != d]
-
-            saveLog(mt, "Task is edited by " + str(d) + ".")
-            send_push_notification(
-                notify_users, 'Task Edited',
-                f'{task.title} was edited by {mt.owner}',
-                url=_task_url(task.masterTask_id), tag=f'task-edit-{mt.pk}'
-            )
-            
+            with transaction.atomic():
+                task: Task = form.save(commit=False)
+                task.pk = None
+                task.masterTask = mt
+                task.version = t.version + 1
+                task.save()
+
+                devs = Developer.objects.all().filter(team=tm)
+                notify_users = [dev.user for dev in devs if dev != d]
+
+                saveLog(mt, "Task is edited by " + str(d) + ".")
+                queue_push_notification(
+                    notify_users, 'Task Edited',
+                    f'{task.title} was edited by {mt.owner}',
+                    url=_task_url(task.masterTask_id), tag=f'task-edit-{mt.pk}', subject=task.title
+                )
 
             return redirect('view_task', task_id)
         else: 
@@ -646,26 +734,26 @@ def create_task(request, team_id):
     if request.method == 'POST':
         form = TaskForm(request.POST)
         if form.is_valid():
-            mastertask = MasterTask()            
-            mastertask.milestone = milestone
-            mastertask.owner = d
-            mastertask.team = t
-            mastertask.save()
-            task:Task = form.save(commit=False)
-            task.masterTask = mastertask 
-            task.save()
-
-            devs = Developer.objects.all().filter(team=t)
-            notify_users = [dev.user for dev in devs if dev != d]
-
-            saveLog(mastertask, "Task is created by " + str(d) + ".")
-            send_push_notification(
-                notify_users, 'New Task Created',
-                f'{task.title} created by {mastertask.owner}',
-                url=_task_url(task.masterTask_id), tag=f'task-create-{mastertask.pk}'
-            )
-            
-            
+            with transaction.atomic():
+                mastertask = MasterTask()            
+                mastertask.milestone = milestone
+                mastertask.owner = d
+                mastertask.team = t
+                mastertask.save()
+                task:Task = form.save(commit=False)
+                task.masterTask = mastertask 
+                task.save()
+
+                devs = Developer.objects.all().filter(team=t)
+                notify_users = [dev.user for dev in devs if dev != d]
+
+                saveLog(mastertask, "Task is created by " + str(d) + ".")
+                queue_push_notification(
+                    notify_users, 'New Task Created',
+                    f'{task.title} created by {mastertask.owner}',
+                    url=_task_url(task.masterTask_id), tag=f'task-create-{mastertask.pk}', subject=task.title
+                )
+
             return redirect('team_view', team_id)
         else:
             context = {
@@ -688,8 +776,8 @@ def create_task(request, team_id):
 
 @login_required 
 def complete_task(request, task_id):
-    mt:MasterTask = get_object_or_404(MasterTask, pk=task_id)
-    t:Task = Task.objects.all().filter(masterTask=mt).order_by('pk').reverse()[0]
+    mt:MasterTask = get_object_or_404(MasterTask.objects.select_related('current_task'), pk=task_id)
+    t:Task = mt.get_task()
     d:Developer = Developer.objects.get(user=request.user)
     tm = mt.team
     if mt.owner != d:
@@ -718,43 +806,47 @@ def complete_task(request, task_id):
     if difficulty_value not in [1, 2, 3]:
         difficulty_value = mt.difficulty
 
-    mt.status = 3
-    mt.difficulty = difficulty_value
-    mt.used_ai = 'used_ai' in request.POST
-    mt.ai_usage = ','.join(request.POST.getlist('ai_usage')) if mt.used_ai else ''
-    mt.completed = datetime.now()
-    mt.save()
-
-    completion_comment = Comment(
-        owner=request.user,
-        mastertask=mt,
-        task=t,
-        body=completion_summary,
-        file_url=completion_file_url,
-        is_completion_update=True
-    )
-    completion_comment.save()
+    with transaction.atomic():
+        # Same row lock as cast_vote; a vote may have moved the task on since it was read
+        if lock_status(mt) != mt.status:
+            return redirect('view_task', task_id)
+        mt.status = 3
+        mt.difficulty = difficulty_value
+        mt.used_ai = 'used_ai' in request.POST
+        mt.ai_usage = ','.join(request.POST.getlist('ai_usage')) if mt.used_ai else ''
+        mt.completed = datetime.now()
+        mt.save(update_fields=['status', 'difficulty', 'used_ai', 'ai_usage', 'completed'])
+
+        completion_comment = Comment(
+            owner=request.user,
+            mastertask=mt,
+            task=t,
+            body=completion_summary,
+            file_url=completion_file_url,
+            is_completion_update=True
+        )
+        completion_comment.save()
 
-    if completion_update_mode:
-        Vote.objects.filter(task=t, status=3).delete()
-        saveLog(mt, "Completion update submitted by " + str(d) + ". Completed-state votes are reset.")
-    else:
-        saveLog(mt, "Task is completed by " + str(d) + ".")
+        if completion_update_mode:
+            reset_votes(t, 3)
+            saveLog(mt, "Completion update submitted by " + str(d) + ". Completed-state votes are reset.")
+        else:
+            saveLog(mt, "Task is completed by " + str(d) + ".")
 
-    devs = Developer.objects.all().filter(team=tm)
-    notify_users = [dev.user for dev in devs if dev != d]
+        devs = Developer.objects.all().filter(team=tm)
+        notify_users = [dev.user for dev in devs if dev != d]
 
-    if completion_update_mode:
-        push_title = 'Completion Update'
-        push_body = f'{t.title} — completion update by {mt.owner}'
-    else:
-        push_title = 'Task Completed'
-        push_body = f'{t.title} completed by {mt.owner}'
+        if completion_update_mode:
+            push_title = 'Completion Update'
+            push_body = f'{t.title} — completion update by {mt.owner}'
+        else:
+            push_title = 'Task Completed'
+            push_body = f'{t.title} completed by {mt.owner}'
 
-    send_push_notification(
-        notify_users, push_title, push_body,
-        url=_task_url(t.masterTask_id), tag=f'task-complete-{mt.pk}'
-    )
+        queue_push_notification(
+            notify_users, push_title, push_body,
+            url=_task_url(t.masterTask_id), tag=f'task-complete-{mt.pk}', subject=t.title
+        )
 
     return redirect('view_task', task_id)
 
@@ -776,7 +868,7 @@ def edit_team(request, team_id):
             tnew.pk = t.pk
             tnew.supervisor = t.supervisor
             tnew.course = t.course
-            tnew.save()
+            tnew.save(update_fields=['name', 'github'])
             return redirect('team_view', team_id)
     else:
         form = TeamFormStd(instance=t)
@@ -797,42 +889,43 @@ def like_task(request,task_id, liked):
     
     if mt.owner == d:
         return redirect('team_view', mt.team.pk)
-    try:
-        # if like object exists, toggle like
-        like = Like.objects.get(owner=d, mastertask=mt)
-        if liked == 1 and like.liked:
-            like.delete() 
-            saveLog(mt, "Like removed by "+ str(d) + ".", True)
-        elif liked == 0 and not like.liked:
-            like.delete() 
-            saveLog(mt, "Dislike removed by "+ str(d) + ".", True)
-        elif liked == 1 and not like.liked:
-            like.liked = True 
-            like.save() 
-            saveLog(mt, "Task liked by "+ str(d) + ".", True)
-        elif liked == 0 and like.liked: 
-            like.liked = False 
+    with transaction.atomic():
+        try:
+            # if like object exists, toggle like
+            like = Like.objects.get(owner=d, mastertask=mt)
+            if liked == 1 and like.liked:
+                like.delete() 
+                saveLog(mt, "Like removed by "+ str(d) + ".", True)
+            elif liked == 0 and not like.liked:
+                like.delete() 
+                saveLog(mt, "Dislike removed by "+ str(d) + ".", True)
+            elif liked == 1 and not like.liked:
+                like.liked = True 
+                like.save() 
+                saveLog(mt, "Task liked by "+ str(d) + ".", True)
+            elif liked == 0 and like.liked: 
+                like.liked = False 
+                like.save() 
+                saveLog(mt, "Task disliked by "+ str(d) + ".", True)
+        except ObjectDoesNotExist:
+            like = Like()
+            like.owner = d 
+            like.mastertask = mt 
+            if liked == 1:
+                like.liked = True 
+                saveLog(mt, "Task liked by "+ str(d) + ".", True)
+            else:
+                like.liked = False 
+                saveLog(mt, "Task disliked by "+ str(d) + ".", True)
             like.save() 
-            saveLog(mt, "Task disliked by "+ str(d) + ".", True)
-    except ObjectDoesNotExist:
-        like = Like()
-        like.owner = d 
-        like.mastertask = mt 
-        if liked == 1:
-            like.liked = True 
-            saveLog(mt, "Task liked by "+ str(d) + ".", True)
-        else:
-            like.liked = False 
-            saveLog(mt, "Task disliked by "+ str(d) + ".", True)
-        like.save() 
     return redirect('view_task', task_id)
 
 
 
 @login_required
 def view_task(request, task_id):
-    mt:MasterTask = get_object_or_404(MasterTask, pk=task_id)
-    t:Task = Task.objects.all().filter(masterTask=mt).order_by('pk').reverse()[0]
+    mt:MasterTask = get_object_or_404(MasterTask.objects.select_related('current_task'), pk=task_id)
+    t:Task = mt.get_task()
     try:
         d:Developer = Developer.objects.get(user=request.user)
     except ObjectDoesNotExist:
@@ -854,81 +947,62 @@ def view_task(request, task_id):
                 comment.owner = request.user
                 comment.mastertask = mt 
                 comment.task = t 
-                if len(Vote.objects.all().filter(task=t).filter(status=mt.status).filter(owner=d)) == 0:
-                    if request.POST['approve'] == "Yes":
-                        comment.approved = True
-                        vote = Vote()
-                        vote.owner = d
-                        vote.task = t
-                        vote.status = mt.status
-                        vote.vote = True
-                        vote.save()
-
-                        saveLog(mt, "Task received an approve vote by "+ str(d) + ".")
-                        send_push_notification(
+                approve = request.POST.get('approve')
+                with transaction.atomic():
+                    result = VoteResult()
+                    if approve in ("Yes", "No"):
+                        result = cast_vote(mt, t, d, approve == "Yes")
+                    if result.voted:
+                        comment.approved = approve == "Yes"
+                        if comment.approved:
+                            saveLog(mt, "Task received an approve vote by "+ str(d) + ".", status=result.status)
+                        else:
+                            saveLog(mt, "Task received a revision request by "+ str(d) + ".", status=result.status)
+                    if result.transition == 2:
+                        saveLog(mt, "All approved. Task is now in open state.")
+                    elif result.transition == 5:
+                        saveLog(mt, "All approved. Task is now accepted!")
+                    comment.save()
+
+                    if result.voted and comment.approved:
+                        queue_push_notification(
                             [task_owner.user], 'Approve Vote',
                             f'{t.title} received an approve vote from {d}',
-                            url=_task_url(t.masterTask_id), tag=f'task-vote-{mt.pk}'
+                            url=_task_url(t.masterTask_id), tag=f'task-vote-{mt.pk}', subject=t.title
                         )
-
-                    elif request.POST['approve'] == "No":
-                        comment.approved = False
-                        vote = Vote()
-                        vote.owner = d
-                        vote.task = t
-                        vote.status = mt.status
-                        vote.vote = False
-                        vote.save()
-
-                        saveLog(mt, "Task received a revision request by "+ str(d) + ".")
-                        send_push_notification(
+                    elif result.voted:
+                        queue_push_notification(
                             [task_owner.user], 'Revision Requested',
                             f'{t.title} received a revision request from {d}',
-                            url=_task_url(t.masterTask_id), tag=f'task-revision-{mt.pk}'
+                            url=_task_url(t.masterTask_id), tag=f'task-revision-{mt.pk}', subject=t.title
+                        )
+                    if result.transition == 2:
+                        queue_push_notification(
+                            [task_owner.user], 'Task is Now Open',
+                            f'{t.title} is now in open state',
+                            url=_task_url(t.masterTask_id), tag=f'task-open-{mt.pk}', subject=t.title
+                        )
+                    elif result.transition == 5:
+                        queue_push_notification(
+                            [task_owner.user], 'Task Accepted',
+                            f'{t.title} has been accepted',
+                            url=_task_url(t.masterTask_id), tag=f'task-accepted-{mt.pk}', subject=t.title
                         )
-                comment.save()
                 return redirect('view_task', task_id)
     
         form = CommentForm()
         comments = Comment.objects.all().filter(mastertask=mt).order_by('date').reverse()
-        voted = len(Vote.objects.all().filter(task=t).filter(status=mt.status).filter(owner=d))
-        v_app = len(Vote.objects.all().filter(task=t).filter(status=mt.status).filter(vote=True))
-        v_den = len(Vote.objects.all().filter(task=t).filter(status=mt.status).filter(vote=False))
-        reopen = False
-        if mt.status == 1 and v_app > (len(mt.team.developer_set.all()) - 1) / 2:
-            mt.status = 2
-            mt.opened = datetime.now()
-            mt.save()
-            
-            saveLog(mt, "All approved. Task is now in open state.")
-            send_push_notification(
-                [task_owner.user], 'Task is Now Open',
-                f'{t.title} is now in open state',
-                url=_task_url(t.masterTask_id), tag=f'task-open-{mt.pk}'
-            )
-            
-        elif mt.status == 3 and v_app > (len(mt.team.developer_set.all()) - 1) / 2:
-            mt.status = 5
-            mt.save()
-
-            saveLog(mt, "All approved. Task is now accepted!")
-            send_push_notification(
-                [task_owner.user], 'Task Accepted',
-                f'{t.title} has been accepted',
-                url=_task_url(t.masterTask_id), tag=f'task-accepted-{mt.pk}'
-            )
-            
-        elif mt.status == 3 and v_den >= (len(mt.team.developer_set.all()) - 1) / 2:
-            reopen = True 
-
-        revision_requested = _has_revision_request(mt, t)
+        voted = int(Vote.objects.filter(task=t, status=mt.status, owner=d).exists())
+        v_app, v_den = get_tally(t, mt.status)
+        reopen = mt.status == 3 and v_den >= (tm.developer_set.count() - 1) / 2
+        revision_requested = mt.status in (1, 3) and v_den > 0
             
         try:
             liked = Like.objects.get(owner = d, mastertask = mt).liked
         except ObjectDoesNotExist:
             liked = None 
 
-        logs = MasterTaskLog.objects.all().filter(mastertask=mt).filter(gizli=False).order_by('tarih').reverse()
+        logs, logs_next = task_log_page(mt)
 
         context = {
             'page_title': 'View Task',
@@ -945,7 +1019,8 @@ def view_task(request, task_id):
             'revision_requested': revision_requested,
             'liked': liked, 
             'comments': comments,
-            'logs' : logs
+            'logs' : logs,
+            'logs_next': logs_next
         }
         return render(request, "tasks/task_view.html", context)
     else : 
@@ -1084,16 +1159,16 @@ def my_teams (request):
     except ObjectDoesNotExist:
         return redirect('my_details')
 
-    teams = d.team.all().order_by('pk')
+    teams = d.team.select_related('course__masterCourse').order_by('pk')
     allowed_avatar_urls = _avatar_url_set()
     default_avatar_url = _default_avatar_url()
     team_members = dict()
     for team in teams:
-        members = list(team.developer_set.all())
-        for member in members:
-            if member.photoURL not in allowed_avatar_urls:
-                member.photoURL = default_avatar_url
-        team_members[team] = members
+        members = CourseRoster.for_course(team.course).team(team.pk)["members"]
+        team_members[team] = [
+            member if member["photo_url"] in allowed_avatar_urls else {**member, "photo_url": default_avatar_url}
+            for member in members
+        ]
 
     return render(request, 'tasks/my_teams.html', {
         'page_title': 'My Teams',
@@ -1145,9 +1220,18 @@ def my_notifications (request):
     except ObjectDoesNotExist:
         return redirect('my_details')
 
+    preference, _ = NotificationPreference.objects.get_or_create(user=request.user)
+    if request.method == 'POST':
+        form = NotificationPreferenceForm(request.POST, instance=preference)
+        if form.is_valid():
+            form.save()
+    else:
+        form = NotificationPreferenceForm(instance=preference)
+
     return render(request, 'tasks/my_notifications.html', {
         'page_title': 'Notifications',
-        'dev': d
+        'dev': d,
+        'form': form
     })
 
 @login_required
@@ -1205,132 +1289,50 @@ def create_team(request, course_id):
         return redirect('lecturer_view')
 
     team_assignments = _course_team_assignments(course)
-    next_team_no = Team.objects.filter(course=course).count() + 1
     errors = []
     success_message = None
 
     if request.method == 'POST':
         mode = request.POST.get("mode", "").strip()
-        existing_team_names = set(Team.objects.filter(course=course).values_list("name", flat=True))
         default_section = _parse_positive_int(request.POST.get("default_section"), 1)
         default_section_description = (request.POST.get("default_section_description") or "").strip()
 
-        if mode == "manual":
-            manual_rows, parse_errors = _parse_manual_team_rows(
-                request.POST.get("manual_list", ""),
-                default_section,
-                default_section_description
-            )
-            errors.extend(parse_errors)
-            if not manual_rows and not errors:
-                errors.append("Please provide at least one manual input line.")
-            created_teams = 0
-            assigned_students = 0
-            team_cache = {}
-
-            if not errors:
-                for row in manual_rows:
-                    team_name = row["team_name"]
-                    team = team_cache.get(team_name)
-                    if team is None:
-                        team = Team.objects.filter(course=course, name=team_name).first()
-                        if team is None:
-                            team = Team.objects.create(
-                                course=course,
-                                name=team_name,
-                                github=None,
-                                supervisor=lecturer
-                            )
-                            existing_team_names.add(team_name)
-                            created_teams += 1
-                        team_cache[team_name] = team
-
-                    developer = _get_or_create_student_developer(
-                        row["student_id"].strip(),
-                        row["first_name"],
-                        row["last_name"]
-                    )
-                    DeveloperCourse.objects.update_or_create(
-                        developer=developer,
-                        course=course,
-                        defaults={
-                            "section": row["section"],
-                            "description": row["description"],
-                        }
-                    )
-
-                    already_assigned = developer.team.filter(course=course).exists()
-                    if already_assigned:
-                        continue
-                    developer.team.add(team)
-                    assigned_students += 1
-
-                success_message = (
-                    f"Manual creation completed. Teams created: {created_teams}. "
-                    f"Students assigned: {assigned_students}."
-                )
+        if mode in ("manual", "random"):
+            upload = request.FILES.get("roster_file")
+            if upload is not None:
+                lines = read_roster_file(upload, skip_header=bool(request.POST.get("has_header")))
+            else:
+                lines = _pasted_roster_lines(request.POST.get(f"{mode}_list", ""))
+            if mode == "manual":
+                parse_row, team_size = _manual_team_row, None
+            else:
+                parse_row, team_size = _random_team_row, _parse_positive_int(request.POST.get("team_size"), 4)
 
-        elif mode == "random":
-            random_rows, parse_errors = _parse_random_team_rows(
-                request.POST.get("random_list", ""),
-                default_section,
-                default_section_description
-            )
-            errors.extend(parse_errors)
-            if not random_rows and not errors:
-                errors.append("Please provide at least one random input line.")
-            team_size = _parse_positive_int(request.POST.get("team_size"), 4)
-            pending_developers = []
-            seen_student_ids = set()
+            # Chunks are imported as they are validated; any error rolls the
+            # whole import back, but the rest of the roster is still checked.
+            roster = RosterImport(course, lecturer, _default_avatar_url(), team_size)
+            row_count = 0
+            try:
+                with transaction.atomic():
+                    for chunk in _roster_row_chunks(
+                        lines, parse_row, default_section, default_section_description, errors
+                    ):
+                        row_count += len(chunk)
+                        if not errors:
+                            roster.add(chunk)
+                    if not row_count and not errors:
+                        errors.append(f"Please provide at least one {mode} input line.")
+                    if errors:
+                        transaction.set_rollback(True)
+                    else:
+                        roster.finish()
+            except RosterFileError as e:
+                errors.append(str(e))
 
             if not errors:
-                for row in random_rows:
-                    student_id = row["student_id"].strip()
-                    if student_id in seen_student_ids:
-                        continue
-                    seen_student_ids.add(student_id)
-                    developer = _get_or_create_student_developer(
-                        student_id,
-                        row["first_name"],
-                        row["last_name"]
-                    )
-                    DeveloperCourse.objects.update_or_create(
-                        developer=developer,
-                        course=course,
-                        defaults={
-                            "section": row["section"],
-                            "description": row["description"],
-                        }
-                    )
-                    if developer.team.filter(course=course).exists():
-                        continue
-                    pending_developers.append(developer)
-
-                from random import shuffle
-                shuffle(pending_developers)
-
-                group_sizes = _balanced_group_sizes(len(pending_developers), team_size)
-                cursor = 0
-                created_teams = 0
-                for group_size in group_sizes:
-                    team_name, next_team_no = _next_default_team_name(existing_team_names, next_team_no)
-                    team = Team.objects.create(
-                        course=course,
-                        name=team_name,
-                        github=None,
-                        supervisor=lecturer
-                    )
-                    existing_team_names.add(team_name)
-                    created_teams += 1
-
-                    for developer in pending_developers[cursor:cursor + group_size]:
-                        developer.team.add(team)
-                    cursor += group_size
-
-                success_message = (
-                    f"Random generation completed. Teams created: {created_teams}. "
-                    f"Students assigned: {len(pending_developers)}."
-                )
+                label = "Manual creation" if mode == "manual" else "Random generation"
+                success_message = f"{label} completed. {roster.summary()}"
+                course.refresh_from_db(fields=["roster_version"])
         else:
             errors.append("Invalid team creation mode.")
 
@@ -1352,22 +1354,98 @@ def lecturer_course_view(request, course_id):
     if course.lecturer_id != lecturer.pk:
         return redirect('lecturer_view')
     milestones = course.milestone_set.all()
-    teams = course.team_set.all()
-    tasks = list()
-    for team in teams:
-        for task in team.mastertask_set.all().order_by('pk').reverse():
-            tasks.append(task)
+    teams = CourseRoster.for_course(course).teams
+    form, tasks_qs = _course_task_feed(course, request.GET)
+    tasks, tasks_next = task_feed_page(tasks_qs, form.get_sort() if form.is_valid() else 'newest')
     context = {
         'page_title': 'Lecturer Course View',
         'course': course,
         'teams': teams,
         'milestones': milestones,
-        'tasks': tasks 
+        'tasks': tasks,
+        'tasks_next': tasks_next,
+        'task_total': tasks_qs.count(),
+        'feed_form': form,
+        'feed_query': request.GET.urlencode(),
     }
 
     return render(request, 'tasks/lecturer_course_view.html', context)
 
 
+def _course_task_feed(course, params):
+    # Filter form bound to the query string and the matching tasks; an
+    # invalid form leaves the feed unfiltered and shows its errors.
+    form = TaskFeedFilterForm(course, params)
+    tasks_qs = MasterTask.objects.filter(team__course=course)
+    if form.is_valid():
+        tasks_qs = form.filter(tasks_qs)
+    return form, tasks_qs
+
+
+@login_required
+@permission_required('tasks.add_team')
+@require_GET
+def lecturer_course_tasks(request, course_id):
+    # JSON pages of the course task feed for the "Load more" button
+    course = get_object_or_404(Course, pk=course_id)
+    lecturer = get_object_or_404(Lecturer, user=request.user)
+    if course.lecturer_id != lecturer.pk:
+        return JsonResponse({"error": "Not allowed"}, status=403)
+
+    form, tasks_qs = _course_task_feed(course, request.GET)
+    if not form.is_valid():
+        return JsonResponse({"error": form.errors.get_json_data()}, status=400)
+    try:
+        tasks, cursor = task_feed_page(tasks_qs, form.get_sort(), cursor=request.GET.get("after"))
+    except ValueError:
+        return JsonResponse({"error": "Invalid cursor"}, status=400)
+    return JsonResponse({
+        "tasks": [
+            {
+                "id": task["pk"],
+                "url": reverse('lecturer_view_task', args=[task["pk"]]),
+                "team": task["team_name"],
+                "owner": task["owner_name"],
+                "title": task["title"],
+                "milestone": task["milestone_name"],
+                "status": task["status"],
+                "status_label": task["status_label"],
+                "promised_date": task["promised_date"].isoformat() if task["promised_date"] else None,
+                "completion": timeuntil(task["completed"], task["opened"]) if task["completed"] and task["opened"] else None,
+                "points": task["points"],
+                "approvals": task["approvals"],
+                "denials": task["denials"],
+                "likes": task["likes"],
+                "dislikes": task["dislikes"],
+            }
+            for task in tasks
+        ],
+        "next": cursor,
+    })
+
+
+@login_required
+@permission_required('tasks.add_team')
+@require_GET
+def lecturer_search(request):
+    # Full-text search over the tasks, comments and logs of the lecturer's courses
+    lecturer = get_object_or_404(Lecturer, user=request.user)
+    courses = Course.objects.filter(lecturer=lecturer).select_related('masterCourse').order_by('-active', '-pk')
+    course_ids = [course.pk for course in courses]
+    selected = request.GET.get('course', '')
+    if selected.isdigit() and int(selected) in course_ids:
+        course_ids = [int(selected)]
+    query = request.GET.get('q', '').strip()
+    context = {
+        'page_title': 'Search',
+        'courses': courses,
+        'selected_course': selected,
+        'query': query,
+        'results': search_documents(query, course_ids) if query else None,
+    }
+    return render(request, 'tasks/lecturer_search.html', context)
+
+
 @login_required
 @permission_required('tasks.add_team')
 def end_course(request, course_id):
@@ -1378,8 +1456,10 @@ def end_course(request, course_id):
     if course.lecturer_id != lecturer.pk:
         return redirect('lecturer_view')
     if course.active:
-        course.active = False
-        course.save(update_fields=['active'])
+        with transaction.atomic():
+            course.active = False
+            course.save(update_fields=['active'])
+            _save_grade_snapshot(course)
     return redirect('lecturer_view_course', course_id)
 
 
@@ -1394,36 +1474,24 @@ def lecturer_course_points_view(request, course_id):
     if course.lecturer_id != lecturer.pk:
         return redirect('lecturer_view')
 
-    rows, section_rows = _course_section_score_rows(course)
-
     if request.GET.get("format") == "csv":
         filename = (
             f"course_points_{course.masterCourse.compact_code}_"
             f"{course.academic_year}_{course.semester}.csv"
         ).replace(" ", "")
-        response = HttpResponse(content_type="text/csv")
-        response["Content-Disposition"] = f'attachment; filename="{filename}"'
-        writer = csv.writer(response)
-        writer.writerow([
-            "Section",
-            "Section Description",
-            "Student ID",
-            "Name",
-            "Surname",
-            "Team",
-            "Final Score",
-        ])
-        for row in rows:
-            writer.writerow([
-                row["section"] if row["section"] is not None else "",
-                row["section_description"],
-                row["student_id"],
-                row["first_name"],
-                row["last_name"],
-                row["team_name"],
-                row["score"],
-            ])
-        return response
+        return _grade_export_response(
+            [course],
+            filename,
+            milestone_columns=course.milestone_set.count() if request.GET.get("milestones") == "1" else 0,
+            compress=request.GET.get("gzip") == "1",
+        )
+
+    snapshot = _course_grade_snapshot(course)
+    if snapshot is not None:
+        rows = snapshot.data["rows"]
+        section_rows = _group_rows_by_section(rows)
+    else:
+        rows, section_rows = _course_section_score_rows(course)
 
     context = {
         "page_title": "Course Points",
@@ -1431,9 +1499,62 @@ def lecturer_course_points_view(request, course_id):
         "section_rows": section_rows,
         "total_students": len(rows),
         "total_sections": len(section_rows),
+        "grade_snapshot": snapshot,
     }
     return render(request, "tasks/course_points_detail.html", context)
 
+
+def _can_export_grades(user):
+    # Staff accounts (e.g. the registrar) hold no lecturer permissions
+    return user.is_staff or user.has_perm('tasks.add_team')
+
+
+def _grade_export_milestone_columns(courses):
+    # Ended courses export the milestones saved in their grade snapshot
+    columns = 0
+    for course in courses.annotate(milestone_count=Count("milestone")):
+        grades = CourseGrades.frozen(course)
+        columns = max(columns, len(grades.milestones) if grades is not None else course.milestone_count)
+    return columns
+
+
+@login_required
+@user_passes_test(_can_export_grades)
+@require_GET
+def lecturer_grades_export(request):
+    # Staff accounts may export every lecturer's courses
+    courses = Course.objects.select_related("masterCourse").order_by(
+        "academic_year", "semester", "masterCourse__code", "pk"
+    )
+    if not request.user.is_staff:
+        lecturer = get_object_or_404(Lecturer, user=request.user)
+        courses = courses.filter(lecturer=lecturer)
+
+    course_id = _parse_positive_int(request.GET.get("course"), None)
+    academic_year = (request.GET.get("academic_year") or "").strip()
+    semester = (request.GET.get("semester") or "").strip()
+    if course_id is not None:
+        courses = courses.filter(pk=course_id)
+    if academic_year:
+        courses = courses.filter(academic_year=academic_year)
+    if semester:
+        courses = courses.filter(semester=semester)
+
+    milestone_columns = 0
+    if request.GET.get("milestones") == "1":
+        milestone_columns = _grade_export_milestone_columns(courses)
+
+    filename = "_".join(
+        ["grades"] + [part for part in (academic_year, semester) if part]
+    ).replace(" ", "") + ".csv"
+    return _grade_export_response(
+        courses.iterator(chunk_size=50),
+        filename,
+        multi_course=True,
+        milestone_columns=milestone_columns,
+        compress=request.GET.get("gzip") == "1",
+    )
+
 @login_required
 @permission_required('tasks.add_team')
 def lecturer_team_view(request, team_id):
@@ -1441,10 +1562,10 @@ def lecturer_team_view(request, team_id):
     lecturer = get_object_or_404(Lecturer, user=request.user)
     if team.course.lecturer_id != lecturer.pk:
         return redirect('lecturer_view')
-    points_data = _build_team_points_breakdown(team, current_user=request.user)
+    points_data = _cached_team_points_breakdown(team, current_user=request.user)
     devs = points_data["developers"]
         
-    tasks = team.mastertask_set.all().order_by('pk').reverse()
+    tasks = list(task_listing(team.mastertask_set.order_by('-pk')))
     context = {
         'page_title': 'Lecturer Team View',
         'team': team,
@@ -1468,7 +1589,7 @@ def lecturer_team_points_detail(request, team_id):
     if team.course.lecturer_id != lecturer.pk:
         return redirect('lecturer_view')
 
-    points_data = _build_team_points_breakdown(team, current_user=request.user)
+    points_data = _cached_team_points_breakdown(team, current_user=request.user)
     context = {
         'page_title': 'Team Points Breakdown',
         'team': team,
@@ -1568,8 +1689,8 @@ def lecturer_edit_milestone(request, milestone_id):
 @login_required
 @permission_required('tasks.add_team')
 def lecturer_task_view(request, task_id):
-    mt:MasterTask = get_object_or_404(MasterTask, pk=task_id)
-    t:Task = Task.objects.all().filter(masterTask=mt).order_by('pk').reverse()[0]
+    mt:MasterTask = get_object_or_404(MasterTask.objects.select_related('current_task'), pk=task_id)
+    t:Task = mt.get_task()
     course = mt.team.course
     lecturer = get_object_or_404(Lecturer, user=request.user)
     if course.lecturer_id != lecturer.pk:
@@ -1586,16 +1707,9 @@ def lecturer_task_view(request, task_id):
             return redirect('lecturer_view_task', task_id)
     form = CommentForm()
     comments = Comment.objects.all().filter(mastertask=mt).order_by('date').reverse()
-    v_app = len(Vote.objects.all().filter(task=t).filter(status=mt.status).filter(vote=True))
-    v_den = len(Vote.objects.all().filter(task=t).filter(status=mt.status).filter(vote=False))
-    if mt.status == 1 and v_app > (len(mt.team.developer_set.all()) - 1) / 2:
-        mt.status = 2
-        mt.save()
-    elif mt.status == 3 and v_app > (len(mt.team.developer_set.all()) - 1) / 2:
-        mt.status = 5
-        mt.save()
+    v_app, v_den = get_tally(t, mt.status)
 
-    logs = MasterTaskLog.objects.all().filter(mastertask=mt).order_by('tarih').reverse()
+    logs, logs_next = task_log_page(mt, include_hidden=True)
 
     context = {
         'page_title': 'Lecturer Task View',
@@ -1607,11 +1721,43 @@ def lecturer_task_view(request, task_id):
         'v_den': v_den,
         'comments': comments,
         'course': course, 
-        'logs': logs 
+        'logs': logs,
+        'logs_next': logs_next
     }
     return render(request, "tasks/lecturer_task_view.html", context)
 
 
+@login_required
+@require_GET
+def task_logs(request, task_id):
+    # Older history entries for the "Load older" button, keyed by the cursor
+    # returned with the previous page.
+    mt: MasterTask = get_object_or_404(MasterTask.objects.select_related('team__course'), pk=task_id)
+    if Developer.objects.filter(user=request.user, team=mt.team).exists():
+        include_hidden = False
+    elif Lecturer.objects.filter(user=request.user, pk=mt.team.course.lecturer_id).exists():
+        include_hidden = True
+    else:
+        return JsonResponse({"error": "Not allowed"}, status=403)
+
+    try:
+        logs, cursor = task_log_page(mt, cursor=request.GET.get("before"), include_hidden=include_hidden)
+    except ValueError:
+        return JsonResponse({"error": "Invalid cursor"}, status=400)
+    return JsonResponse({
+        "logs": [
+            {
+                "id": log.pk,
+                "tarih": date_format(timezone.localtime(log.tarih), "DATETIME_FORMAT"),
+                "taskstatus": log.taskstatus,
+                "log": log.log,
+            }
+            for log in logs
+        ],
+        "next": cursor,
+    })
+
+
 @login_required
 @require_POST
 def push_subscribe(request):
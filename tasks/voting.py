@@ -0,0 +1,83 @@
+from datetime import datetime
+
+from django.db import transaction
+from django.db.models import F
+
+from tasks.models import MasterTask, TaskDeadline, Vote, VoteTally
+
+PROPOSED, OPEN, COMPLETED, ACCEPTED = 1, 2, 3, 5
+
+# Status reached when a majority of the other team members approve
+QUORUM_TRANSITIONS = {
+    PROPOSED: OPEN,
+    COMPLETED: ACCEPTED,
+}
+
+
+class VoteResult:
+    def __init__(self, voted=False, status=None, transition=None):
+        self.voted = voted
+        self.status = status  # status the vote was cast in
+        self.transition = transition  # new status if the vote reached quorum
+
+
+def get_tally(task, status):
+    tally = VoteTally.objects.filter(task=task, status=status).first()
+    if tally is None:
+        return 0, 0
+    return tally.approvals, tally.denials
+
+
+def has_quorum(votes, team_size):
+    return votes > (team_size - 1) / 2
+
+
+def lock_status(mastertask: MasterTask) -> int:
+    """Lock the row of ``mastertask`` and return its current status.
+
+    A no-op UPDATE takes the row lock (or SQLite's write lock) before the
+    status is read. Call it inside transaction.atomic(); status changes made
+    after it are serialized with cast_vote.
+    """
+    locked = MasterTask.objects.filter(pk=mastertask.pk)
+    locked.update(status=F("status"))
+    return locked.values_list("status", flat=True).get()
+
+
+def cast_vote(mastertask: MasterTask, task, developer, approve: bool) -> VoteResult:
+    """Record a vote and apply the quorum transition it triggers, atomically.
+
+    The row lock is taken by lock_status before anything is read, so votes of
+    the same task are serialized. The status change itself is a guarded
+    UPDATE and happens at most once even if the whole team votes at once.
+    """
+    with transaction.atomic():
+        locked = MasterTask.objects.filter(pk=mastertask.pk)
+        status = lock_status(mastertask)
+        mastertask.status = status
+        if Vote.objects.filter(task=task, status=status, owner=developer).exists():
+            return VoteResult()
+
+        Vote.objects.create(task=task, owner=developer, status=status, vote=approve)
+        tally, _ = VoteTally.objects.get_or_create(task=task, status=status)
+        counter = "approvals" if approve else "denials"
+        VoteTally.objects.filter(pk=tally.pk).update(**{counter: F(counter) + 1})
+        tally.refresh_from_db()
+
+        transition = None
+        if status in QUORUM_TRANSITIONS and has_quorum(tally.approvals, mastertask.team.developer_set.count()):
+            changes = {"status": QUORUM_TRANSITIONS[status]}
+            if changes["status"] == OPEN:
+                changes["opened"] = datetime.now()
+            if MasterTask.objects.filter(pk=mastertask.pk, status=status).update(**changes):
+                for field, value in changes.items():
+                    setattr(mastertask, field, value)
+                mastertask.refresh_points_ledger()
+                TaskDeadline.refresh(locked)
+                transition = changes["status"]
+        return VoteResult(voted=True, status=status, transition=transition)
+
+
+def reset_votes(task, status):
+    Vote.objects.filter(task=task, status=status).delete()
+    VoteTally.objects.filter(task=task, status=status).update(approvals=0, denials=0)
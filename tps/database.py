@@ -0,0 +1,91 @@
+"""Database profiles used by settings.DATABASES.
+
+The SQLite profile applies tuned pragmas to every new connection:
+- WAL, so readers no longer block the writer or each other.
+- A busy timeout, so a writer waits for the lock instead of failing
+  with "database is locked".
+- A larger page cache and memory map.
+It also starts transactions with BEGIN IMMEDIATE. A transaction that
+reads and then writes otherwise fails at once when another writer took
+the lock in between, whatever the busy timeout. Each value can be
+overridden from the environment.
+
+The PostgreSQL profile reads its connection from the POSTGRES_*
+variables. By default it keeps a psycopg connection pool per process
+(needs ``psycopg[pool]``); with POSTGRES_POOL=pgbouncer it leaves pooling
+to a PgBouncer in transaction mode instead. ``copy_sqlite_data`` moves an
+existing db.sqlite3 into it.
+"""
+import os
+
+
+def sqlite_pragmas():
+    # Read when settings are loaded, after .env
+    return {
+        "journal_mode": os.environ.get("SQLITE_JOURNAL_MODE", "WAL"),
+        # Milliseconds a connection waits for a lock held by another one
+        "busy_timeout": int(os.environ.get("SQLITE_BUSY_TIMEOUT", "5000")),
+        # NORMAL is durable in WAL mode except for the last commits before a power loss
+        "synchronous": os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL"),
+        "mmap_size": int(os.environ.get("SQLITE_MMAP_SIZE", str(128 * 1024 * 1024))),
+        # Negative values are KiB
+        "cache_size": int(os.environ.get("SQLITE_CACHE_SIZE", "-20000")),
+        "temp_store": os.environ.get("SQLITE_TEMP_STORE", "MEMORY"),
+    }
+
+
+def sqlite_transaction_mode():
+    return os.environ.get("SQLITE_TRANSACTION_MODE", "IMMEDIATE")
+
+
+def sqlite_init_command(pragmas):
+    return ";".join(f"PRAGMA {name}={value}" for name, value in pragmas.items())
+
+
+def sqlite_database(name):
+    pragmas = sqlite_pragmas()
+    return {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": name,
+        # Keep connections, and their page cache and memory map, across requests
+        "CONN_MAX_AGE": int(os.environ.get("DB_CONN_MAX_AGE", "600")),
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": {
+            "init_command": sqlite_init_command(pragmas),
+            "transaction_mode": sqlite_transaction_mode(),
+            "timeout": pragmas["busy_timeout"] / 1000,
+        },
+    }
+
+
+def postgresql_database():
+    pool = os.environ.get("POSTGRES_POOL", "psycopg")
+    options = {}
+    if os.environ.get("POSTGRES_SSLMODE"):
+        options["sslmode"] = os.environ["POSTGRES_SSLMODE"]
+    database = {
+        "ENGINE": "django.db.backends.postgresql",
+        "NAME": os.environ.get("POSTGRES_DB", "tps"),
+        "USER": os.environ.get("POSTGRES_USER", "tps"),
+        "PASSWORD": os.environ.get("POSTGRES_PASSWORD", ""),
+        "HOST": os.environ.get("POSTGRES_HOST", "localhost"),
+        "PORT": os.environ.get("POSTGRES_PORT", "5432"),
+        "CONN_MAX_AGE": int(os.environ.get("DB_CONN_MAX_AGE", "600")),
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": options,
+    }
+    if pool == "psycopg":
+        # Connections go back to the pool after each request, so Django
+        # must not hold on to them itself
+        database["CONN_MAX_AGE"] = 0
+        options["pool"] = {
+            "min_size": int(os.environ.get("POSTGRES_POOL_MIN_SIZE", "2")),
+            "max_size": int(os.environ.get("POSTGRES_POOL_MAX_SIZE", "10")),
+            # Seconds a request waits for a free connection
+            "timeout": float(os.environ.get("POSTGRES_POOL_TIMEOUT", "10")),
+        }
+    elif pool == "pgbouncer":
+        # In transaction mode a named cursor may end up on another server
+        # connection than the one that declared it
+        database["DISABLE_SERVER_SIDE_CURSORS"] = True
+    return database
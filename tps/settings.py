@@ -15,6 +15,8 @@ from pathlib import Path
 
 from dotenv import load_dotenv
 
+from tps.database import postgresql_database, sqlite_database
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -81,12 +83,16 @@ WSGI_APPLICATION = 'tps.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# SQLite with the pragmas and connection reuse of tps.database, or
+# PostgreSQL with DB_ENGINE=postgresql and the POSTGRES_* variables
+if os.environ.get('DB_ENGINE', 'sqlite') == 'postgresql':
+    DATABASES = {
+        'default': postgresql_database(),
+    }
+else:
+    DATABASES = {
+        'default': sqlite_database(BASE_DIR / 'db.sqlite3'),
     }
-}
 
 
 # Password validation
@@ -137,3 +143,14 @@ VAPID_PUBLIC_KEY = os.environ.get('VAPID_PUBLIC_KEY', '')
 VAPID_PRIVATE_KEY = os.environ.get('VAPID_PRIVATE_KEY', '')
 VAPID_CLAIMS_EMAIL = os.environ.get('VAPID_CLAIMS_EMAIL', 'mailto:kaya.oguz@ieu.edu.tr')
 PUSH_NOTIFICATIONS_ENABLED = os.environ.get('PUSH_NOTIFICATIONS_ENABLED', 'False') == 'True'
+# Concurrent deliveries per notification and the HTTP timeout of each, in seconds
+PUSH_MAX_WORKERS = int(os.environ.get('PUSH_MAX_WORKERS', '8'))
+PUSH_TIMEOUT = float(os.environ.get('PUSH_TIMEOUT', '10'))
+# Seconds a burst of notifications on one task is held and grouped into one push
+PUSH_COALESCE_WINDOW = int(os.environ.get('PUSH_COALESCE_WINDOW', '120'))
+
+# Number of team points breakdowns kept in each process' LRU cache
+TEAM_POINTS_CACHE_SIZE = int(os.environ.get('TEAM_POINTS_CACHE_SIZE', '256'))
+
+# Number of course rosters kept in each process' LRU cache
+COURSE_ROSTER_CACHE_SIZE = int(os.environ.get('COURSE_ROSTER_CACHE_SIZE', '128'))